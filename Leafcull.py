@@ -4,111 +4,233 @@ Created on 28 Mar 2011
 @author: Simon Bull
 '''
 
-import collections
+import heapq
+import multiprocessing
 
-def main(adjList):
+def main(adjList, workers=1, statistics=None):
     """The method by which the Leaf algorithm determines which nodes to remove from the dataset.
 
+    As the removal of a node only affects the nodes in its connected component, the graph is split into its connected components, and each
+    one is culled independently. Components of one or two nodes are resolved directly, and larger ones are culled by cull_component (in
+    parallel if more than one worker is used). The result is the same as culling the entire graph at once.
+
+    :param adjList:     An adjacency list representation of the protein similarity graph.
+    :type adjList:      dictionary
+    :param workers:     The number of processes to use when culling the components.
+    :type workers:      int
+    :param statistics:  If not None, the number of components, the size of the largest component and the number of iterations of each
+                        kind performed by cull_component are added to this.
+    :type statistics:   dictionary
+    :returns :          The proteins that should be removed from the dataset, grouped by component in the order that the components first
+                        appear in adjList.
+    :type :             list
+
+    """
+
+    componentRemoveLists = []
+    componentsToCull = []
+    components = connected_components(adjList)
+    if statistics is not None:
+        statistics['components'] = statistics.get('components', 0) + len(components)
+        statistics['largestComponent'] = max([statistics.get('largestComponent', 0)] + [len(i) for i in components])
+    for component in components:
+        if len(component) == 2:
+            # Of a pair of nodes, the one that appears first in adjList is kept.
+            componentRemoveLists.append([component[1]])
+        elif len(component) > 2:
+            # The removals of the larger components are filled in once they have been culled.
+            componentRemoveLists.append(None)
+            componentsToCull.append(dict((i, adjList.get(i, set())) for i in component))
+
+    if workers > 1 and len(componentsToCull) > 1:
+        pool = multiprocessing.Pool(workers)
+        culledComponents = pool.map(cull_component_statistics, componentsToCull)
+        pool.close()
+        pool.join()
+    else:
+        culledComponents = map(cull_component_statistics, componentsToCull)
+    culledComponents = iter(culledComponents)
+    removeList = []
+    for componentRemoveList in componentRemoveLists:
+        if componentRemoveList is None:
+            componentRemoveList, componentStatistics = next(culledComponents)
+            if statistics is not None:
+                for i in componentStatistics:
+                    statistics[i] = statistics.get(i, 0) + componentStatistics[i]
+        removeList.extend(componentRemoveList)
+
+    return removeList
+
+def connected_components(adjList):
+    """Determine the connected components of a graph.
+
     :param adjList: An adjacency list representation of the protein similarity graph.
     :type adjList:  dictionary
-    :returns :      The proteins that should be removed from the dataset.
+    :returns :      The nodes in each connected component. The nodes in each component, and the components themselves, are ordered by the
+                    order that the nodes appear in adjList.
     :type :         list
 
     """
 
+    # Nodes that only appear as the neighbour of another node come after all the nodes in adjList.
+    nodeOrder = dict((node, index) for index, node in enumerate(adjList))
+    for i in adjList:
+        for j in adjList[i]:
+            if not j in nodeOrder:
+                nodeOrder[j] = len(nodeOrder)
+
+    components = []
+    visited = set()
+    for i in nodeOrder:
+        if not i in visited:
+            # Find all nodes reachable from i.
+            visited.add(i)
+            component = [i]
+            toVisit = [i]
+            while toVisit:
+                for j in adjList.get(toVisit.pop(), ()):
+                    if not j in visited:
+                        visited.add(j)
+                        component.append(j)
+                        toVisit.append(j)
+            component.sort(key=nodeOrder.get)
+            components.append(component)
+
+    return components
+
+def cull_component_statistics(adjList):
+    """Cull a connected component, and determine the number of iterations of each kind performed.
+
+    :param adjList: An adjacency list representation of the protein similarity graph.
+    :type adjList:  dictionary
+    :returns :      The proteins that should be removed from the dataset, and the number of iterations of each kind performed.
+    :type :         list, dictionary
+
+    """
+
+    statistics = {}
+    return cull_component(adjList, statistics), statistics
+
+def cull_component(adjList, statistics=None):
+    """The method by which the Leaf algorithm determines which nodes to remove from the dataset.
+
+    The nodes are remapped to integers (in the order that they appear in adjList), and each node's closed neighbourhood (the node and its
+    neighbours) is stored as a set of integers. Wherever there is a choice between equally good nodes, the node that appears first in adjList
+    is chosen, so the removal is deterministic.
+
+    :param adjList:     An adjacency list representation of the protein similarity graph.
+    :type adjList:      dictionary
+    :param statistics:  If not None, the number of clique removals ('cliqueIterations') and NeighbourCull removals
+                        ('neighbourCullIterations') performed are added to this.
+    :type statistics:   dictionary
+    :returns :          The proteins that should be removed from the dataset.
+    :type :             list
+
+    """
+
     removeList = []
+    cliqueIterations = 0
+    neighbourCullIterations = 0
     if not adjList:
         # If the graph supplied is empty (i.e. no redundancy is present)
         return removeList
 
-    # Determine number of neighbours for each node.
-    neighbours = collections.defaultdict(set)
+    # Map the nodes to integers.
+    nodes = list(adjList)
+    nodeIndices = dict((node, index) for index, node in enumerate(nodes))
+    for i in adjList:
+        for j in adjList[i]:
+            if not j in nodeIndices:
+                nodeIndices[j] = len(nodes)
+                nodes.append(j)
+    closedNeighbourhoods = [set([i]) for i in range(len(nodes))]
     for i in adjList:
-        numNeighbours = len(adjList[i])
+        nodeIndex = nodeIndices[i]
+        for j in adjList[i]:
+            closedNeighbourhoods[nodeIndex].add(nodeIndices[j])
+            closedNeighbourhoods[nodeIndices[j]].add(nodeIndex)
+
+    # Determine number of neighbours for each node.
+    degrees = [len(i) - 1 for i in closedNeighbourhoods]
+    neighbours = [set() for i in range(max(degrees) + 1)]
+    for i, numNeighbours in enumerate(degrees):
         neighbours[numNeighbours].add(i)
-    # Fill in the blank keys.
-    for i in set(range(max(neighbours))) - set(neighbours):
-        neighbours[i]  # Defaultdict automatically creates an empty set here.
+    maxNeighbours = len(neighbours) - 1
+
+    # The clique status of each node is only recalculated when its neighbourhood changes (i.e. one of its neighbours is removed). A node
+    # whose neighbours are all connected to one another stays that way as nodes are removed, so the nodes known to be in such a clique are
+    # kept in a heap ordered by their number of neighbours.
+    toCheck = set([i for i in range(len(nodes)) if degrees[i] > 0])
+    inClique = [False] * len(nodes)
+    cliqueHeap = []
+
+    def remove_node(node):
+        # Remove a node from the graph, updating the neighbourhoods and clique status of its neighbours.
+        removeList.append(nodes[node])
+        neighbours[degrees[node]].remove(node)
+        neighbours[0].add(node)
+        degrees[node] = 0
+        for i in closedNeighbourhoods[node]:
+            if i != node:
+                closedNeighbourhoods[i].remove(node)
+                neighbours[degrees[i]].remove(i)
+                degrees[i] -= 1
+                neighbours[degrees[i]].add(i)
+                if inClique[i]:
+                    if degrees[i] > 0:
+                        heapq.heappush(cliqueHeap, (degrees[i], i))
+                else:
+                    toCheck.add(i)
+        closedNeighbourhoods[node] = set([node])
 
     while True:
-        # Determine the maximum number of neighbours.
-        maxNeighbours = max(neighbours)
-        while maxNeighbours > 0 and (not neighbours[maxNeighbours]):
-            del neighbours[maxNeighbours]
-            maxNeighbours -= 1
+        # Find the node with the fewest neighbours (greater than 0) where the neighbours are all connected to one another, and remove its
+        # neighbours. Repeat until there are no such nodes.
+        while True:
+            for i in toCheck:
+                if degrees[i] > 0:
+                    neighbourhood = closedNeighbourhoods[i]
+                    if all(neighbourhood <= closedNeighbourhoods[j] for j in neighbourhood):
+                        inClique[i] = True
+                        heapq.heappush(cliqueHeap, (degrees[i], i))
+            toCheck.clear()
 
-        # If there are no nodes with neighbours then exit.
-        if maxNeighbours == 0:
-            return removeList
+            # Discard heap entries for nodes whose number of neighbours has changed since they were added.
+            while cliqueHeap and (cliqueHeap[0][0] != degrees[cliqueHeap[0][1]]):
+                heapq.heappop(cliqueHeap)
+            if not cliqueHeap:
+                break
 
-        nClique = 1
-        while nClique <= maxNeighbours:
-            nodesOfInterest = neighbours[nClique]  # Get the nodes with nClique neighbours.
-            # For every node of interest see if the neighbours of the node are all neighbours of each other (i.e. a clique).
-            for i in nodesOfInterest:
-                neighboursOfInterest = adjList[i]
-                if neighboursOfInterest.intersection(*[adjList[j].union([j]) for j in neighboursOfInterest]) == neighboursOfInterest:
-                    # i's neighbours are all connected to one another, and therefore i participates in a clique with all of its neighbours where
-                    # it is connected only to nodes in the clique.
-                    toRemove = set(adjList[i])  # Make a duplicate to prevent Set changed size during iteration errors.
-                    removeList.extend(toRemove)  # Mark all the removed nodes as removed.
-                    neighbours[nClique].remove(i)  # Node i no longer has nClique neighbours.
-                    neighbours[0].add(i)  # Node i now has no neighbours.
-                    adjList[i] = set([])  # Update the adjacency list to reflect the fact that i has no neighbours.
-                    neighboursOfRemoved = set([k for j in toRemove for k in adjList[j]])
-                    for j in neighboursOfRemoved:
-                        neighboursRemoved = adjList[j].intersection(toRemove)
-                        numNeighbours = len(adjList[j])
-                        neighbours[numNeighbours].remove(j)
-                        neighbours[numNeighbours - len(neighboursRemoved)].add(j)
-                        adjList[j] -= neighboursRemoved
-                    # Update the adjacency list to reflect the removal of the nodes in toRemove.
-                    for j in toRemove:
-                        numNeighbours = len(adjList[j])
-                        neighbours[numNeighbours].remove(j)
-                        neighbours[0].add(j)
-                        adjList[j] = set([])
-                    nClique = 1
-                    break
-            else:
-                # No clique found.
-                nClique += 1
+            # i's neighbours are all connected to one another, and therefore i participates in a clique with all of its neighbours where
+            # it is connected only to nodes in the clique.
+            numNeighbours, i = heapq.heappop(cliqueHeap)
+            cliqueIterations += 1
+            for j in sorted(closedNeighbourhoods[i] - set([i])):
+                remove_node(j)
 
         ########################################
         # Perform the NeighbourCull operation. #
         ########################################
-        # Re-calculate this, as it may have changed since it was last calculated.
-        maxNeighbours = max(neighbours)
         while maxNeighbours > 0 and (not neighbours[maxNeighbours]):
-            del neighbours[maxNeighbours]
             maxNeighbours -= 1
 
         # If there are no nodes with neighbours then exit.
         if maxNeighbours == 0:
+            if statistics is not None:
+                statistics['cliqueIterations'] = statistics.get('cliqueIterations', 0) + cliqueIterations
+                statistics['neighbourCullIterations'] = statistics.get('neighbourCullIterations', 0) + neighbourCullIterations
             return removeList
 
         # Get the IDs of the nodes with the max number of neighbours.
-        nodesWithMaxNeighbours = list(neighbours[maxNeighbours])
+        nodesWithMaxNeighbours = sorted(neighbours[maxNeighbours])
         # If there is more than one node with the maximum number of neighbours determine which node to remove.
         if len(nodesWithMaxNeighbours) != 1:
-            # Determine the number of neighbours for each node.
-            extendedNeighbourhood = [adjList[x].union([x]) for x in nodesWithMaxNeighbours]
-            extendedNeighbourhood = [set().union(*[adjList[i] for i in a]) for a in extendedNeighbourhood]
-            # Determine the size of each extended neighbourhood, and which nodes have the min size.
-            sizes = [len(x) for x in extendedNeighbourhood]
+            # Determine the size of each extended neighbourhood (the neighbours of the node's neighbours), and which nodes have the min size.
+            sizes = [len(set().union(*[closedNeighbourhoods[i] for i in closedNeighbourhoods[x]])) for x in nodesWithMaxNeighbours]
             minSize = min(sizes)
             toRemove = nodesWithMaxNeighbours[sizes.index(minSize)]
         else:
             toRemove = nodesWithMaxNeighbours[0]
 
-        removeList.append(toRemove)
-        # Update the list of neighbours for each node that toRemove is adjacent to.
-        for i in adjList[toRemove]:
-            numNeighbours = len(adjList[i])
-            neighbours[numNeighbours].remove(i)
-            neighbours[numNeighbours - 1].add(i)
-            adjList[i].remove(toRemove)
-        # Update the adjacency list to reflect the removal of to remove.
-        adjList[toRemove] = set([])
-        neighbours[maxNeighbours].remove(toRemove)
-        neighbours[0].add(toRemove)
\ No newline at end of file
+        remove_node(toRemove)
+        neighbourCullIterations += 1
@@ -0,0 +1,759 @@
+'''
+Benchmarks of the processing, run on seeded synthetic data so that they need neither the PDB, network access nor a BLAST install.
+
+Each benchmark generates its data in a temporary directory, times the processing (keeping the best of a number of repeats), and then runs
+the processing once more while tracing the memory allocated by Python to determine its peak memory use. Memory-mapped files are not traced,
+so the peak memory of the culling mostly reflects the culling itself rather than the size of the stores.
+
+The results can be recorded as a baseline, and later results checked against it. A benchmark has regressed if its throughput has fallen, or
+its peak memory or quality (e.g. the recall of the k-mer search) has worsened, by more than the tolerance. Throughput depends on the
+machine, so the baseline should be recorded on the machine that it is checked on. Usage:
+
+    python benchmarks.py record [benchmark ...] [--scale factor] [--repeats number] [--baseline file] [--blast directory]
+    python benchmarks.py check [benchmark ...] [--scale factor] [--repeats number] [--baseline file] [--blast directory]
+
+The command exits with a non-zero status if any benchmark has regressed, or has no baseline recorded at the same scale to be checked
+against (so a missing baseline fails the check rather than passing it). Some benchmarks also have a ceiling on the memory that they may use
+(e.g. the extraction of the similarities with a memory limit), and exceeding it is a regression whether recording or checking. The scale
+sets the size of the synthetic data, e.g. "python benchmarks.py check spilling --scale 1000 --repeats 1" extracts the similarities from
+about 11 GB of PSI-BLAST output.
+
+The kmer and psiblast benchmarks search the same sequences with the two similarity backends, and report the recall and wall time of each.
+No BLAST install is needed, as the PSI-BLAST backend runs the stand-in executables of the tests unless --blast gives a BLAST+ install, so
+only the timings of the kmer benchmark are meaningful without one.
+'''
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import chainstore
+import generateculledsubsets
+import Leafcull
+import parsePDBmmCIF
+import processPSIoutput
+import updatelocalPDB
+
+# The location of the recorded baseline.
+defaultBaseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'BenchmarkBaseline.json')
+
+# The location of the BLAST+ executables that the PSI-BLAST similarity backend is benchmarked with. These are the stand-ins used by the tests
+# (whose speed says nothing about that of PSI-BLAST), so that no BLAST+ install is needed. Point this at a BLAST+ install to benchmark the
+# real thing.
+blastExecutables = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests', 'fakeblast')
+
+# The amino acids used in the synthetic sequences.
+aminoAcids = 'ACDEFGHIKLMNPQRSTVWY'
+
+# The most memory to hold the pairs in when benchmarking the spilling of the similarities.
+spillMemoryLimit = 2 ** 28
+
+# The items of the _atom_site loop in a typical mmCIF file, and additional items that can be added to it to vary the shape of the loop.
+atomSiteItems = ['group_PDB', 'id', 'type_symbol', 'label_atom_id', 'label_alt_id', 'label_comp_id', 'label_asym_id', 'label_entity_id',
+                 'label_seq_id', 'pdbx_PDB_ins_code', 'Cartn_x', 'Cartn_y', 'Cartn_z', 'occupancy', 'B_iso_or_equiv', 'pdbx_formal_charge',
+                 'auth_seq_id', 'auth_comp_id', 'auth_asym_id', 'auth_atom_id', 'pdbx_PDB_model_num']
+extraAtomSiteItems = ['Cartn_x_esd', 'Cartn_y_esd', 'Cartn_z_esd', 'occupancy_esd', 'B_iso_or_equiv_esd', 'pdbx_auth_alt_id', 'pdbx_tls_group_id',
+                      'pdbx_ncs_dom_id']
+
+# The atoms of each synthetic residue.
+residueAtoms = ['N', 'CA', 'C', 'O', 'CB', 'CG', 'CD', 'CE', 'NZ', 'OG']
+
+def main(action='check', benchmarkNames=None, fileBaseline=defaultBaseline, scale=1.0, repeats=3, tolerance=0.25, seed=0):
+    """Run the benchmarks, and either record the results as the baseline or check them against it.
+
+    :param action:          Either 'record' to record the results as the baseline, or 'check' to check them against it.
+    :type action:           string
+    :param benchmarkNames:  The benchmarks to run (the keys of benchmarks), or None to run them all.
+    :type benchmarkNames:   list
+    :param fileBaseline:    The location of the baseline.
+    :type fileBaseline:     string
+    :param scale:           The factor to scale the size of the synthetic data by.
+    :type scale:            float
+    :param repeats:         The number of times to time each benchmark (the fastest time is used).
+    :type repeats:          int
+    :param tolerance:       The fraction by which a result can be worse than the baseline before it is deemed a regression.
+    :type tolerance:        float
+    :param seed:            The seed for generating the synthetic data.
+    :type seed:             int
+    :returns :              The results of each benchmark (keyed by its name), and a description of each regression found (including each
+                            benchmark checked that has no baseline, and each benchmark that used more memory than its ceiling).
+    :type :                 dictionary, list
+
+    """
+
+    if not action in ['record', 'check']:
+        raise ValueError('Unknown benchmark action ' + action + '.')
+    for i in benchmarkNames or []:
+        if not i in benchmarks:
+            raise ValueError('Unknown benchmark ' + i + '.')
+
+    baseline = {}
+    if os.path.exists(fileBaseline):
+        with open(fileBaseline, 'r') as readBaseline:
+            baseline = json.load(readBaseline)
+
+    results = {}
+    regressions = []
+    for name in benchmarkNames or list(benchmarks):
+        workDir = tempfile.mkdtemp(prefix='PDBbenchmark')
+        try:
+            results[name] = run_benchmark(benchmarks[name], workDir, scale, repeats, random.Random(seed))
+        finally:
+            shutil.rmtree(workDir)
+        report_result(name, results[name])
+        if results[name]['memoryCeiling'] is not None and results[name]['peakMemory'] > results[name]['memoryCeiling']:
+            regressions.append(name + ': peak memory of ' + '%.1f' % (results[name]['peakMemory'] / 2.0 ** 20) + ' MB exceeds the ceiling of ' +
+                               '%.1f' % (results[name]['memoryCeiling'] / 2.0 ** 20) + ' MB')
+        if action == 'check':
+            if name in baseline:
+                regressions.extend(compare_result(name, results[name], baseline[name], tolerance))
+            else:
+                regressions.append(name + ': no baseline recorded in ' + fileBaseline + ' (run "python benchmarks.py record" first)')
+
+    if action == 'record':
+        baseline.update(results)
+        with open(fileBaseline + '.tmp', 'w') as writeBaseline:
+            json.dump(baseline, writeBaseline, indent=1, sort_keys=True)
+        os.replace(fileBaseline + '.tmp', fileBaseline)
+    return results, regressions
+
+def run_benchmark(benchmark, workDir, scale, repeats, randomGenerator):
+    """Run a single benchmark.
+
+    :param benchmark:       The function that sets up the benchmark (see the benchmark_ functions).
+    :type benchmark:        function
+    :param workDir:         The directory to generate the synthetic data in.
+    :type workDir:          string
+    :param scale:           The factor to scale the size of the synthetic data by.
+    :type scale:            float
+    :param repeats:         The number of times to time the benchmark (the fastest time is used).
+    :type repeats:          int
+    :param randomGenerator: The source of randomness for generating the synthetic data.
+    :type randomGenerator:  random.Random
+    :returns :              The scale, number of items processed, unit of the items, throughput (items per second), fastest time, peak memory
+                            (in bytes), the most memory that the benchmark may use (None if it has no ceiling) and any measures of quality
+                            (keyed by their names under 'quality').
+    :type :                 dictionary
+
+    """
+
+    setup = benchmark(workDir, scale, randomGenerator)
+    run, items, unit = setup[:3]
+
+    bestTime = None
+    for i in range(max(repeats, 1)):
+        startTime = time.perf_counter()
+        quality = run()
+        runTime = time.perf_counter() - startTime
+        bestTime = runTime if bestTime is None else min(bestTime, runTime)
+
+    tracemalloc.start()
+    try:
+        run()
+        peakMemory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {'scale' : scale, 'items' : items, 'unit' : unit, 'throughput' : items / bestTime if bestTime > 0 else float(items), 'seconds' : bestTime,
+            'peakMemory' : peakMemory, 'memoryCeiling' : setup[3] if len(setup) > 3 else None, 'quality' : quality or {}}
+
+def report_result(name, result):
+    """Write out the result of a benchmark.
+
+    :param name:    The name of the benchmark.
+    :type name:     string
+    :param result:  The result of the benchmark, as returned by run_benchmark.
+    :type result:   dictionary
+
+    """
+
+    line = (name + ': ' + str(result['items']) + ' ' + result['unit'] + ' in ' + '%.3f' % result['seconds'] + 's (' + '%.1f' % result['throughput'] +
+            ' ' + result['unit'] + '/s), peak memory ' + '%.1f' % (result['peakMemory'] / 2.0 ** 20) + ' MB')
+    if result.get('memoryCeiling') is not None:
+        line += ' (ceiling ' + '%.1f' % (result['memoryCeiling'] / 2.0 ** 20) + ' MB)'
+    for i in sorted(result['quality']):
+        line += ', ' + i + ' ' + '%.4f' % result['quality'][i]
+    sys.stdout.write(line + '\n')
+
+def compare_result(name, result, baselineResult, tolerance):
+    """Compare the result of a benchmark to its baseline.
+
+    :param name:            The name of the benchmark.
+    :type name:             string
+    :param result:          The result of the benchmark, as returned by run_benchmark.
+    :type result:           dictionary
+    :param baselineResult:  The recorded baseline of the benchmark.
+    :type baselineResult:   dictionary
+    :param tolerance:       The fraction by which a result can be worse than the baseline before it is deemed a regression.
+    :type tolerance:        float
+    :returns :              A description of each regression found.
+    :type :                 list
+
+    """
+
+    if result['scale'] != baselineResult['scale']:
+        return [name + ': the baseline was recorded at scale ' + str(baselineResult['scale']) + ', not ' + str(result['scale'])]
+
+    regressions = []
+    if result['throughput'] < baselineResult['throughput'] * (1 - tolerance):
+        regressions.append(name + ': throughput fell from ' + '%.1f' % baselineResult['throughput'] + ' to ' + '%.1f' % result['throughput'] + ' ' +
+                           result['unit'] + '/s')
+    if result['peakMemory'] > baselineResult['peakMemory'] * (1 + tolerance):
+        regressions.append(name + ': peak memory rose from ' + '%.1f' % (baselineResult['peakMemory'] / 2.0 ** 20) + ' to ' +
+                           '%.1f' % (result['peakMemory'] / 2.0 ** 20) + ' MB')
+    for i in sorted(baselineResult['quality']):
+        if result['quality'].get(i, 0.0) < baselineResult['quality'][i] * (1 - tolerance / 10):
+            regressions.append(name + ': ' + i + ' fell from ' + '%.4f' % baselineResult['quality'][i] + ' to ' + '%.4f' % result['quality'].get(i, 0.0))
+    return regressions
+
+##################
+# Synthetic data #
+##################
+def generate_sequence_families(randomGenerator, families, membersPerFamily, minLength, maxLength, mutationRates):
+    """Generate families of sequences, where the members of a family differ from the family's ancestral sequence only by substitutions.
+
+    As no member has an insertion or deletion, the sequence identity of two members of a family is the identity of their ungapped alignment.
+    The sequences of different families are unrelated.
+
+    :param randomGenerator:     The source of randomness.
+    :type randomGenerator:      random.Random
+    :param families:            The number of families.
+    :type families:             int
+    :param membersPerFamily:    The maximum number of members of each family (each family has between one and this many members).
+    :type membersPerFamily:     int
+    :param minLength:           The minimum length of a sequence.
+    :type minLength:            int
+    :param maxLength:           The maximum length of a sequence.
+    :type maxLength:            int
+    :param mutationRates:       The rates of substitution to choose from for each member.
+    :type mutationRates:        list
+    :returns :                  The sequences, and the family of each sequence.
+    :type :                     list, list
+
+    """
+
+    sequences = []
+    familyOfSequence = []
+    for family in range(families):
+        ancestor = [randomGenerator.choice(aminoAcids) for i in range(randomGenerator.randint(minLength, maxLength))]
+        for member in range(randomGenerator.randint(1, membersPerFamily)):
+            mutationRate = randomGenerator.choice(mutationRates)
+            sequences.append(''.join([randomGenerator.choice(aminoAcids) if randomGenerator.random() < mutationRate else i for i in ancestor]))
+            familyOfSequence.append(family)
+    return sequences, familyOfSequence
+
+def generate_mmCIF(fileMmCIF, randomGenerator, entryID, sequences, atomsPerResidue=8, extraColumns=0, models=1,
+                   method='X-RAY DIFFRACTION', resolution=2.0):
+    """Generate a gzipped mmCIF file containing a protein entity for each of a number of sequences (with one chain each).
+
+    :param fileMmCIF:           The location to write the file to.
+    :type fileMmCIF:            string
+    :param randomGenerator:     The source of randomness.
+    :type randomGenerator:      random.Random
+    :param entryID:             The ID of the entry.
+    :type entryID:              string
+    :param sequences:           The sequences of the entities.
+    :type sequences:            list
+    :param atomsPerResidue:     The number of atoms in each residue of the structure (at most the length of residueAtoms).
+    :type atomsPerResidue:      int
+    :param extraColumns:        The number of additional items in the _atom_site loop (at most the length of extraAtomSiteItems).
+    :type extraColumns:         int
+    :param models:              The number of models of the structure (e.g. more than one for an NMR structure).
+    :type models:               int
+    :param method:              The experimental method.
+    :type method:               string
+    :param resolution:          The resolution.
+    :type resolution:           float
+    :returns :                  The number of atom records written.
+    :type :                     int
+
+    """
+
+    lines = ['data_' + entryID, '# ', '_entry.id   ' + entryID, '# ']
+
+    # The entities, with descriptions that need quoting.
+    lines.extend(['loop_', '_entity.id ', '_entity.type ', '_entity.src_method ', '_entity.pdbx_description '])
+    for i in range(len(sequences)):
+        lines.append(str(i + 1) + ' polymer man ' + ("'Protein " + str(i + 1) + "'" if i % 2 else '"Protein ' + str(i + 1) + "'s domain\""))
+    lines.extend(['# ', 'loop_', '_entity_poly.entity_id ', '_entity_poly.type ', '_entity_poly.nstd_linkage ',
+                  '_entity_poly.pdbx_seq_one_letter_code_can ', '_entity_poly.pdbx_strand_id '])
+    for i, sequence in enumerate(sequences):
+        # Sequences are written as multi-line text fields of 80 residues per line, as in the PDB.
+        lines.append(str(i + 1) + " 'polypeptide(L)' no ")
+        lines.append(';' + '\n'.join([sequence[j:j + 80] for j in range(0, len(sequence), 80)]))
+        lines.append(';')
+        lines.append(chr(65 + i % 26) + ' ')
+
+    # The source organisms and external database references.
+    lines.extend(['# ', 'loop_', '_entity_src_gen.entity_id ', '_entity_src_gen.pdbx_gene_src_scientific_name '])
+    lines.extend([str(i + 1) + " 'Homo sapiens' " for i in range(len(sequences))])
+    lines.extend(['# ', 'loop_', '_struct_ref.id ', '_struct_ref.db_name ', '_struct_ref.db_code ', '_struct_ref.entity_id '])
+    lines.extend([str(i + 1) + ' UNP P' + '%05d' % randomGenerator.randrange(100000) + ' ' + str(i + 1) for i in range(len(sequences))])
+
+    # The experimental method and refinement statistics.
+    lines.extend(['# ', '_exptl.entry_id   ' + entryID, "_exptl.method   '" + method + "' ", '# ',
+                  '_refine.entry_id   ' + entryID, '_refine.ls_d_res_high   ' + str(resolution), '_refine.ls_R_factor_obs   0.2',
+                  '_refine.ls_R_factor_R_free   0.25', '# '])
+
+    # The atoms.
+    lines.append('loop_')
+    lines.extend(['_atom_site.' + i + ' ' for i in atomSiteItems + extraAtomSiteItems[:extraColumns]])
+    atomsWritten = 0
+    for model in range(1, models + 1):
+        for i, sequence in enumerate(sequences):
+            chain = chr(65 + i % 26)
+            for residue in range(1, len(sequence) + 1):
+                for atom in residueAtoms[:atomsPerResidue]:
+                    atomsWritten += 1
+                    lines.append('ATOM ' + str(atomsWritten) + ' ' + atom[0] + ' ' + atom + ' . ALA ' + chain + ' ' + str(i + 1) + ' ' + str(residue) +
+                                 ' ? ' + ' '.join(['%.3f' % randomGenerator.uniform(-50.0, 50.0) for j in range(3)]) + ' 1.00 ' +
+                                 '%.2f' % randomGenerator.uniform(5.0, 80.0) + ' ? ' + str(residue) + ' ALA ' + chain + ' ' + atom + ' ' +
+                                 str(model) + ' ?' * extraColumns + ' ')
+    lines.append('# ')
+
+    with gzip.open(fileMmCIF, 'wt') as writeMmCIF:
+        writeMmCIF.write('\n'.join(lines) + '\n')
+    return atomsWritten
+
+def generate_PSI_output(filePSIOutput, randomGenerator, queries, groups, hitsPerQuery, iterations=2):
+    """Generate the tabular output of PSI-BLASTing a number of queries, in the format requested by updatelocalPDB.sequence_BLAST.
+
+    :param filePSIOutput:   The location to write the output to.
+    :type filePSIOutput:    string
+    :param randomGenerator: The source of randomness.
+    :type randomGenerator:  random.Random
+    :param queries:         The sequence groupings that were BLASTed.
+    :type queries:          list
+    :param groups:          The sequence groupings that were BLASTed against.
+    :type groups:           list
+    :param hitsPerQuery:    The number of hits of each query in each iteration.
+    :type hitsPerQuery:     int
+    :param iterations:      The number of iterations of PSI-BLAST run for each query.
+    :type iterations:       int
+    :returns :              The number of hit lines written.
+    :type :                 int
+
+    """
+
+    linesWritten = 0
+    writeOutput = open(filePSIOutput, 'w')
+    for query in queries:
+        hits = randomGenerator.sample(groups, min(hitsPerQuery, len(groups)))
+        for iteration in range(1, iterations + 1):
+            writeOutput.write('# PSIBLAST 2.2.28+\n# Iteration: ' + str(iteration) + '\n# Query: ' + query + '\n# Database: TempDB\n' +
+                              '# Fields: query id, subject id, % identity, alignment length, evalue\n# ' + str(len(hits)) + ' hits found\n')
+            for hit in hits:
+                writeOutput.write(query + '\t' + hit + '\t' + '%.2f' % randomGenerator.uniform(15.0, 100.0) + '\t' +
+                                  str(randomGenerator.randint(10, 500)) + '\t' + '%.0e' % (10.0 ** randomGenerator.uniform(-80.0, 1.0)) + '\n')
+            linesWritten += len(hits)
+    writeOutput.write('# BLAST processed ' + str(len(queries)) + ' queries\n')
+    writeOutput.close()
+    return linesWritten
+
+def generate_similarity_graph(randomGenerator, numberOfNodes, density, numberOfCliques, cliqueSize):
+    """Generate a similarity graph made up of random edges and planted cliques (as families of near-identical sequences form).
+
+    :param randomGenerator: The source of randomness.
+    :type randomGenerator:  random.Random
+    :param numberOfNodes:   The number of nodes (numbered from 0).
+    :type numberOfNodes:    int
+    :param density:         The fraction of the pairs of nodes that are joined by a random edge.
+    :type density:          float
+    :param numberOfCliques: The number of cliques to plant in the graph.
+    :type numberOfCliques:  int
+    :param cliqueSize:      The maximum number of nodes in a clique (each clique has between two and this many nodes).
+    :type cliqueSize:       int
+    :returns :              An adjacency list representation of the graph (nodes without any edges are not included).
+    :type :                 dictionary
+
+    """
+
+    adjList = {}
+    numberOfEdges = int(density * numberOfNodes * (numberOfNodes - 1) / 2)
+    edges = [tuple(randomGenerator.sample(range(numberOfNodes), 2)) for i in range(numberOfEdges)]
+    for i in range(numberOfCliques):
+        members = randomGenerator.sample(range(numberOfNodes), randomGenerator.randint(2, min(cliqueSize, numberOfNodes)))
+        edges.extend([(j, k) for j in members for k in members if j < k])
+    for nodeA, nodeB in edges:
+        adjList.setdefault(nodeA, set()).add(nodeB)
+        adjList.setdefault(nodeB, set()).add(nodeA)
+    return dict((i, adjList[i]) for i in sorted(adjList))
+
+def group_name(index):
+    """Determine the name of a synthetic sequence grouping, in the same form as the names of real ones.
+
+    :param index:   The index of the sequence grouping.
+    :type index:    int
+    :returns :      The name of the sequence grouping.
+    :type :         string
+
+    """
+
+    return hashlib.sha1(str(index).encode('ascii')).hexdigest()[:16]
+
+##################
+# The benchmarks #
+##################
+def benchmark_parsing(workDir, scale, randomGenerator):
+    """Benchmark the parsing of mmCIF files of a range of sizes and loop shapes.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit.
+    :type :     function, int, string
+
+    """
+
+    mmCIFFiles = []
+    atoms = 0
+    for i in range(max(1, int(20 * scale))):
+        sequences = generate_sequence_families(randomGenerator, randomGenerator.randint(1, 4), 1, 50, 400, [0.0])[0]
+        models = 5 if i % 5 == 4 else 1  # Every fifth entry is a multi-model (NMR) structure.
+        mmCIFFiles.append(workDir + '/' + '%04d' % i + '.cif.gz')
+        atoms += generate_mmCIF(mmCIFFiles[-1], randomGenerator, '%04d' % i, sequences, randomGenerator.randint(4, len(residueAtoms)),
+                                i % (len(extraAtomSiteItems) + 1), models, 'SOLUTION NMR' if models > 1 else 'X-RAY DIFFRACTION')
+
+    def run():
+        for i in mmCIFFiles:
+            parsePDBmmCIF.main(i)
+
+    return run, atoms, 'atoms'
+
+def benchmark_similarity_extraction(workDir, scale, randomGenerator):
+    """Benchmark the extraction of the similarities from PSI-BLAST output.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit.
+    :type :     function, int, string
+
+    """
+
+    groups = [group_name(i) for i in range(max(2, int(5000 * scale)))]
+    queries = groups[:max(1, int(1000 * scale))]
+    hitsPerQuery = 100
+    lines = generate_PSI_output(workDir + '/PSIoutput.txt', randomGenerator, queries, groups, hitsPerQuery)
+
+    def run():
+        processPSIoutput.main(workDir + '/PSIoutput.txt', workDir + '/Similarity.tsv')
+
+    return run, lines, 'hits'
+
+def benchmark_similarity_spilling(workDir, scale, randomGenerator):
+    """Benchmark the extraction of the similarities from PSI-BLAST output when there is not enough memory to hold them all.
+
+    The output is about 11 MB per unit of scale (so a scale of 1000 generates about 11 GB), with up to 100000 sequence groupings (about the
+    number of representative sequences in the PDB). Beyond that, the number of hits of each query grows instead. The memory used to hold the
+    pairs is limited to a tenth of the pairs, up to spillMemoryLimit.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit, and the most memory that the
+                extraction may use.
+    :type :     function, int, string, int
+
+    """
+
+    groups = [group_name(i) for i in range(min(100000, max(2, int(5000 * scale))))]
+    queries = groups[:min(len(groups), max(1, int(1000 * scale)))]
+    hitsPerQuery = min(len(groups), max(100, int(100000 * scale) // len(queries)))
+    lines = generate_PSI_output(workDir + '/PSIoutput.txt', randomGenerator, queries, groups, hitsPerQuery)
+    memoryLimit = min(spillMemoryLimit, len(queries) * hitsPerQuery * processPSIoutput.bytesPerPair // 10)
+
+    def run():
+        processPSIoutput.main(workDir + '/PSIoutput.txt', workDir + '/Similarity.tsv', memoryLimit=memoryLimit)
+
+    return run, lines, 'hits', memory_ceiling(memoryLimit, len(groups))
+
+def memory_ceiling(memoryLimit, numberOfGroups):
+    """Determine the most memory that extracting the similarities with a memory limit should use.
+
+    The memory limit only covers the pairs held in memory, so the ceiling also allows for sorting the pairs when they are spilled, the index
+    of the sequence groupings, and the read buffers of the spilled runs that are merged.
+
+    :param memoryLimit:     The memory limit of the extraction.
+    :type memoryLimit:      int
+    :param numberOfGroups:  The number of sequence groupings.
+    :type numberOfGroups:   int
+    :returns :              The most memory (in bytes) that the extraction should use.
+    :type :                 int
+
+    """
+
+    return 2 * memoryLimit + numberOfGroups * 200 + 2 ** 24
+
+def benchmark_leafcull(workDir, scale, randomGenerator):
+    """Benchmark the Leaf algorithm on a sparse graph with planted cliques.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit.
+    :type :     function, int, string
+
+    """
+
+    numberOfNodes = max(2, int(20000 * scale))
+    adjList = generate_similarity_graph(randomGenerator, numberOfNodes, 2.0 / numberOfNodes, max(1, numberOfNodes // 20), 12)
+
+    def run():
+        Leafcull.main(adjList)
+
+    return run, numberOfNodes, 'nodes'
+
+def benchmark_culling(workDir, scale, randomGenerator):
+    """Benchmark the generation of every culled subset from a synthetic chain store and similarity graph.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit.
+    :type :     function, int, string
+
+    """
+
+    edges = generate_culling_stores(workDir, scale, randomGenerator)
+
+    def run():
+        generateculledsubsets.main(workDir, 1, 1, force=True)
+
+    return run, edges, 'similarities'
+
+def benchmark_identity_rebuild(workDir, scale, randomGenerator):
+    """Benchmark culling every subset of the default subset specification with the similarity graph rebuilt from scratch for each sequence
+    identity (the way the graphs were built before they were extended from one sequence identity to the next), so that every similarity at
+    or above the sequence identity is examined for each subset.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit.
+    :type :     function, int, string
+
+    """
+
+    generate_culling_stores(workDir, scale, randomGenerator)
+    subsetGroups = culling_subset_groups(workDir)
+
+    def run():
+        cull_subset_groups(subsetGroups, False)
+
+    return run, sum([len(i[1]) for i in subsetGroups]), 'subsets'
+
+def benchmark_identity_extension(workDir, scale, randomGenerator):
+    """Benchmark culling every subset of the default subset specification with the similarity graph of each sequence identity extended from
+    that of the next highest (as generateculledsubsets.write_subsets does), so that each similarity is only examined once for each group of
+    subsets, on the same data as benchmark_identity_rebuild.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit. The function returns the fraction
+                of the subsets that are the same as when the graphs are rebuilt for each sequence identity (which should always be 1).
+    :type :     function, int, string
+
+    """
+
+    generate_culling_stores(workDir, scale, randomGenerator)
+    subsetGroups = culling_subset_groups(workDir)
+    rebuiltSubsets = cull_subset_groups(subsetGroups, False)
+
+    def run():
+        extendedSubsets = cull_subset_groups(subsetGroups, True)
+        return {'agreement' : sum([i == j for i, j in zip(extendedSubsets, rebuiltSubsets)]) / float(len(rebuiltSubsets))}
+
+    return run, len(rebuiltSubsets), 'subsets'
+
+def culling_subset_groups(workDir):
+    """Load the chain and similarity stores written by generate_culling_stores, and determine the subsets of the default subset specification.
+
+    :param workDir: The directory containing the stores.
+    :type workDir:  string
+    :returns :      The chains eligible for culling, and the sequence identities to cull them at (from highest to lowest), for each group of
+                    subsets that share the same filter predicates.
+    :type :         list
+
+    """
+
+    generateculledsubsets.set_culling_data(workDir + '/ChainStore.bin', workDir + '/Similarity.bin')
+    chainTable = generateculledsubsets.cullingData[0]
+    identitiesOfPredicates = {}
+    for predicates, seqIdentity, outputName in generateculledsubsets.expand_subset_spec(generateculledsubsets.defaultSubsetSpec):
+        identitiesOfPredicates.setdefault(predicates, []).append(seqIdentity)
+
+    subsetGroups = []
+    for predicates in sorted(identitiesOfPredicates):
+        toCull = generateculledsubsets.groups_from_mask(chainTable, generateculledsubsets.filter_mask(chainTable, predicates))
+        subsetGroups.append((toCull, sorted(identitiesOfPredicates[predicates], reverse=True)))
+    return subsetGroups
+
+def cull_subset_groups(subsetGroups, extendGraphs):
+    """Cull every subset in groups of subsets.
+
+    :param subsetGroups:    The groups of subsets, as returned by culling_subset_groups.
+    :type subsetGroups:     list
+    :param extendGraphs:    Whether to extend the similarity graph of each sequence identity from that of the one before it (True), or to
+                            build it from scratch (False).
+    :type extendGraphs:     boolean
+    :returns :              The chains kept in each subset.
+    :type :                 list
+
+    """
+
+    similarities = generateculledsubsets.cullingData[1]
+    subsetsCulled = []
+    for toCull, seqIdentities in subsetGroups:
+        graph = {'adjList' : {}, 'edges' : 0, 'eligibleEdges' : 0} if extendGraphs else None
+        for seqIdentity in seqIdentities:
+            subsetsCulled.append(generateculledsubsets.cull_at_identity(toCull, similarities, seqIdentity, graph=graph))
+    return subsetsCulled
+
+def generate_culling_stores(workDir, scale, randomGenerator):
+    """Write a synthetic chain store (ChainStore.bin) and similarity store (Similarity.bin) to cull.
+
+    :param workDir:         The directory to write the stores to.
+    :type workDir:          string
+    :param scale:           The factor to scale the size of the synthetic data by.
+    :type scale:            float
+    :param randomGenerator: The source of randomness.
+    :type randomGenerator:  random.Random
+    :returns :              The number of similarities written.
+    :type :                 int
+
+    """
+
+    # Write the chains, with a range of qualities and some sequence groupings shared by multiple chains.
+    numberOfGroups = max(2, int(4000 * scale))
+    sequences = generate_sequence_families(randomGenerator, numberOfGroups, 1, 30, 300, [0.0])[0]
+    chainWriter = chainstore.open_writer(workDir + '/ChainStore.bin')
+    for i in range(numberOfGroups * 3 // 2):
+        sequence = sequences[i % numberOfGroups]
+        experimentalType = 'XRAY' if randomGenerator.random() < 0.9 else 'NMR'
+        chainstore.add_chain(chainWriter, '%04dA' % i + '\t' + str(len(sequence)) + '\t' + experimentalType + '\t' +
+                             '%.2f' % randomGenerator.uniform(0.8, 4.0) + '\t' + '%.3f' % randomGenerator.uniform(0.1, 0.4) + '\t' +
+                             '%.3f' % randomGenerator.uniform(0.1, 0.4) + '\t' + ('yes' if randomGenerator.random() < 0.02 else 'no') +
+                             "\tSynthetic protein\t<UNP P00000>\t[Homo sapiens]", sequence)
+    chainstore.close_writer(chainWriter)
+    groups = [chainstore.sequence_group(i) for i in sequences]
+
+    # Write the similarities between the sequence groupings, and convert them to the similarity store.
+    adjList = generate_similarity_graph(randomGenerator, numberOfGroups, 4.0 / numberOfGroups, max(1, numberOfGroups // 20), 12)
+    writeSimilarity = open(workDir + '/Similarity.tsv', 'w')
+    writeSimilarity.write('Group1\tGroup2\tSimilarity\n')
+    edges = 0
+    for nodeA in adjList:
+        for nodeB in sorted(adjList[nodeA]):
+            if nodeA < nodeB:
+                writeSimilarity.write(groups[nodeA] + '\t' + groups[nodeB] + '\t' + '%.2f' % randomGenerator.uniform(15.0, 100.0) + '\n')
+                edges += 1
+    writeSimilarity.close()
+    processPSIoutput.merge([workDir + '/Similarity.tsv'], set(groups), None, fileEdges=workDir + '/Similarity.bin',
+                           groupOrder=[chainstore.group_id(chainstore.load(workDir + '/ChainStore.bin'), i) for i in range(numberOfGroups)])
+    return edges
+
+def benchmark_kmer_search(workDir, scale, randomGenerator):
+    """Benchmark the speed and recall of the k-mer similarity backend on families of related sequences.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit. The function returns the
+                recall of the pairs of sequences at or above 70% identity, and the recall of the pairs that the PSI-BLAST backend finds at or
+                above 70% identity on the same sequences (see benchmark_psiblast_search).
+    :type :     function, int, string
+
+    """
+
+    sequences, truePairs = generate_search_data(workDir, scale, randomGenerator)
+    psiblastPairs = search_pairs(workDir, 'psiblast', 70.0)
+
+    def run():
+        pairsFound = search_pairs(workDir, 'kmer', 70.0)
+        return {'recall' : len(truePairs & pairsFound) / float(len(truePairs)) if truePairs else 1.0,
+                'recallOfPSIBLAST' : len(psiblastPairs & pairsFound) / float(len(psiblastPairs)) if psiblastPairs else 1.0}
+
+    return run, len(sequences), 'sequences'
+
+def benchmark_psiblast_search(workDir, scale, randomGenerator):
+    """Benchmark the speed and recall of the PSI-BLAST similarity backend on the same sequences as benchmark_kmer_search.
+
+    The BLAST+ executables in blastExecutables are used, which are the stand-ins used by the tests unless a BLAST+ install is given.
+
+    :returns :  The function that runs the benchmark, the number of items that it processes and their unit. The function returns the
+                recall of the pairs of sequences at or above 70% identity.
+    :type :     function, int, string
+
+    """
+
+    sequences, truePairs = generate_search_data(workDir, scale, randomGenerator)
+
+    def run():
+        pairsFound = search_pairs(workDir, 'psiblast', 70.0)
+        return {'recall' : len(truePairs & pairsFound) / float(len(truePairs)) if truePairs else 1.0}
+
+    return run, len(sequences), 'sequences'
+
+def generate_search_data(workDir, scale, randomGenerator):
+    """Write families of related sequences to search for similarities (ReprChains.fasta).
+
+    :param workDir:         The directory to write the sequences to.
+    :type workDir:          string
+    :param scale:           The factor to scale the number of sequences by.
+    :type scale:            float
+    :param randomGenerator: The source of randomness.
+    :type randomGenerator:  random.Random
+    :returns :              The sequences, and the pairs of sequence groupings at or above 70% identity.
+    :type :                 list, set
+
+    """
+
+    sequences, familyOfSequence = generate_sequence_families(randomGenerator, max(1, int(100 * scale)), 6, 80, 400,
+                                                             [0.0, 0.02, 0.05, 0.1, 0.2, 0.3, 0.5])
+    writeFasta = open(workDir + '/ReprChains.fasta', 'w')
+    for i, sequence in enumerate(sequences):
+        writeFasta.write('>' + group_name(i) + '\n' + sequence + '\n')
+    writeFasta.close()
+
+    # The only pairs at or above 70% identity are members of the same family, whose identity is that of their ungapped alignment.
+    truePairs = set([])
+    for i in range(len(sequences)):
+        for j in range(i + 1, len(sequences)):
+            if familyOfSequence[i] == familyOfSequence[j]:
+                matches = sum([k == l for k, l in zip(sequences[i], sequences[j])])
+                if 100.0 * matches / len(sequences[i]) >= 70.0:
+                    truePairs.add(tuple(sorted([group_name(i), group_name(j)])))
+    return sequences, truePairs
+
+def search_pairs(workDir, similarityBackend, minIdentity):
+    """Search all the sequences written by generate_search_data against each other with one of the similarity backends of updatelocalPDB.
+
+    :param workDir:             The directory containing the sequences.
+    :type workDir:              string
+    :param similarityBackend:   The similarity backend to search with.
+    :type similarityBackend:    string
+    :param minIdentity:         The minimum sequence identity of the pairs to return.
+    :type minIdentity:          float
+    :returns :                  The pairs of sequence groupings found at or above minIdentity.
+    :type :                     set
+
+    """
+
+    # Remove the results of any previous search, as the PSI-BLAST backend reuses them.
+    if os.path.exists(workDir + '/ResultsBLAST'):
+        shutil.rmtree(workDir + '/ResultsBLAST')
+    backendSettings = {'parsedPDB' : workDir, 'blastExecutables' : blastExecutables, 'blastJobs' : 1, 'blastThreads' : 1,
+                       'blastShardSize' : 500, 'similarityMemory' : 2 ** 30, 'workers' : 1, 'kmerMinIdentity' : minIdentity, 'searchName' : ''}
+    updatelocalPDB.similarityBackends[similarityBackend](workDir + '/ReprChains.fasta', workDir + '/ReprChains.fasta', workDir + '/Similarity.tsv',
+                                                         backendSettings)
+    readSimilarity = open(workDir + '/Similarity.tsv', 'r')
+    readSimilarity.readline()  # Strip the header.
+    pairsFound = set([tuple(sorted(chunks[:2])) for chunks in (line.split('\t') for line in readSimilarity) if float(chunks[2]) >= minIdentity])
+    readSimilarity.close()
+    return pairsFound
+
+# The benchmarks that can be run, in the order that they are run.
+benchmarks = {'parsing' : benchmark_parsing, 'extraction' : benchmark_similarity_extraction, 'spilling' : benchmark_similarity_spilling,
+              'leafcull' : benchmark_leafcull, 'culling' : benchmark_culling, 'rebuild' : benchmark_identity_rebuild,
+              'extension' : benchmark_identity_extension, 'kmer' : benchmark_kmer_search, 'psiblast' : benchmark_psiblast_search}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the processing on seeded synthetic data.')
+    parser.add_argument('action', nargs='?', default='check', choices=['record', 'check'])
+    parser.add_argument('benchmarkNames', nargs='*', metavar='benchmark', help='the benchmarks to run (all of them if none are given)')
+    parser.add_argument('--scale', type=float, default=1.0, help='the factor to scale the size of the synthetic data by')
+    parser.add_argument('--repeats', type=int, default=3, help='the number of times to time each benchmark')
+    parser.add_argument('--baseline', default=defaultBaseline, help='the location of the baseline')
+    parser.add_argument('--blast', default=blastExecutables, help='the directory containing the BLAST+ executables to benchmark')
+    arguments = parser.parse_args()
+    blastExecutables = arguments.blast
+    results, regressions = main(arguments.action, arguments.benchmarkNames or None, arguments.baseline, arguments.scale, arguments.repeats)
+    for i in regressions:
+        sys.stderr.write('REGRESSION ' + i + '\n')
+    sys.exit(1 if regressions else 0)
@@ -0,0 +1,400 @@
+'''
+Binary store of the protein chains extracted from the PDB.
+
+The store is a single file that can be memory-mapped, with the layout (all numbers in native byte order):
+    header          magic, version, number of chains, number of unique sequences, 4 bytes of padding (so that the heap sizes are 8 byte
+                    aligned), header heap size and sequence heap size
+    res             float64 per chain
+    rFactorObs      float64 per chain
+    rFactorFree     float64 per chain
+    headerOffsets   2 uint64 per chain, the start and end offsets of each chain's FASTA identifier line in the header heap (chains with
+                    the same line share its offsets)
+    sequenceOffsets uint64 per unique sequence (plus one), the offset of each unique sequence in the sequence heap
+    length          uint32 per chain, the length of the chain's sequence
+    sequenceIndex   uint32 per chain, the index of the chain's sequence in the unique sequences (i.e. its representative group)
+    nonXRay         uint8 per chain, 1 if the chain was not determined by X-ray diffraction
+    alphaCarbonOnly uint8 per chain, 1 if the chain's structure only contains alpha carbons
+    atoms           uint32 per chain, the number of atoms in the chain's structure (in the first model)
+    alphaCarbons    uint32 per chain, the number of alpha carbons in the chain's structure (in the first model)
+    residues        uint32 per chain, the number of residues in the chain's structure (in the first model)
+    groupIDs        16 bytes per unique sequence, the identifier of the sequence grouping (see sequence_group)
+    headerHeap      the FASTA identifier lines (without the > and newline), interned so that identical lines are stored once
+    sequenceHeap    the unique sequences
+Each section starts on an 8 byte boundary. The atoms, alpha carbons and residues of a chain are unknownCount when they are not known (e.g. the
+structure does not record the chain of each atom, or the store was made from a FASTA file).
+'''
+
+import array
+import hashlib
+import mmap
+import os
+import struct
+
+storeMagic = b'PDBCHAIN'
+storeVersion = 2
+headerFormat = '=8sIII4xQQ'
+
+# The value of the number of atoms, alpha carbons or residues of a chain when it is not known.
+unknownCount = 0xFFFFFFFF
+
+def open_writer(fileStore):
+    """Start writing a chain store.
+
+    :param fileStore:   The location to write the store to.
+    :type fileStore:    string
+    :returns :          The state of the store being written, to pass to add_chain and close_writer.
+    :type :             dictionary
+
+    """
+
+    writer = {'fileStore' : fileStore, 'res' : array.array('d'), 'rFactorObs' : array.array('d'), 'rFactorFree' : array.array('d'),
+              'headerOffsets' : array.array('Q'), 'length' : array.array('I'), 'sequenceIndex' : array.array('I'), 'nonXRay' : array.array('B'),
+              'alphaCarbonOnly' : array.array('B'), 'atoms' : array.array('I'), 'alphaCarbons' : array.array('I'), 'residues' : array.array('I'),
+              'headers' : {}, 'headerHeapSize' : 0, 'sequences' : {}}
+    writer['headerHeap'] = open(fileStore + '.headers.tmp', 'wb')  # The header heap is written to disk as the chains are added.
+    return writer
+
+def add_chain(writer, identifierLine, sequence, structureCounts=(None, None, None)):
+    """Add a chain to a chain store that is being written.
+
+    :param writer:          The state of the store being written, as returned by open_writer.
+    :type writer:           dictionary
+    :param identifierLine:  The FASTA identifier line for the chain (without the > and newline), in the format written to AllChains.fasta.
+    :type identifierLine:   string
+    :param sequence:        The sequence of the chain.
+    :type sequence:         string
+    :param structureCounts: The number of atoms, alpha carbons and residues in the chain's structure (each None if it is not known).
+    :type structureCounts:  tuple
+
+    """
+
+    chunks = identifierLine.split('\t')
+    writer['res'].append(float(chunks[3]))
+    writer['rFactorObs'].append(float(chunks[4]))
+    writer['rFactorFree'].append(float(chunks[5]))
+    writer['length'].append(len(sequence))
+    writer['nonXRay'].append(0 if chunks[2] == 'XRAY' else 1)
+    writer['alphaCarbonOnly'].append(1 if chunks[6] == 'yes' else 0)
+    writer['atoms'].append(unknownCount if structureCounts[0] is None else structureCounts[0])
+    writer['alphaCarbons'].append(unknownCount if structureCounts[1] is None else structureCounts[1])
+    writer['residues'].append(unknownCount if structureCounts[2] is None else structureCounts[2])
+
+    # Intern the identifier line.
+    if not identifierLine in writer['headers']:
+        encodedLine = identifierLine.encode('utf-8')
+        writer['headers'][identifierLine] = writer['headerHeapSize']
+        writer['headerHeap'].write(encodedLine)
+        writer['headerHeapSize'] += len(encodedLine)
+    writer['headerOffsets'].append(writer['headers'][identifierLine])
+
+    # Intern the sequence.
+    if not sequence in writer['sequences']:
+        writer['sequences'][sequence] = len(writer['sequences'])
+    writer['sequenceIndex'].append(writer['sequences'][sequence])
+
+def close_writer(writer):
+    """Finish writing a chain store.
+
+    :param writer:  The state of the store being written, as returned by open_writer.
+    :type writer:   dictionary
+
+    """
+
+    fileStore = writer['fileStore']
+    writer['headerHeap'].close()
+
+    # As identifier lines are interned, a chain's identifier line ends where the next one in the heap starts.
+    headerStarts = sorted(set(writer['headerOffsets']))
+    headerEnds = dict(zip(headerStarts, headerStarts[1:] + [writer['headerHeapSize']]))
+    headerOffsets = array.array('Q')
+    for i in writer['headerOffsets']:
+        headerOffsets.extend([i, headerEnds[i]])
+
+    # Record the unique sequences in the order that they were first added.
+    sequences = sorted(writer['sequences'], key=writer['sequences'].get)
+    encodedSequences = [i.encode('utf-8') for i in sequences]
+    sequenceOffsets = array.array('Q', [0])
+    for i in encodedSequences:
+        sequenceOffsets.append(sequenceOffsets[-1] + len(i))
+    groupIDs = b''.join([sequence_group(i).encode('ascii') for i in sequences])
+
+    writeStore = open(fileStore + '.tmp', 'wb')
+    writeStore.write(struct.pack(headerFormat, storeMagic, storeVersion, len(writer['res']), len(sequences), writer['headerHeapSize'],
+                                 sequenceOffsets[-1]))
+    for i in [writer['res'], writer['rFactorObs'], writer['rFactorFree'], headerOffsets, sequenceOffsets, writer['length'],
+              writer['sequenceIndex'], writer['nonXRay'], writer['alphaCarbonOnly'], writer['atoms'], writer['alphaCarbons'],
+              writer['residues']]:
+        write_section(writeStore, i.tobytes())
+    write_section(writeStore, groupIDs)
+    with open(fileStore + '.headers.tmp', 'rb') as readHeaderHeap:
+        write_section(writeStore, readHeaderHeap.read())
+    write_section(writeStore, b''.join(encodedSequences))
+    writeStore.close()
+    os.remove(fileStore + '.headers.tmp')
+    os.replace(fileStore + '.tmp', fileStore)
+
+def write_section(writeStore, section):
+    """Write a section of a chain store, padding it to a multiple of 8 bytes.
+
+    :param writeStore:  The open store file.
+    :type writeStore:   file object
+    :param section:     The section to write.
+    :type section:      bytes
+
+    """
+
+    writeStore.write(section)
+    writeStore.write(b'\x00' * (-len(section) % 8))
+
+def sequence_group(sequence):
+    """Determine the identifier of the sequence grouping that a sequence belongs to.
+
+    The identifier is derived from the sequence itself, so that it is the same on every run.
+
+    :param sequence:    The sequence to determine the grouping of.
+    :type sequence:     string
+    :returns :          The identifier of the sequence grouping.
+    :type :             string
+
+    """
+
+    return hashlib.sha1(sequence.encode('utf-8')).hexdigest()[:16]
+
+def from_fasta(fileAllFasta, fileStore):
+    """Create a chain store from a FASTA file in the format of AllChains.fasta.
+
+    As the FASTA file does not record the structure counts of the chains, they are all unknownCount in the store.
+
+    :param fileAllFasta:    The location of the FASTA file containing all the chains.
+    :type fileAllFasta:     string
+    :param fileStore:       The location to write the store to.
+    :type fileStore:        string
+
+    """
+
+    writer = open_writer(fileStore)
+    readAllFasta = open(fileAllFasta, 'r')
+    while True:
+        # Read the file two lines at a time.
+        identifierLine = readAllFasta.readline().rstrip('\n')[1:]  # Strip off the newline and the > at the front.
+        sequence = readAllFasta.readline().strip()
+        if not sequence:
+            # Reached the end of the file when there is no second line.
+            break
+        add_chain(writer, identifierLine, sequence)
+    readAllFasta.close()
+    close_writer(writer)
+
+def load(fileStore):
+    """Memory-map a chain store.
+
+    The numeric columns are returned as memoryviews onto the mapped file, so no data is copied when loading.
+
+    :param fileStore:   The location of the store.
+    :type fileStore:    string
+    :returns :          The columns and heaps of the store keyed by their names (see the module documentation), along with the number
+                        of chains ('numberOfChains') and unique sequences ('numberOfSequences').
+    :type :             dictionary
+
+    """
+
+    readStore = open(fileStore, 'rb')
+    storeMap = mmap.mmap(readStore.fileno(), 0, access=mmap.ACCESS_READ)
+    readStore.close()
+    magic, version, numberOfChains, numberOfSequences, headerHeapSize, sequenceHeapSize = struct.unpack_from(headerFormat, storeMap)
+    if magic != storeMagic or version != storeVersion:
+        raise ValueError(fileStore + ' is not a version ' + str(storeVersion) + ' chain store.')
+    layout, storeSize = section_layout(numberOfChains, numberOfSequences, headerHeapSize, sequenceHeapSize)
+    if len(storeMap) != storeSize:
+        raise ValueError(fileStore + ' is not the size recorded in its header.')
+
+    store = {'numberOfChains' : numberOfChains, 'numberOfSequences' : numberOfSequences, 'mmap' : storeMap}
+    storeView = memoryview(storeMap)
+    for name, offset, sectionSize, typecode in layout:
+        store[name] = storeView[offset:offset + sectionSize].cast(typecode)
+
+    return store
+
+def section_layout(numberOfChains, numberOfSequences, headerHeapSize, sequenceHeapSize):
+    """Determine where each section of a chain store is in the store file.
+
+    :param numberOfChains:      The number of chains in the store.
+    :type numberOfChains:       int
+    :param numberOfSequences:   The number of unique sequences in the store.
+    :type numberOfSequences:    int
+    :param headerHeapSize:      The size of the header heap in bytes.
+    :type headerHeapSize:       int
+    :param sequenceHeapSize:    The size of the sequence heap in bytes.
+    :type sequenceHeapSize:     int
+    :returns :                  The name, offset, size in bytes (excluding the padding at its end) and array typecode of each section in
+                                the order they are in the file, and the size of the file.
+    :type :                     list, int
+
+    """
+
+    layout = []
+    offset = struct.calcsize(headerFormat)
+    offset += -offset % 8
+    for name, typecode, size in [('res', 'd', numberOfChains), ('rFactorObs', 'd', numberOfChains), ('rFactorFree', 'd', numberOfChains),
+                                 ('headerOffsets', 'Q', 2 * numberOfChains), ('sequenceOffsets', 'Q', numberOfSequences + 1),
+                                 ('length', 'I', numberOfChains), ('sequenceIndex', 'I', numberOfChains), ('nonXRay', 'B', numberOfChains),
+                                 ('alphaCarbonOnly', 'B', numberOfChains), ('atoms', 'I', numberOfChains), ('alphaCarbons', 'I', numberOfChains),
+                                 ('residues', 'I', numberOfChains), ('groupIDs', 'B', 16 * numberOfSequences),
+                                 ('headerHeap', 'B', headerHeapSize), ('sequenceHeap', 'B', sequenceHeapSize)]:
+        sectionSize = size * struct.calcsize(typecode)
+        layout.append((name, offset, sectionSize, typecode))
+        offset += sectionSize + (-sectionSize % 8)
+    return layout, offset
+
+def is_current(fileStore):
+    """Determine whether a chain store exists, was written by the current version of this module and is complete.
+
+    :param fileStore:   The location of the store.
+    :type fileStore:    string
+    :returns :          Whether the store can be loaded.
+    :type :             boolean
+
+    """
+
+    if not os.path.exists(fileStore):
+        return False
+    with open(fileStore, 'rb') as readStore:
+        header = readStore.read(struct.calcsize(headerFormat))
+    if len(header) != struct.calcsize(headerFormat):
+        return False
+    magic, version, numberOfChains, numberOfSequences, headerHeapSize, sequenceHeapSize = struct.unpack(headerFormat, header)
+    if (magic, version) != (storeMagic, storeVersion):
+        return False
+    storeSize = section_layout(numberOfChains, numberOfSequences, headerHeapSize, sequenceHeapSize)[1]
+    return os.path.getsize(fileStore) == storeSize
+
+def identifier_line(store, chain):
+    """Get the FASTA identifier line (without the > and newline) of a chain in a chain store.
+
+    :param store:   The chain store, as returned by load.
+    :type store:    dictionary
+    :param chain:   The index of the chain in the store.
+    :type chain:    int
+    :returns :      The identifier line.
+    :type :         bytes
+
+    """
+
+    return store['headerHeap'][store['headerOffsets'][2 * chain]:store['headerOffsets'][2 * chain + 1]].tobytes()
+
+def chain_id(store, chain):
+    """Get the identifier (e.g. 1ABCA) of a chain in a chain store.
+
+    :param store:   The chain store, as returned by load.
+    :type store:    dictionary
+    :param chain:   The index of the chain in the store.
+    :type chain:    int
+    :returns :      The chain identifier.
+    :type :         string
+
+    """
+
+    return identifier_line(store, chain).split(b'\t', 1)[0].decode('utf-8')
+
+def unique_sequence(store, sequenceIndex):
+    """Get a unique sequence from a chain store.
+
+    :param store:           The chain store, as returned by load.
+    :type store:            dictionary
+    :param sequenceIndex:   The index of the unique sequence.
+    :type sequenceIndex:    int
+    :returns :              The sequence.
+    :type :                 bytes
+
+    """
+
+    return store['sequenceHeap'][store['sequenceOffsets'][sequenceIndex]:store['sequenceOffsets'][sequenceIndex + 1]].tobytes()
+
+def group_id(store, sequenceIndex):
+    """Get the identifier of the sequence grouping of a unique sequence in a chain store.
+
+    :param store:           The chain store, as returned by load.
+    :type store:            dictionary
+    :param sequenceIndex:   The index of the unique sequence.
+    :type sequenceIndex:    int
+    :returns :              The sequence grouping identifier.
+    :type :                 string
+
+    """
+
+    return store['groupIDs'][16 * sequenceIndex:16 * (sequenceIndex + 1)].tobytes().decode('ascii')
+
+def fasta_record(store, chain):
+    """Get the FASTA record of a chain in a chain store, in the format of AllChains.fasta.
+
+    :param store:   The chain store, as returned by load.
+    :type store:    dictionary
+    :param chain:   The index of the chain in the store.
+    :type chain:    int
+    :returns :      The FASTA record (identifier line and sequence).
+    :type :         bytes
+
+    """
+
+    return b'>' + identifier_line(store, chain) + b'\n' + unique_sequence(store, store['sequenceIndex'][chain]) + b'\n'
+
+def export_fasta(store, fileAllFasta):
+    """Write out the FASTA records of all chains in a chain store (i.e. AllChains.fasta).
+
+    :param store:           The chain store, as returned by load.
+    :type store:            dictionary
+    :param fileAllFasta:    The location to write the FASTA file to.
+    :type fileAllFasta:     string
+
+    """
+
+    with open(fileAllFasta, 'wb') as writeAllFasta:
+        for i in range(store['numberOfChains']):
+            writeAllFasta.write(fasta_record(store, i))
+
+def export_chains(store, fileChains):
+    """Write out the information about all chains in a chain store (i.e. Chains.tsv). Counts that are not known are written as NA.
+
+    :param store:       The chain store, as returned by load.
+    :type store:        dictionary
+    :param fileChains:  The location to write the chain information to.
+    :type fileChains:   string
+
+    """
+
+    writeChains = open(fileChains, 'w')
+    writeChains.write('\t'.join(['Chain', 'Res', 'RVal', 'SeqLen', 'NonXRay', 'AlphaCarbonOnly', 'ReprGroup', 'Atoms', 'AlphaCarbons', 'Residues']) +
+                      '\n')  # Write the header for the chains file.
+    for i in range(store['numberOfChains']):
+        # The resolution and R value are taken from the identifier line so that they are written exactly as they were recorded.
+        chunks = identifier_line(store, i).decode('utf-8').split('\t')
+        writeChains.write(chunks[0] + '\t' + chunks[3] + '\t' + chunks[4] + '\t' + str(store['length'][i]) + '\t' +
+                          ('yes' if store['nonXRay'][i] else 'no') + '\t' + ('yes' if store['alphaCarbonOnly'][i] else 'no') + '\t' +
+                          group_id(store, store['sequenceIndex'][i]) + '\t' +
+                          '\t'.join(['NA' if j == unknownCount else str(j) for j in [store['atoms'][i], store['alphaCarbons'][i], store['residues'][i]]]) +
+                          '\n')
+    writeChains.close()
+
+def export_representatives(store, fileReprFasta, groupsToSkip=frozenset()):
+    """Write out one FASTA record for each sequence grouping in a chain store (i.e. ReprChains.fasta), identified by the grouping.
+
+    :param store:           The chain store, as returned by load.
+    :type store:            dictionary
+    :param fileReprFasta:   The location to write the FASTA file to.
+    :type fileReprFasta:    string
+    :param groupsToSkip:    The sequence groupings to not write out.
+    :type groupsToSkip:     set
+    :returns :              The sequence groupings that were written out.
+    :type :                 set
+
+    """
+
+    groupsWritten = set([])
+    writeReprFasta = open(fileReprFasta, 'wb')
+    for i in range(store['numberOfSequences']):
+        sequenceGrouping = group_id(store, i)
+        if not sequenceGrouping in groupsToSkip:
+            writeReprFasta.write(b'>' + sequenceGrouping.encode('ascii') + b'\n' + unique_sequence(store, i) + b'\n')
+            groupsWritten.add(sequenceGrouping)
+    writeReprFasta.close()
+    return groupsWritten
@@ -1,9 +1,10 @@
 import sys
 
+import profiling
 import updatelocalPDB
 import generateculledsubsets
 
-def main(mmCIFDir, parsedPDB, blastExecutables):
+def main(mmCIFDir, parsedPDB, blastExecutables, workers=1, profile=False, fileSubsetSpec=None, updateSettings=None):
     """Run the updating and culling of the entire PDB.
 
     :param mmCIFDir:            The directory containing the mmCIF files for the PDB.
@@ -12,11 +13,31 @@ def main(mmCIFDir, parsedPDB, blastExecutables):
     :type parsedPDB:            string
     :param blastExecutables:    The location of the BLAST+ executables.
     :type blastExecutables:     string
+    :param workers:             The number of processes to use when parsing the mmCIF files and generating the culled subsets.
+    :type workers:              int
+    :param profile:             Whether to record the time and memory used by each stage of the processing, and write them out to
+                                RunReport.json in parsedPDB.
+    :type profile:              boolean
+    :param fileSubsetSpec:      The location of a JSON file specifying the culled subsets to generate, or None to generate the default ones
+                                (see generateculledsubsets.main).
+    :type fileSubsetSpec:       string
+    :param updateSettings:      The other keyword arguments to pass to updatelocalPDB.main (e.g. {'blastJobs' : 4,
+                                'similarityBackend' : 'kmer', 'clusterIdentity' : 95.0}), or None to use its defaults.
+    :type updateSettings:       dictionary
 
     """
 
-    updatelocalPDB.main(mmCIFDir, parsedPDB, blastExecutables)
-    generateculledsubsets.main(parsedPDB)
+    if profile:
+        profiling.start()
+    updateStage = profiling.begin_stage('updatelocalPDB')
+    updatelocalPDB.main(mmCIFDir, parsedPDB, blastExecutables, workers, **(updateSettings or {}))
+    profiling.end_stage(updateStage)
+    cullingStage = profiling.begin_stage('generateculledsubsets')
+    generateculledsubsets.main(parsedPDB, workers, fileSubsetSpec=fileSubsetSpec)
+    profiling.end_stage(cullingStage)
+    if profile:
+        profiling.write_report(parsedPDB + '/RunReport.json')
+        profiling.stop()
 
 if __name__ == '__main__':
-    main(sys.argv[1], sys.argv[2], sys.argv[3])
\ No newline at end of file
+    main(sys.argv[1], sys.argv[2], sys.argv[3], int(sys.argv[4]) if len(sys.argv) > 4 else 1, len(sys.argv) > 5 and sys.argv[5] == 'profile')
\ No newline at end of file
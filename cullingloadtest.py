@@ -0,0 +1,125 @@
+'''
+Load test a culling server (see cullingserver) by sending it random queries from a number of concurrent connections, and report the
+number of queries answered per second and the latency of the queries.
+
+The queries are drawn (with a fixed seed) from a set of distinct quality criteria, so the fraction of the queries that the server can
+answer from its cache is controlled by the number of distinct queries. Usage:
+
+    python cullingloadtest.py host:port|socketPath [queries] [connections] [distinctQueries]
+'''
+
+import asyncio
+import json
+import random
+import sys
+import time
+
+def main(address, queries=1000, connections=8, distinctQueries=50, seed=0):
+    """Load test a culling server.
+
+    :param address:         The host:port of the server, or the location of its Unix socket.
+    :type address:          string
+    :param queries:         The total number of queries to send.
+    :type queries:          int
+    :param connections:     The number of connections to send the queries over concurrently.
+    :type connections:      int
+    :param distinctQueries: The number of distinct queries to draw the queries from.
+    :type distinctQueries:  int
+    :param seed:            The seed for generating the queries.
+    :type seed:             int
+    :returns :              The number of queries sent, the number that failed, the queries answered per second, and the 50th, 95th and
+                            99th percentile and maximum latencies (in seconds).
+    :type :                 dictionary
+
+    """
+
+    randomGenerator = random.Random(seed)
+    queryPool = [random_query(randomGenerator) for i in range(distinctQueries)]
+    queryTargets = [randomGenerator.choice(queryPool) for i in range(queries)]
+    return asyncio.run(run_load(address, queryTargets, connections))
+
+def random_query(randomGenerator):
+    """Generate the target of a random culling query.
+
+    :param randomGenerator: The source of randomness.
+    :type randomGenerator:  random.Random
+    :returns :              The target (path and query string) of the query.
+    :type :                 string
+
+    """
+
+    return ('/cull?resolution=' + '%.1f' % randomGenerator.uniform(1.0, 3.5) + '&rValue=' + '%.2f' % randomGenerator.uniform(0.15, 1.0) +
+            '&seqIdentity=' + str(randomGenerator.randint(20, 95)) + '&minLength=' + str(randomGenerator.choice([20, 30, 40, 50])) +
+            '&includeNonXray=' + str(randomGenerator.choice([0, 0, 0, 1])))
+
+async def run_load(address, queryTargets, connections):
+    """Send queries to a culling server over a number of concurrent connections.
+
+    :param address:         The host:port of the server, or the location of its Unix socket.
+    :type address:          string
+    :param queryTargets:    The target of each query to send.
+    :type queryTargets:     list
+    :param connections:     The number of connections to send the queries over concurrently.
+    :type connections:      int
+    :returns :              The results of the load test (see main).
+    :type :                 dictionary
+
+    """
+
+    latencies = []
+    failures = []
+    startTime = time.perf_counter()
+    await asyncio.gather(*[send_queries(address, queryTargets[i::connections], latencies, failures) for i in range(connections)])
+    elapsed = time.perf_counter() - startTime
+
+    latencies.sort()
+    percentile = lambda x : latencies[min(len(latencies) - 1, int(x * len(latencies)))] if latencies else None
+    return {'queries' : len(queryTargets), 'failures' : len(failures), 'queriesPerSecond' : len(latencies) / elapsed if elapsed > 0 else None,
+            'latency50' : percentile(0.5), 'latency95' : percentile(0.95), 'latency99' : percentile(0.99),
+            'latencyMax' : latencies[-1] if latencies else None}
+
+async def send_queries(address, queryTargets, latencies, failures):
+    """Send queries to a culling server one after another over a single connection.
+
+    :param address:         The host:port of the server, or the location of its Unix socket.
+    :type address:          string
+    :param queryTargets:    The target of each query to send.
+    :type queryTargets:     list
+    :param latencies:       The latencies of the queries answered successfully. Updated with the latencies of the queries sent.
+    :type latencies:        list
+    :param failures:        The queries that failed. Updated with the failures of the queries sent.
+    :type failures:         list
+
+    """
+
+    if ':' in address:
+        host, port = address.rsplit(':', 1)
+        reader, writer = await asyncio.open_connection(host, int(port))
+    else:
+        reader, writer = await asyncio.open_unix_connection(address)
+
+    try:
+        for target in queryTargets:
+            startTime = time.perf_counter()
+            writer.write(('GET ' + target + ' HTTP/1.1\r\nHost: localhost\r\n\r\n').encode('latin-1'))
+            await writer.drain()
+            statusLine = await reader.readline()
+            contentLength = 0
+            while True:
+                headerLine = await reader.readline()
+                if headerLine in [b'\r\n', b'']:
+                    break
+                name, _, value = headerLine.decode('latin-1').partition(':')
+                if name.strip().lower() == 'content-length':
+                    contentLength = int(value)
+            body = await reader.readexactly(contentLength)
+            if statusLine.split()[1:2] == [b'200']:
+                latencies.append(time.perf_counter() - startTime)
+            else:
+                failures.append((target, statusLine.decode('latin-1').strip(), body.decode('utf-8', 'replace').strip()))
+    finally:
+        writer.close()
+
+if __name__ == '__main__':
+    results = main(sys.argv[1], *[int(i) for i in sys.argv[2:5]])
+    sys.stdout.write(json.dumps(results, indent=1) + '\n')
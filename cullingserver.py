@@ -0,0 +1,311 @@
+'''
+A long-running server that culls the PDB on demand, at any quality criteria rather than only those of the subsets written by
+generateculledsubsets.
+
+The chain and similarity stores written by updatelocalPDB are loaded (memory-mapped) once when the server starts, and each query is culled
+in a pool of worker processes that share them. The results of the most recent distinct queries are cached, and a query that arrives while
+an identical one is being culled waits for that culling rather than repeating it.
+
+The server speaks HTTP/1.1 over TCP or a Unix socket. The queries are GET requests of the form
+
+    /cull?resolution=2.3&rValue=0.3&seqIdentity=35&minLength=40&includeNonXray=0&format=json
+
+where minLength (default 40), includeNonXray (default 0, which also excludes alpha carbon only chains) and format (json for a list of the
+identifiers of the chains kept, or fasta for their FASTA records in the format of the culled subsets) are optional. A GET request for
+/status reports the number of chains and similarities, the state of the cache and the number of requests that failed. A request that fails
+(e.g. because a worker process died) is answered with a 500 response, and the server keeps serving.
+'''
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import sys
+import urllib.parse
+import chainstore
+import edgestore
+import generateculledsubsets
+
+# The reason phrases of the HTTP status codes that the server responds with.
+statusReasons = {200 : 'OK', 400 : 'Bad Request', 404 : 'Not Found', 405 : 'Method Not Allowed', 500 : 'Internal Server Error'}
+
+def main(parsedPDB, host='127.0.0.1', port=8080, workers=1, cacheSize=256, socketPath=None):
+    """Run the culling server until it is interrupted.
+
+    :param parsedPDB:   The directory containing the results of updatelocalPDB (the chain and similarity stores are created by
+                        generateculledsubsets if they are not present).
+    :type parsedPDB:    string
+    :param host:        The address to listen on.
+    :type host:         string
+    :param port:        The port to listen on.
+    :type port:         int
+    :param workers:     The number of processes to cull with (if 1, then the culling is performed in a thread of the server's process).
+    :type workers:      int
+    :param cacheSize:   The number of query results to cache.
+    :type cacheSize:    int
+    :param socketPath:  If not None, the server listens on a Unix socket at this location instead of on host and port.
+    :type socketPath:   string
+
+    """
+
+    serverState = open_server(parsedPDB, workers, cacheSize)
+    try:
+        asyncio.run(serve(serverState, host, port, socketPath))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        serverState['executor'].shutdown()
+
+def open_server(parsedPDB, workers=1, cacheSize=256):
+    """Load the chain and similarity stores, and start the processes that the culling is performed in.
+
+    :param parsedPDB:   The directory containing the results of updatelocalPDB.
+    :type parsedPDB:    string
+    :param workers:     The number of processes to cull with (if 1, then the culling is performed in a thread of the calling process).
+    :type workers:      int
+    :param cacheSize:   The number of query results to cache.
+    :type cacheSize:    int
+    :returns :          The state of the server.
+    :type :             dictionary
+
+    """
+
+    fileChainStore = parsedPDB + '/ChainStore.bin'
+    fileEdges = parsedPDB + '/Similarity.bin'
+    generateculledsubsets.prepare_stores(parsedPDB)
+    generateculledsubsets.set_culling_data(fileChainStore, fileEdges)
+    chainTable, similarities = generateculledsubsets.cullingData
+    serverState = {'chainTable' : chainTable, 'numberOfSimilarities' : len(similarities[0]), 'stores' : (fileChainStore, fileEdges),
+                   'workers' : workers, 'cache' : collections.OrderedDict(), 'cacheSize' : cacheSize, 'pending' : {}, 'queries' : 0,
+                   'cacheHits' : 0, 'errors' : 0}
+    start_executor(serverState)
+    return serverState
+
+def start_executor(serverState):
+    """Start the processes (or thread) that the culling is performed in.
+
+    :param serverState: The state of the server, as returned by open_server.
+    :type serverState:  dictionary
+
+    """
+
+    if serverState['workers'] > 1:
+        # The worker processes are started through a fork server where possible, as processes forked from the server itself would inherit
+        # the sockets of the connections open at the time, and keep them open after the server has closed them.
+        startMethod = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else None
+        serverState['executor'] = concurrent.futures.ProcessPoolExecutor(serverState['workers'], multiprocessing.get_context(startMethod),
+                                                                         initializer=generateculledsubsets.set_culling_data,
+                                                                         initargs=serverState['stores'])
+    else:
+        serverState['executor'] = concurrent.futures.ThreadPoolExecutor(1)
+
+async def serve(serverState, host, port, socketPath=None):
+    """Accept and answer connections until cancelled.
+
+    :param serverState: The state of the server, as returned by open_server.
+    :type serverState:  dictionary
+    :param host:        The address to listen on.
+    :type host:         string
+    :param port:        The port to listen on.
+    :type port:         int
+    :param socketPath:  If not None, the server listens on a Unix socket at this location instead of on host and port.
+    :type socketPath:   string
+
+    """
+
+    handler = lambda reader, writer : handle_connection(serverState, reader, writer)
+    if socketPath is None:
+        server = await asyncio.start_server(handler, host, port)
+    else:
+        server = await asyncio.start_unix_server(handler, socketPath)
+    async with server:
+        await server.serve_forever()
+
+async def handle_connection(serverState, reader, writer):
+    """Answer the requests sent on a connection until the client closes it.
+
+    :param serverState: The state of the server, as returned by open_server.
+    :type serverState:  dictionary
+    :param reader:      The stream to read the requests from.
+    :type reader:       asyncio.StreamReader
+    :param writer:      The stream to write the responses to.
+    :type writer:       asyncio.StreamWriter
+
+    """
+
+    try:
+        while True:
+            requestLine = await reader.readline()
+            if not requestLine:
+                break
+            headers = {}
+            while True:
+                headerLine = await reader.readline()
+                if headerLine in [b'\r\n', b'\n', b'']:
+                    break
+                name, _, value = headerLine.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            chunks = requestLine.decode('latin-1').split()
+            if len(chunks) != 3 or chunks[0] != 'GET':
+                status, contentType, body = 405, 'text/plain', b'Only GET requests are supported.\n'
+            else:
+                try:
+                    status, contentType, body = await answer_request(serverState, chunks[1])
+                except Exception as e:
+                    # Answer with an error and keep serving, rather than dropping the connection. Any requests waiting on the same culling
+                    # receive the same exception, and so are answered with an error as well.
+                    serverState['errors'] += 1
+                    status, contentType, body = 500, 'text/plain', ('The request failed: ' + repr(e) + '\n').encode('utf-8')
+
+            keepAlive = chunks[-1:] == ['HTTP/1.1'] and headers.get('connection', '').lower() != 'close'
+            writer.write(('HTTP/1.1 ' + str(status) + ' ' + statusReasons[status] +
+                          '\r\nContent-Type: ' + contentType + '\r\nContent-Length: ' + str(len(body)) + '\r\nConnection: ' +
+                          ('keep-alive' if keepAlive else 'close') + '\r\n\r\n').encode('latin-1') + body)
+            await writer.drain()
+            if not keepAlive:
+                break
+    except (ConnectionError, ValueError):
+        # A ValueError is raised by readline if a line of the request is longer than the stream's limit.
+        pass
+    finally:
+        writer.close()
+
+async def answer_request(serverState, target):
+    """Answer a single GET request.
+
+    :param serverState: The state of the server, as returned by open_server.
+    :type serverState:  dictionary
+    :param target:      The target of the request (the path and query string).
+    :type target:       string
+    :returns :          The HTTP status code, content type and body of the response.
+    :type :             int, string, bytes
+
+    """
+
+    url = urllib.parse.urlsplit(target)
+    if url.path == '/status':
+        status = {'chains' : len(serverState['chainTable']['chain']), 'similarities' : serverState['numberOfSimilarities'],
+                  'queries' : serverState['queries'], 'cacheHits' : serverState['cacheHits'], 'cached' : len(serverState['cache']),
+                  'cacheSize' : serverState['cacheSize'], 'errors' : serverState['errors']}
+        return 200, 'application/json', json.dumps(status).encode('utf-8') + b'\n'
+    elif url.path != '/cull':
+        return 404, 'text/plain', b'Unknown path ' + url.path.encode('utf-8') + b'.\n'
+
+    try:
+        query, responseFormat = parse_query(url.query)
+    except ValueError as e:
+        return 400, 'text/plain', str(e).encode('utf-8') + b'\n'
+    chainsKept = await culled_chains(serverState, query)
+
+    chainTable = serverState['chainTable']
+    if responseFormat == 'fasta':
+        return 200, 'text/plain', b''.join([chainstore.fasta_record(chainTable['store'], i) for i in chainsKept])
+    response = {'resolution' : query[0], 'rValue' : query[1], 'seqIdentity' : query[2], 'minLength' : query[3], 'includeNonXray' : query[4] == 1,
+                'chains' : [chainTable['chain'][i] for i in chainsKept]}
+    return 200, 'application/json', json.dumps(response).encode('utf-8') + b'\n'
+
+def parse_query(queryString):
+    """Determine the quality criteria and response format of a query.
+
+    :param queryString: The query string of the request.
+    :type queryString:  string
+    :returns :          The resolution, R value, sequence identity, minimum length and whether to include non-X-ray and alpha carbon only
+                        chains (1) or not (0), and the format of the response.
+    :type :             tuple, string
+
+    """
+
+    parameters = dict(urllib.parse.parse_qsl(queryString))
+    for i in parameters:
+        if not i in ['resolution', 'rValue', 'seqIdentity', 'minLength', 'includeNonXray', 'format']:
+            raise ValueError('Unknown parameter ' + i + '.')
+    for i in ['resolution', 'rValue', 'seqIdentity']:
+        if not i in parameters:
+            raise ValueError('The ' + i + ' parameter is required.')
+
+    try:
+        resolution = float(parameters['resolution'])
+        rValue = float(parameters['rValue'])
+        seqIdentity = float(parameters['seqIdentity'])
+        minLength = int(parameters.get('minLength', 40))
+    except ValueError:
+        raise ValueError('The resolution, rValue and seqIdentity parameters must be numbers, and minLength an integer.')
+    if not 0.0 <= seqIdentity <= 100.0:
+        raise ValueError('The seqIdentity parameter must be between 0 and 100.')
+    includeNonXray = parameters.get('includeNonXray', '0').lower()
+    if not includeNonXray in ['0', '1', 'false', 'true']:
+        raise ValueError('The includeNonXray parameter must be 0 or 1.')
+    responseFormat = parameters.get('format', 'json')
+    if not responseFormat in ['json', 'fasta']:
+        raise ValueError('The format parameter must be json or fasta.')
+
+    # The sequence identity is truncated to the precision the similarities are stored at (see edgestore.quantise), so that equivalent queries
+    # share a cache entry.
+    return (resolution, rValue, edgestore.quantise(seqIdentity) / 100.0, minLength, 1 if includeNonXray in ['1', 'true'] else 0), responseFormat
+
+async def culled_chains(serverState, query):
+    """Determine the chains kept when culling at a set of quality criteria, using the cache where possible.
+
+    :param serverState: The state of the server, as returned by open_server.
+    :type serverState:  dictionary
+    :param query:       The resolution, R value, sequence identity, minimum length and whether to include non-X-ray and alpha carbon only
+                        chains, as returned by parse_query.
+    :type query:        tuple
+    :returns :          The indices of the chains that are kept, in the order that they appear in the chain store.
+    :type :             list
+
+    """
+
+    serverState['queries'] += 1
+    cache = serverState['cache']
+    if query in cache:
+        serverState['cacheHits'] += 1
+        cache.move_to_end(query)
+        return cache[query]
+
+    if query in serverState['pending']:
+        # An identical query is being culled, so wait for its result.
+        serverState['cacheHits'] += 1
+        return await asyncio.shield(serverState['pending'][query])
+
+    executor = serverState['executor']
+    try:
+        pending = asyncio.get_running_loop().run_in_executor(executor, cull_query, query)
+        serverState['pending'][query] = pending
+        chainsKept = await asyncio.shield(pending)
+    except concurrent.futures.BrokenExecutor:
+        if serverState['executor'] is executor:
+            # A worker process died, and the pool can not be used again, so replace it for the queries that follow.
+            executor.shutdown(wait=False)
+            start_executor(serverState)
+        raise
+    finally:
+        serverState['pending'].pop(query, None)
+    cache[query] = chainsKept
+    if len(cache) > serverState['cacheSize']:
+        cache.popitem(last=False)
+    return chainsKept
+
+def cull_query(query):
+    """Cull the chains at a set of quality criteria, using the chains and similarities set by generateculledsubsets.set_culling_data.
+
+    :param query:   The resolution, R value, sequence identity, minimum length and whether to include non-X-ray and alpha carbon only chains.
+    :type query:    tuple
+    :returns :      The indices of the chains that are kept, in the order that they appear in the chain store.
+    :type :         list
+
+    """
+
+    resolution, rValue, seqIdentity, minLength, includeNonXrayAndCAOnly = query
+    chainTable, similarities = generateculledsubsets.cullingData
+    toCull = generateculledsubsets.eligible_groups(chainTable, resolution, rValue, minLength, includeNonXrayAndCAOnly)
+    return sorted(generateculledsubsets.cull_at_identity(toCull, similarities, seqIdentity))
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and not sys.argv[2].isdigit():
+        # The second argument is the location of a Unix socket rather than a port.
+        main(sys.argv[1], socketPath=sys.argv[2], workers=int(sys.argv[3]) if len(sys.argv) > 3 else 1)
+    else:
+        main(sys.argv[1], port=int(sys.argv[2]) if len(sys.argv) > 2 else 8080, workers=int(sys.argv[3]) if len(sys.argv) > 3 else 1)
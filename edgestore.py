@@ -0,0 +1,248 @@
+'''
+Binary store of the similarities between sequence groupings.
+
+The store is a single file that can be memory-mapped, with the layout (all numbers in native byte order):
+    header      magic, version, number of sequence groupings, number of similarities and a CRC-32 checksum of the rest of the file
+    groupIDs    16 bytes per sequence grouping, the identifier of the grouping (see chainstore.sequence_group)
+    groupA      uint32 per similarity, the index of the first sequence grouping in the pair
+    groupB      uint32 per similarity, the index of the second sequence grouping in the pair
+    identity    uint16 per similarity, the sequence identity of the pair in hundredths of a percent (truncated, see quantise)
+The similarities are sorted from most to least similar (ties are ordered by groupA and then groupB), so the similarities at or above any
+sequence identity are a prefix of them. Each section starts on an 8 byte boundary.
+'''
+
+import array
+import math
+import mmap
+import os
+import struct
+import sys
+import zlib
+
+storeMagic = b'PDBEDGES'
+storeVersion = 1
+headerFormat = '=8sIIQI4x'
+
+def quantise(identity):
+    """Convert a sequence identity to the hundredths of a percent it is stored as.
+
+    The sequence identity is truncated rather than rounded, so that a similarity is at or above a threshold (which is truncated in the same
+    way) exactly when it was before being stored (e.g. a similarity of 29.996 is stored as 2999, and so is below a threshold of 30). A
+    small tolerance stops thresholds such as 0.29 * 100 (28.999999999999996) from being truncated to the hundredth below.
+
+    :param identity:    The sequence identity (as a percentage).
+    :type identity:     float
+    :returns :          The sequence identity in hundredths of a percent.
+    :type :             int
+
+    """
+
+    return int(math.floor(identity * 100 + 1e-9))
+
+def write(fileStore, groups, groupA, groupB, identity):
+    """Write a similarity store.
+
+    :param fileStore:   The location to write the store to.
+    :type fileStore:    string
+    :param groups:      The identifiers of the sequence groupings, in index order.
+    :type groups:       list
+    :param groupA:      The index of the first sequence grouping of each similarity, sorted as described in the module documentation.
+    :type groupA:       array
+    :param groupB:      The index of the second sequence grouping of each similarity.
+    :type groupB:       array
+    :param identity:    The sequence identity of each similarity in hundredths of a percent.
+    :type identity:     array
+
+    """
+
+    write_sorted(fileStore, groups, zip(groupA, groupB, identity))
+
+def write_sorted(fileStore, groups, similarities):
+    """Write a similarity store from a stream of similarities, without holding them in memory.
+
+    The groupA section is written straight into the store, while the groupB and identity sections are written to temporary files alongside
+    it and appended once the stream is exhausted. The header is written last, when the number of similarities and the checksum are known.
+
+    :param fileStore:       The location to write the store to.
+    :type fileStore:        string
+    :param groups:          The identifiers of the sequence groupings, in index order.
+    :type groups:           list
+    :param similarities:    The (index of the first sequence grouping, index of the second sequence grouping, sequence identity in hundredths
+                            of a percent) of each similarity, sorted as described in the module documentation.
+    :type similarities:     iterable
+
+    """
+
+    groupIDs = b''.join([i.encode('ascii') for i in groups])
+    if len(groupIDs) != 16 * len(groups):
+        raise ValueError('The sequence grouping identifiers must be 16 characters long.')
+    groupIDs += b'\x00' * (-len(groupIDs) % 8)
+
+    sectionLocations = [fileStore + '.groupB.tmp', fileStore + '.identity.tmp']
+    writeStore = open(fileStore + '.tmp', 'wb')
+    writeSections = [open(i, 'w+b') for i in sectionLocations]
+    try:
+        writeStore.write(b'\x00' * struct.calcsize(headerFormat))
+        writeStore.write(groupIDs)
+        checksum = zlib.crc32(groupIDs)
+
+        # Write the similarities out a block at a time.
+        numberOfSimilarities = 0
+        blocks = [array.array('I'), array.array('I'), array.array('H')]
+        for similarity in similarities:
+            for block, value in zip(blocks, similarity):
+                block.append(value)
+            if len(blocks[0]) == 65536:
+                checksum = zlib.crc32(blocks[0].tobytes(), checksum)
+                for block, writeSection in zip(blocks, [writeStore] + writeSections):
+                    writeSection.write(block.tobytes())
+                numberOfSimilarities += len(blocks[0])
+                blocks = [array.array('I'), array.array('I'), array.array('H')]
+        checksum = zlib.crc32(blocks[0].tobytes(), checksum)
+        for block, writeSection in zip(blocks, [writeStore] + writeSections):
+            writeSection.write(block.tobytes())
+        numberOfSimilarities += len(blocks[0])
+
+        # Pad the groupA section, and append the (padded) groupB and identity sections.
+        padding = b'\x00' * (-4 * numberOfSimilarities % 8)
+        writeStore.write(padding)
+        checksum = zlib.crc32(padding, checksum)
+        for itemSize, writeSection in zip([4, 2], writeSections):
+            writeSection.write(b'\x00' * (-itemSize * numberOfSimilarities % 8))
+            writeSection.seek(0)
+            while True:
+                block = writeSection.read(1 << 20)
+                if not block:
+                    break
+                writeStore.write(block)
+                checksum = zlib.crc32(block, checksum)
+
+        writeStore.seek(0)
+        writeStore.write(struct.pack(headerFormat, storeMagic, storeVersion, len(groups), numberOfSimilarities, checksum))
+        writeStore.close()
+        os.replace(fileStore + '.tmp', fileStore)
+    finally:
+        writeStore.close()
+        for writeSection, sectionLocation in zip(writeSections, sectionLocations):
+            writeSection.close()
+            os.remove(sectionLocation)
+        if os.path.exists(fileStore + '.tmp'):
+            os.remove(fileStore + '.tmp')
+
+def load(fileStore, verify=True):
+    """Memory-map a similarity store.
+
+    :param fileStore:   The location of the store.
+    :type fileStore:    string
+    :param verify:      Whether to check the checksum of the store.
+    :type verify:       boolean
+    :returns :          The sections of the store as memoryviews keyed by their names (see the module documentation), along with the number
+                        of sequence groupings ('numberOfGroups') and similarities ('numberOfSimilarities').
+    :type :             dictionary
+
+    """
+
+    readStore = open(fileStore, 'rb')
+    storeMap = mmap.mmap(readStore.fileno(), 0, access=mmap.ACCESS_READ)
+    readStore.close()
+    magic, version, numberOfGroups, numberOfSimilarities, checksum = struct.unpack_from(headerFormat, storeMap)
+    if magic != storeMagic or version != storeVersion:
+        raise ValueError(fileStore + ' is not a version ' + str(storeVersion) + ' similarity store.')
+
+    store = {'numberOfGroups' : numberOfGroups, 'numberOfSimilarities' : numberOfSimilarities, 'mmap' : storeMap}
+    storeView = memoryview(storeMap)
+    offset = struct.calcsize(headerFormat)
+    if verify and zlib.crc32(storeView[offset:]) != checksum:
+        raise ValueError(fileStore + ' is corrupt (checksum mismatch).')
+    for name, typecode, size in [('groupIDs', 'B', 16 * numberOfGroups), ('groupA', 'I', numberOfSimilarities),
+                                 ('groupB', 'I', numberOfSimilarities), ('identity', 'H', numberOfSimilarities)]:
+        sectionSize = size * struct.calcsize(typecode)
+        store[name] = storeView[offset:offset + sectionSize].cast(typecode)
+        offset += sectionSize + (-sectionSize % 8)
+
+    return store
+
+def group_id(store, groupIndex):
+    """Get the identifier of a sequence grouping in a similarity store.
+
+    :param store:       The similarity store, as returned by load.
+    :type store:        dictionary
+    :param groupIndex:  The index of the sequence grouping.
+    :type groupIndex:   int
+    :returns :          The sequence grouping identifier.
+    :type :             string
+
+    """
+
+    return store['groupIDs'][16 * groupIndex:16 * (groupIndex + 1)].tobytes().decode('ascii')
+
+def edges_at_identity(identity, seqIdentity):
+    """Determine the number of similarities that are at or above a given sequence identity.
+
+    :param identity:    The sequence identities in hundredths of a percent, sorted from greatest to least.
+    :type identity:     array or memoryview
+    :param seqIdentity: The sequence identity (as a percentage) to find the similarities at or above.
+    :type seqIdentity:  float
+    :returns :          The number of similarities at or above the sequence identity.
+    :type :             int
+
+    """
+
+    # Binary search for the first similarity below the sequence identity.
+    threshold = quantise(seqIdentity)
+    low = 0
+    high = len(identity)
+    while low < high:
+        middle = (low + high) // 2
+        if identity[middle] >= threshold:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+def sort_similarities(pairs, identity):
+    """Sort similarities from most to least similar, ordering ties by their pair of sequence groupings.
+
+    As the sequence identities are integers in a small range, the similarities are bucketed by identity (a counting sort), and only the pairs
+    within each bucket are compared.
+
+    :param pairs:       The pair of each similarity, as the index of the first grouping shifted 32 bits left and combined with the second.
+    :type pairs:        array
+    :param identity:    The sequence identity of each similarity in hundredths of a percent.
+    :type identity:     array
+    :returns :          The index of the first sequence grouping, the index of the second sequence grouping and the sequence identity of
+                        each similarity, in sorted order.
+    :type :             array, array, array
+
+    """
+
+    counts = [0] * 65536
+    for i in identity:
+        counts[i] += 1
+    starts = [0] * 65536
+    position = 0
+    for i in range(65535, -1, -1):
+        starts[i] = position
+        position += counts[i]
+
+    sortedPairs = array.array('Q', bytes(8 * len(pairs)))
+    for pair, i in zip(pairs, identity):
+        sortedPairs[starts[i]] = pair
+        starts[i] += 1
+
+    sortedIdentity = array.array('H')
+    position = 0
+    for i in range(65535, -1, -1):
+        if counts[i]:
+            sortedPairs[position:position + counts[i]] = array.array('Q', sorted(sortedPairs[position:position + counts[i]]))
+            sortedIdentity.extend([i] * counts[i])
+            position += counts[i]
+
+    # Split the packed pairs into their halves by viewing each 64 bit pair as two 32 bit integers.
+    halves = memoryview(sortedPairs).cast('B').cast('I')
+    groupA = array.array('I')
+    groupB = array.array('I')
+    high, low = (0, 1) if sys.byteorder == 'big' else (1, 0)
+    groupA.frombytes(halves[high::2].tobytes())
+    groupB.frombytes(halves[low::2].tobytes())
+    return groupA, groupB, sortedIdentity
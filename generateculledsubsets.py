@@ -1,12 +1,70 @@
 import gzip
+import hashlib
+import itertools
+import json
+import multiprocessing
+import operator
 import os
+import time
+import chainstore
+import edgestore
 import Leafcull
+import processPSIoutput
+import profiling
 
-def main(parsedPDB):
+# The chain table and similarities used when generating subsets. This is set once in each process that generates subsets, so
+# that worker processes share the data (inherited on fork) rather than having it sent to them with every subset.
+cullingData = None
+
+# The version of the way subsets are generated and written. Changing this causes every subset to be regenerated, rather than being
+# skipped because the manifest records it as generated from the same inputs.
+subsetFormat = 1
+
+# The number of filter masks to keep for each chain table before they are discarded.
+maskCacheSize = 64
+
+# The columns of the chain table that filter predicates can test, and the comparisons they can use.
+filterColumns = {'resolution' : 'res', 'rValue' : 'rVal', 'rFree' : 'rFree', 'length' : 'seqLen', 'nonXRay' : 'nonXRay',
+                 'alphaCarbonOnly' : 'alphaCarbonOnly', 'atoms' : 'atoms', 'alphaCarbons' : 'alphaCarbons', 'residues' : 'residues'}
+# The columns of the chain table that count parts of a chain's structure, which are not known for some chains (see chainstore.unknownCount).
+countColumns = set(['atoms', 'alphaCarbons', 'residues'])
+filterOperators = {'<=' : operator.le, '<' : operator.lt, '>=' : operator.ge, '>' : operator.gt, '==' : operator.eq, '!=' : operator.ne}
+
+# The axes that a subset grid can vary, and the filter predicate that each value of an axis contributes (seqIdentity is the sequence
+# identity that the subset is culled at, rather than a filter).
+gridAxes = {'resolution' : ('resolution', '<='), 'rValue' : ('rValue', '<='), 'minLength' : ('length', '>='), 'seqIdentity' : None}
+
+# The subsets generated when no subset specification is given. Each grid of subsets has a template for the names of its output files
+# (filled in with the values of the grid's axes), the values of each axis of the grid, and the filter predicates ([column, comparison,
+# value]) that every chain in the grid's subsets must also satisfy.
+defaultSubsetSpec = {'subsets' : [
+    {'name' : 'SeqIden_{seqIdentity}_Res_{resolution}_RVal_{rValue}.fasta.gz',
+     'grid' : {'resolution' : [1.6, 1.8, 2.0, 2.2, 2.4, 2.5, 2.6, 2.8, 3.0], 'rValue' : [0.25, 0.5, 0.75, 1.0],
+               'seqIdentity' : [20, 25, 30, 40, 50, 60, 70, 80, 90]},
+     'filters' : [['length', '>=', 40], ['nonXRay', '==', 0], ['alphaCarbonOnly', '==', 0]]},
+    {'name' : 'SeqIden_{seqIdentity}_Res_{resolution}_RVal_{rValue}_INCLNONXRAY_INCLCAONLY.fasta.gz',
+     'grid' : {'resolution' : [100.0], 'rValue' : [1.0], 'seqIdentity' : [20, 25, 30, 40, 50, 60, 70, 80, 90]},
+     'filters' : [['length', '>=', 40]]}
+    ]}
+
+def main(parsedPDB, workers=1, compressionLevel=9, fileSubsetSpec=None, force=False):
     """Cull the entire PDB at different quality criterion.
 
-    :param parsedPDB:   The directory where the results of the culling will be written.
-    :type parsedPDB:    string
+    A manifest of the subsets (Manifest.json in the directory of subsets) records the hash of the inputs and parameters that each subset
+    was generated from, and the hash of the file written. A subset whose inputs and parameters are unchanged since it was last written is
+    skipped, and a subset that is regenerated but whose file would be identical to the existing one leaves the existing file untouched.
+
+    :param parsedPDB:           The directory where the results of the culling will be written.
+    :type parsedPDB:            string
+    :param workers:             The number of processes to use when generating the subsets.
+    :type workers:              int
+    :param compressionLevel:    The gzip compression level to write the subsets with.
+    :type compressionLevel:     int
+    :param fileSubsetSpec:      The location of a JSON file specifying the subsets to generate (in the same form as defaultSubsetSpec), or
+                                None to generate the subsets in defaultSubsetSpec.
+    :type fileSubsetSpec:       string
+    :param force:               Whether to regenerate every subset, even those whose inputs and parameters are unchanged.
+    :type force:                boolean
 
     """
 
@@ -15,79 +73,479 @@ def main(parsedPDB):
     if not os.path.exists(subsetsDir):
         os.mkdir(subsetsDir)
 
-    # Define the combinations of resolution, r value and sequence identity to use.
-    resolutionsOfInterest = [1.6, 1.8, 2.0, 2.2, 2.4, 2.5, 2.6, 2.8, 3.0]
-    rValuesOfInterest = [0.25, 0.5, 0.75, 1.0]
-    sequenceIdentities = [20, 25, 30, 40, 50, 60, 70, 80, 90]
-    tuplesToDo = [(i, j, k) for i in resolutionsOfInterest for j in rValuesOfInterest for k in sequenceIdentities]
-    tuplesToDo.extend([(100.0, 1.0, i) for i in sequenceIdentities])
-    tuplesToDo = set(tuplesToDo)
+    # Determine the subsets to generate.
+    subsetSpec = defaultSubsetSpec
+    if fileSubsetSpec is not None:
+        with open(fileSubsetSpec, 'r') as readSubsetSpec:
+            subsetSpec = json.load(readSubsetSpec)
+    subsets = expand_subset_spec(subsetSpec)
+
+    # Load the chain, similarity and sequence information once, rather than once per subset.
+    loadStage = profiling.begin_stage('load')
+    fileChainStore, fileEdges = prepare_stores(parsedPDB)
+    inputsDigest = file_digest([fileChainStore, fileEdges])
+    profiling.end_stage(loadStage)
+
+    # Determine the subsets that need generating.
+    fileManifest = subsetsDir + '/Manifest.json'
+    oldManifest = {}
+    if os.path.exists(fileManifest):
+        with open(fileManifest, 'r') as readManifest:
+            oldManifest = json.load(readManifest)
+    manifest = {}
+    subsetsToWrite = []
+    for predicates, seqIdentity, outputName in subsets:
+        parameters = [subsetFormat, inputsDigest, [list(i) for i in predicates], seqIdentity, compressionLevel]
+        inputsHash = hashlib.sha1(json.dumps(parameters).encode('utf-8')).hexdigest()
+        oldEntry = oldManifest.get(outputName, {})
+        manifest[outputName] = {'inputs' : inputsHash, 'output' : oldEntry.get('output')}
+        outputExists = oldEntry.get('output') is not None and os.path.exists(subsetsDir + '/' + outputName)
+        if force or oldEntry.get('inputs') != inputsHash or not outputExists:
+            subsetsToWrite.append((predicates, seqIdentity, outputName, oldEntry.get('output') if outputExists else None))
+
+    # The subsets are grouped by the filter predicates used to select the chains to cull, as every subset in a group culls the same chains
+    # (only the sequence identity differs). The groups are ordered by their predicates, so that groups sharing predicates are generally
+    # handled one after another (and by the same process), and reuse the masks of the predicates they share.
+    subsetsToDo = {}
+    for predicates, seqIdentity, outputName, oldOutputHash in subsetsToWrite:
+        subsetsToDo.setdefault(predicates, []).append((seqIdentity, subsetsDir + '/' + outputName, oldOutputHash))
+    subsetsToDo = [(i, subsetsToDo[i], compressionLevel) for i in sorted(subsetsToDo)]
 
     # Generate the culled lists.
-    for i in tuplesToDo:
-        resolution = i[0]
-        rValue = i[1]
-        seqIdentity = i[2]
-        includeNonXrayAndCAOnly = 1 if resolution == 100.0 else 0
-
-        # Determine the chains that meet the criteria.
-        toCull = {}
-        fileChains = parsedPDB + '/Chains.tsv'
-        readChains = open(fileChains, 'r')
-        readChains.readline()  # Strip the header.
-        for line in readChains:
-            chunks = (line.strip()).split('\t')
-            chain = chunks[0]
-            res = float(chunks[1])
-            rVal = float(chunks[2])
-            seqLen = int(chunks[3])
-            nonXRay = 1 if chunks[4] == 'yes' else 0
-            alphaCarbonOnly = 1 if chunks[5] == 'yes' else 0
-            reprGroup = chunks[6]
-            if (res <= resolution) and (rVal <= rValue) and (seqLen >= 40) and (nonXRay <= includeNonXrayAndCAOnly) and (alphaCarbonOnly <= includeNonXrayAndCAOnly):
-                toCull[reprGroup] = chain
-        readChains.close()
-
-        # Determine similarities between representative groups that need culling.
-        adjList = {}
-        fileSimilarity = parsedPDB + '/Similarity.tsv'
-        readSimilarity = open(fileSimilarity, 'r')
-        readSimilarity.readlines()  # Strip header.
-        for line in readSimilarity:
-            chunks = (line.strip()).split('\t')
-            chainA = chunks[0]
-            chainB = chunks[1]
-            if chainA in toCull and chainB in toCull and float(chunks[3]) >= seqIdentity:
-                # The sequences are in the set to be culled and are too similar.
-                if chainA in adjList:
-                    adjList[chainA].add(chainB)
-                else:
-                    adjList[chainA] = set([chainB])
-                if chainB in adjList:
-                    adjList[chainB].add(chainA)
-                else:
-                    adjList[chainB] = set([chainA])
-        readSimilarity.close()
-
-        # Perform the culling.
-        chainsToRemove = Leafcull.main(adjList)
-        chainsToKeep = [toCull[i] for i in toCull if not i in chainsToRemove]
-
-        # Write out the kept chains.
-        xrayCAInfo = '_INCLNONXRAY_INCLCAONLY' if includeNonXrayAndCAOnly else ''
-        outputLocation = subsetsDir + '/SeqIden_' + str(seqIdentity) + '_Res_' + str(resolution) + '_RVal_' + str(rValue) + xrayCAInfo + '.fasta.gz'
-        with gzip.open(outputLocation, 'w') as writeKept:
-            fileAllFasta = parsedPDB + '/AllChains.fasta'
-            readAllFasta = open(fileAllFasta, 'r')
+    cullStage = profiling.begin_stage('cull')
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, set_culling_data, (fileChainStore, fileEdges))
+        subsetsWritten = pool.imap_unordered(write_subsets, subsetsToDo)
+    else:
+        set_culling_data(fileChainStore, fileEdges)
+        subsetsWritten = map(write_subsets, subsetsToDo)
+    for i in subsetsWritten:
+        for outputLocation, outputHash, cullTime, subsetStatistics in i:
+            manifest[os.path.basename(outputLocation)]['output'] = outputHash
+            profiling.record('culled subsets', os.path.basename(outputLocation), cullTime, **subsetStatistics)
+    if workers > 1:
+        pool.close()
+        pool.join()
+    profiling.end_stage(cullStage, len(subsetsToWrite))
+
+    # Record the subsets generated, only rewriting the manifest when it has changed.
+    if manifest != oldManifest:
+        with open(fileManifest + '.tmp', 'w') as writeManifest:
+            json.dump(manifest, writeManifest, indent=1, sort_keys=True)
+            writeManifest.write('\n')
+        os.replace(fileManifest + '.tmp', fileManifest)
+
+def expand_subset_spec(subsetSpec):
+    """Determine the subsets specified by a subset specification.
+
+    :param subsetSpec:  The subset specification (see defaultSubsetSpec).
+    :type subsetSpec:   dictionary
+    :returns :          The filter predicates, sequence identity and output file name of each subset. The predicates of a subset are a
+                        sorted tuple of (column, comparison, value) tuples.
+    :type :             list
+
+    """
+
+    subsets = []
+    outputNames = set([])
+    for subsetGrid in subsetSpec['subsets']:
+        grid = subsetGrid.get('grid', {})
+        for axis in grid:
+            if not axis in gridAxes:
+                raise ValueError('Unknown subset grid axis ' + axis + '.')
+        if not grid.get('seqIdentity'):
+            raise ValueError('Every subset grid needs at least one seqIdentity.')
+        if not 'name' in subsetGrid:
+            raise ValueError('Every subset grid needs a name template.')
+        filters = []
+        for column, comparison, value in subsetGrid.get('filters', []):
+            if not column in filterColumns or not comparison in filterOperators:
+                raise ValueError('Unknown subset filter ' + ' '.join([str(column), str(comparison), str(value)]) + '.')
+            filters.append((column, comparison, value))
+
+        axes = sorted(grid)
+        for values in itertools.product(*[grid[i] for i in axes]):
+            gridPoint = dict(zip(axes, values))
+            predicates = set(filters)
+            for axis in axes:
+                if gridAxes[axis] is not None:
+                    predicates.add(gridAxes[axis] + (gridPoint[axis],))
+            outputName = subsetGrid['name'].format(**gridPoint)
+            if outputName in outputNames:
+                raise ValueError('More than one subset is named ' + outputName + '.')
+            outputNames.add(outputName)
+            subsets.append((tuple(sorted(predicates)), gridPoint['seqIdentity'], outputName))
+
+    return subsets
+
+def prepare_stores(parsedPDB):
+    """Ensure that the chain and similarity stores are present and up to date.
+
+    If the chain store is not present (e.g. the parsing was run by an older version, so the store is missing or in an older format), then it
+    is created from the FASTA file of all chains. Similarly, if the similarity store is not present or does not match the chain store and
+    similarity file, then it is created from the similarity file. The similarity file is only needed when the similarity store is created.
+
+    :param parsedPDB:   The directory containing the results of the parsing.
+    :type parsedPDB:    string
+    :returns :          The locations of the chain store and the similarity store.
+    :type :             string, string
+
+    """
+
+    fileChainStore = parsedPDB + '/ChainStore.bin'
+    if not chainstore.is_current(fileChainStore):
+        chainstore.from_fasta(parsedPDB + '/AllChains.fasta', fileChainStore)
+    chainTable = load_chains(fileChainStore)
+    fileSimilarity = parsedPDB + '/Similarity.tsv'
+    fileEdges = parsedPDB + '/Similarity.bin'
+    if not similarity_store_current(fileEdges, fileSimilarity, chainTable):
+        processPSIoutput.merge([fileSimilarity], set(chainTable['groups']), None, fileEdges=fileEdges, groupOrder=chainTable['groups'])
+    return fileChainStore, fileEdges
+
+def set_culling_data(fileChainStore, fileEdges):
+    """Set the data used when generating subsets in the current process.
+
+    The chain and similarity stores are memory-mapped by each process, so they are shared between processes through the page cache.
+
+    :param fileChainStore:  The location of the chain store.
+    :type fileChainStore:   string
+    :param fileEdges:       The location of the similarity store.
+    :type fileEdges:        string
+
+    """
+
+    global cullingData
+    cullingData = (load_chains(fileChainStore), load_similarities(fileEdges))
+
+def write_subsets(subsets):
+    """Generate the culled subsets that share the same filter predicates, and write out the FASTA records of the chains kept in each.
+
+    The chains eligible for culling are determined once and reused for every sequence identity. The subsets are culled from the highest
+    sequence identity to the lowest, so that the similarity graph of each subset is built by adding to the graph of the previous one, and
+    each similarity is only examined once (see cull_at_identity).
+
+    Each subset is written to a temporary file that then replaces the output file, so that an output file is never seen partially written.
+    The gzip header records a fixed modification time and the name of the output file, so that the same subset is always written out as
+    the same bytes. If these are the same as the bytes of the existing output file, then the existing file is left untouched.
+
+    :param subsets: The filter predicates, the sequence identity, output location and hash of the existing output file (None if there is
+                    no existing file) of each subset to generate, and the gzip compression level.
+    :type subsets:  tuple
+    :returns :      The location of each subset that was written, the hash of its file, the time taken (in seconds) to cull and write it,
+                    and the statistics of the culling (the numbers of eligible groups, similarities and chains kept, whether the existing
+                    file was left untouched, and the statistics recorded by Leafcull). The time taken to determine the eligible groups
+                    is included in the first subset.
+    :type :         list
+
+    """
+
+    predicates, identitiesToDo, compressionLevel = subsets
+    chainTable, similarities = cullingData
+
+    startTime = time.perf_counter()
+    toCull = groups_from_mask(chainTable, filter_mask(chainTable, predicates))
+
+    subsetsWritten = []
+    graph = {'adjList' : {}, 'edges' : 0, 'eligibleEdges' : 0}
+    for seqIdentity, outputLocation, oldOutputHash in sorted(identitiesToDo, key=lambda x : -x[0]):
+        statistics = {'eligibleGroups' : len(toCull)}
+        chainsToKeep = cull_at_identity(toCull, similarities, seqIdentity, statistics, graph)
+        statistics['chainsKept'] = len(chainsToKeep)
+
+        # Write out the kept chains, in the order that they appear in the chain store.
+        with open(outputLocation + '.tmp', 'wb') as writeTemporary:
+            with gzip.GzipFile(outputLocation, 'wb', compressionLevel, writeTemporary, mtime=0) as writeKept:
+                for i in sorted(chainsToKeep):
+                    writeKept.write(chainstore.fasta_record(chainTable['store'], i))
+        outputHash = file_digest([outputLocation + '.tmp'])
+        statistics['unchanged'] = outputHash == oldOutputHash
+        if statistics['unchanged']:
+            os.remove(outputLocation + '.tmp')
+        else:
+            os.replace(outputLocation + '.tmp', outputLocation)
+
+        subsetsWritten.append((outputLocation, outputHash, time.perf_counter() - startTime, statistics))
+        startTime = time.perf_counter()
+
+    return subsetsWritten
+
+def cull(chainTable, similarities, resolution, rValue, seqIdentity, minLength, includeNonXrayAndCAOnly):
+    """Determine the chains that are kept when culling at a given set of quality criteria.
+
+    :param chainTable:              The chain information, as returned by load_chains.
+    :type chainTable:               dictionary
+    :param similarities:            The similarities between representative groups, as returned by load_similarities.
+    :type similarities:             tuple
+    :param resolution:              The maximum permissible resolution.
+    :type resolution:               float
+    :param rValue:                  The maximum permissible R value.
+    :type rValue:                   float
+    :param seqIdentity:             The sequence identity at or above which two representative groups are deemed redundant.
+    :type seqIdentity:              float
+    :param minLength:               The minimum permissible sequence length.
+    :type minLength:                int
+    :param includeNonXrayAndCAOnly: Whether non-X-ray and alpha carbon only chains are permissible (1) or not (0).
+    :type includeNonXrayAndCAOnly:  int
+    :returns :                      The chains that are kept.
+    :type :                         set
+
+    """
+
+    toCull = eligible_groups(chainTable, resolution, rValue, minLength, includeNonXrayAndCAOnly)
+    return set([chainTable['chain'][i] for i in cull_at_identity(toCull, similarities, seqIdentity)])
+
+def cull_at_identity(toCull, similarities, seqIdentity, statistics=None, graph=None):
+    """Determine the chains that are kept when culling the eligible representative groups at a given sequence identity.
+
+    As the similarities are sorted from most to least similar, the similarities at or above any sequence identity are a prefix of them, and
+    only that prefix is examined. The graph of a lower sequence identity therefore contains the graph of a higher one, and is built up in the
+    same order, so extending the graph of a higher sequence identity (by examining only the similarities between the two sequence
+    identities) gives exactly the graph that would be built from scratch (Leafcull does not alter the graph).
+
+    :param toCull:          The chain chosen for each representative group eligible for culling, as returned by eligible_groups.
+    :type toCull:           dictionary
+    :param similarities:    The similarities between representative groups, as returned by load_similarities.
+    :type similarities:     tuple
+    :param seqIdentity:     The sequence identity at or above which two representative groups are deemed redundant.
+    :type seqIdentity:      float
+    :param statistics:      If not None, the number of similarities between eligible representative groups ('similarities') and the
+                            statistics of the culling (see Leafcull.main) are added to this.
+    :type statistics:       dictionary
+    :param graph:           If not None, the similarity graph ('adjList'), the number of similarities examined to build it ('edges') and the
+                            number of them that are in it ('eligibleEdges') from culling the same groups at a higher or equal sequence
+                            identity. The graph is extended rather than rebuilt, and this is updated to hold the extended graph.
+    :type graph:            dictionary
+    :returns :              The indices of the chains that are kept.
+    :type :                 set
+
+    """
+
+    # Determine similarities between representative groups that need culling.
+    groupA, groupB, similarity = similarities
+    numberOfEdges = edgestore.edges_at_identity(similarity, seqIdentity)
+    if graph is None or graph['edges'] > numberOfEdges:
+        graph = {'adjList' : {}, 'edges' : 0, 'eligibleEdges' : 0}
+    adjList = graph['adjList']
+    eligibleEdges = graph['eligibleEdges']
+    for chainA, chainB in zip(groupA[graph['edges']:numberOfEdges], groupB[graph['edges']:numberOfEdges]):
+        if chainA in toCull and chainB in toCull:
+            # The sequences are in the set to be culled and are too similar.
+            eligibleEdges += 1
+            if chainA in adjList:
+                adjList[chainA].add(chainB)
+            else:
+                adjList[chainA] = set([chainB])
+            if chainB in adjList:
+                adjList[chainB].add(chainA)
+            else:
+                adjList[chainB] = set([chainA])
+
+    graph['edges'] = numberOfEdges
+    graph['eligibleEdges'] = eligibleEdges
+    if statistics is not None:
+        statistics['similarities'] = eligibleEdges
+
+    # Perform the culling.
+    chainsToRemove = set(Leafcull.main(adjList, statistics=statistics))
+    return set([toCull[i] for i in toCull if not i in chainsToRemove])
+
+def eligible_groups(chainTable, resolution, rValue, minLength, includeNonXrayAndCAOnly):
+    """Determine the representative groups that have a chain that meets a given set of quality criteria.
+
+    :param chainTable:              The chain information, as returned by load_chains.
+    :type chainTable:               dictionary
+    :param resolution:              The maximum permissible resolution.
+    :type resolution:               float
+    :param rValue:                  The maximum permissible R value.
+    :type rValue:                   float
+    :param minLength:               The minimum permissible sequence length.
+    :type minLength:                int
+    :param includeNonXrayAndCAOnly: Whether non-X-ray and alpha carbon only chains are permissible (1) or not (0).
+    :type includeNonXrayAndCAOnly:  int
+    :returns :                      A mapping from the index of each eligible representative group to the index of the chain chosen for it. If
+                                    more than one chain from a representative group meets the criteria, then the last one is chosen.
+    :type :                         dictionary
+
+    """
+
+    return groups_from_mask(chainTable, eligible_mask(chainTable, resolution, rValue, minLength, includeNonXrayAndCAOnly))
+
+def groups_from_mask(chainTable, mask):
+    """Determine the representative groups that have a chain selected by a mask.
+
+    :param chainTable:  The chain information, as returned by load_chains.
+    :type chainTable:   dictionary
+    :param mask:        A mask with a 1 for each selected chain and a 0 for each other chain.
+    :type mask:         bytearray
+    :returns :          A mapping from the index of each representative group with a selected chain to the index of the chain chosen for it.
+                        If more than one chain from a representative group is selected, then the last one is chosen.
+    :type :             dictionary
+
+    """
+
+    toCull = {}
+    reprGroup = chainTable['reprGroup']
+    for index in itertools.compress(range(len(mask)), mask):
+        toCull[reprGroup[index]] = index
+    return toCull
+
+def eligible_mask(chainTable, resolution, rValue, minLength, includeNonXrayAndCAOnly):
+    """Determine which chains meet a given set of quality criteria.
+
+    :param chainTable:              The chain information, as returned by load_chains.
+    :type chainTable:               dictionary
+    :param resolution:              The maximum permissible resolution.
+    :type resolution:               float
+    :param rValue:                  The maximum permissible R value.
+    :type rValue:                   float
+    :param minLength:               The minimum permissible sequence length.
+    :type minLength:                int
+    :param includeNonXrayAndCAOnly: Whether non-X-ray and alpha carbon only chains are permissible (1) or not (0).
+    :type includeNonXrayAndCAOnly:  int
+    :returns :                      A mask with a 1 for each chain that meets the criteria and a 0 for each one that does not.
+    :type :                         bytearray
+
+    """
+
+    predicates = [('resolution', '<=', resolution), ('rValue', '<=', rValue), ('length', '>=', minLength)]
+    if not includeNonXrayAndCAOnly:
+        predicates.extend([('nonXRay', '==', 0), ('alphaCarbonOnly', '==', 0)])
+    return filter_mask(chainTable, predicates)
+
+def filter_mask(chainTable, predicates):
+    """Determine which chains satisfy every one of a set of filter predicates.
+
+    The mask of each predicate is computed once per chain table (see predicate_mask), and the masks are combined a whole mask at a time by
+    treating each mask as one large integer (as every byte of a mask is 0 or 1, a bitwise and of the integers is a bytewise and of the masks).
+
+    :param chainTable:  The chain information, as returned by load_chains.
+    :type chainTable:   dictionary
+    :param predicates:  The (column, comparison, value) of each predicate (see filterColumns and filterOperators).
+    :type predicates:   iterable
+    :returns :          A mask with a 1 for each chain that satisfies the predicates and a 0 for each one that does not.
+    :type :             bytearray
+
+    """
+
+    numberOfChains = len(chainTable['chain'])
+    combinedMask = int.from_bytes(b'\x01' * numberOfChains, 'little')
+    for i in predicates:
+        combinedMask &= int.from_bytes(predicate_mask(chainTable, i), 'little')
+    return bytearray(combinedMask.to_bytes(numberOfChains, 'little'))
+
+def predicate_mask(chainTable, predicate):
+    """Determine which chains satisfy a filter predicate.
+
+    The masks are cached in the chain table ('masks'), so that subsets sharing a predicate (e.g. the same maximum resolution) only test
+    the chains against it once. A chain whose count of atoms, alpha carbons or residues is not known satisfies no predicate on that count.
+
+    :param chainTable:  The chain information, as returned by load_chains.
+    :type chainTable:   dictionary
+    :param predicate:   The column, comparison and value of the predicate (see filterColumns and filterOperators).
+    :type predicate:    tuple
+    :returns :          A mask with a 1 for each chain that satisfies the predicate and a 0 for each one that does not.
+    :type :             bytearray
+
+    """
+
+    masks = chainTable.setdefault('masks', {})
+    predicate = tuple(predicate)
+    if not predicate in masks:
+        column, comparison, value = predicate
+        if len(masks) >= maskCacheSize:
+            masks.clear()
+        values = chainTable[filterColumns[column]]
+        if column in countColumns:
+            masks[predicate] = bytearray([0 if i is None or i == chainstore.unknownCount else filterOperators[comparison](i, value) for i in values])
+        else:
+            masks[predicate] = bytearray(map(filterOperators[comparison], values, itertools.repeat(value, len(values))))
+    return masks[predicate]
+
+def load_chains(fileChainStore):
+    """Load the chain information from a chain store.
+
+    The numeric columns are memoryviews onto the memory-mapped store, and the representative groups are the indices of the chains' unique
+    sequences in the store.
+
+    :param fileChainStore:  The location of the chain store.
+    :type fileChainStore:   string
+    :returns :              The columns of the chain information, keyed by column name, along with the chain identifiers ('chain'), the
+                            representative group names ('groups'), a mapping from each representative group name to its index ('groupIndices')
+                            and the chain store itself ('store').
+    :type :                 dictionary
+
+    """
+
+    store = chainstore.load(fileChainStore)
+    chainTable = {'chain' : [chainstore.chain_id(store, i) for i in range(store['numberOfChains'])], 'res' : store['res'],
+                  'rVal' : store['rFactorObs'], 'rFree' : store['rFactorFree'], 'seqLen' : store['length'], 'nonXRay' : store['nonXRay'],
+                  'alphaCarbonOnly' : store['alphaCarbonOnly'], 'atoms' : store['atoms'], 'alphaCarbons' : store['alphaCarbons'],
+                  'residues' : store['residues'], 'reprGroup' : store['sequenceIndex'],
+                  'groups' : [chainstore.group_id(store, i) for i in range(store['numberOfSequences'])], 'store' : store, 'masks' : {}}
+    chainTable['groupIndices'] = dict((group, index) for index, group in enumerate(chainTable['groups']))
+
+    return chainTable
+
+def load_similarities(fileEdges):
+    """Load the similarities between representative groups from a similarity store, sorted from most to least similar.
+
+    The indices of the representative groups in the similarity store are the indices of the unique sequences in the chain store (see
+    similarity_store_current).
+
+    :param fileEdges:   The location of the similarity store.
+    :type fileEdges:    string
+    :returns :          The indices of the first groups, the indices of the second groups and the similarities (in hundredths of a percent)
+                        of each pair of groups.
+    :type :             memoryview, memoryview, memoryview
+
+    """
+
+    edges = edgestore.load(fileEdges, False)
+    return edges['groupA'], edges['groupB'], edges['identity']
+
+def file_digest(files):
+    """Determine the SHA-1 hash of the contents of a number of files.
+
+    :param files:   The locations of the files, in the order that their contents are hashed.
+    :type files:    list
+    :returns :      The hexadecimal hash of the size and contents of each file (the sizes are included so that moving bytes from the end of
+                    one file to the start of the next changes the hash).
+    :type :         string
+
+    """
+
+    digest = hashlib.sha1()
+    for i in files:
+        digest.update(str(os.path.getsize(i)).encode('ascii') + b'\n')
+        with open(i, 'rb') as readFile:
             while True:
-                # Read the file two lines at a time.
-                identifierLine = readAllFasta.readline()
-                sequence = readAllFasta.readline()
-                if not sequence:
-                    # Reached the end of the file when there is no second line.
+                block = readFile.read(1 << 20)
+                if not block:
                     break
+                digest.update(block)
+    return digest.hexdigest()
+
+def similarity_store_current(fileEdges, fileSimilarity, chainTable):
+    """Determine whether a similarity store is up to date.
+
+    :param fileEdges:       The location of the similarity store.
+    :type fileEdges:        string
+    :param fileSimilarity:  The location of the file containing the similarity information.
+    :type fileSimilarity:   string
+    :param chainTable:      The chain information, as returned by load_chains.
+    :type chainTable:       dictionary
+    :returns :              Whether the similarity store exists, is intact, is no older than the similarity file (if there is one) and
+                            indexes the representative groups in the same order as the chain store.
+    :type :                 boolean
+
+    """
 
-                chain = identifierLine[1:6]  # Get the chain identifier.
-                if chain in chainsToKeep:
-                    writeKept.write(bytes(identifierLine + sequence, 'UTF-8'))
-            readAllFasta.close()
\ No newline at end of file
+    if not os.path.exists(fileEdges):
+        return False
+    if os.path.exists(fileSimilarity) and os.path.getmtime(fileEdges) < os.path.getmtime(fileSimilarity):
+        return False
+    try:
+        edges = edgestore.load(fileEdges)
+    except ValueError:
+        return False
+    return edges['groupIDs'] == chainTable['store']['groupIDs']
@@ -0,0 +1,272 @@
+'''
+Find high identity pairs of sequences without BLASTing, using an index of the minimizers of the sequences.
+
+A minimizer is the k-mer with the smallest hash in a window of consecutive k-mers. Two sequences that share a long enough identical stretch
+share the minimizers of it, and the shared minimizers of a pair of similar sequences mostly lie on the same diagonal (the difference between
+their positions in the two sequences). Pairs sharing enough minimizers on a diagonal are candidates, and the identity of each candidate is
+determined by aligning the sequences in a band around the diagonal.
+
+Only pairs with a high sequence identity are reliably found, so this is only a substitute for PSI-BLAST when the culling is performed at
+high sequence identities.
+'''
+
+import multiprocessing
+import zlib
+import processPSIoutput
+
+# The minimizer index and sequences used when searching. This is set once in each process that searches, so that worker processes share the
+# index (inherited on fork) rather than having it sent to them with every query.
+searchData = None
+
+def main(fileQueryFasta, fileReprFasta, outputLocation, minIdentity=70.0, kmerSize=5, windowSize=8, minShared=2, maxOccurrences=2000,
+         bandWidth=16, minAlignLength=20, workers=1, memoryLimit=2 ** 30):
+    """Find the pairs of sequences that are at or above a given sequence identity, and write them out in the same format as processPSIoutput.
+
+    :param fileQueryFasta:  The FASTA file of the sequences to find the similar sequences of.
+    :type fileQueryFasta:   string
+    :param fileReprFasta:   The FASTA file of the sequences to search (normally ReprChains.fasta).
+    :type fileReprFasta:    string
+    :param outputLocation:  The location where the similarity information will be written.
+    :type outputLocation:   string
+    :param minIdentity:     The minimum sequence identity (as a percentage) for a pair to be recorded.
+    :type minIdentity:      float
+    :param kmerSize:        The length of the k-mers.
+    :type kmerSize:         int
+    :param windowSize:      The number of consecutive k-mers to choose each minimizer from.
+    :type windowSize:       int
+    :param minShared:       The minimum number of minimizers a pair must share on a diagonal to be aligned.
+    :type minShared:        int
+    :param maxOccurrences:  The maximum number of sequences a minimizer can occur in to be used (very common minimizers come from low
+                            complexity regions and tags, and are not informative).
+    :type maxOccurrences:   int
+    :param bandWidth:       The maximum distance from the diagonal that the alignment can stray.
+    :type bandWidth:        int
+    :param minAlignLength:  The minimum permissible alignment length required for a pair to be recorded.
+    :type minAlignLength:   int
+    :param workers:         The number of processes to use when searching.
+    :type workers:          int
+    :param memoryLimit:     The approximate number of bytes of memory to use for holding the pairs (see processPSIoutput).
+    :type memoryLimit:      int
+
+    """
+
+    names, sequences = read_fasta(fileReprFasta)
+    sequenceIndices = dict((name, index) for index, name in enumerate(names))
+    queryNames, querySequences = read_fasta(fileQueryFasta)
+    queries = [(name, sequenceIndices.get(name, -1), sequence) for name, sequence in zip(queryNames, querySequences)]
+    settings = {'minIdentity' : minIdentity, 'kmerSize' : kmerSize, 'windowSize' : windowSize, 'minShared' : minShared, 'bandWidth' : bandWidth,
+                'minAlignLength' : minAlignLength}
+
+    index = build_index(sequences, kmerSize, windowSize, maxOccurrences)
+    # A pair of queries only needs to be searched for once, from the query that comes first in fileReprFasta.
+    queried = bytearray(len(sequences))
+    for name, sequenceIndex, sequence in queries:
+        if sequenceIndex >= 0:
+            queried[sequenceIndex] = 1
+
+    similaritiesFound = processPSIoutput.open_similarities(outputLocation, memoryLimit)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers, set_search_data, (names, sequences, index, queried, settings))
+        hits = pool.imap(search_query, queries, 64)
+    else:
+        set_search_data(names, sequences, index, queried, settings)
+        hits = map(search_query, queries)
+    for query, hitsFound in zip(queryNames, hits):
+        processPSIoutput.record_hits(query, hitsFound, similaritiesFound)
+    if workers > 1:
+        pool.close()
+        pool.join()
+    processPSIoutput.write_similarities(similaritiesFound)
+
+def set_search_data(names, sequences, index, queried, settings):
+    """Set the data used when searching in the current process.
+
+    :param names:       The names of the sequences to search.
+    :type names:        list
+    :param sequences:   The sequences to search.
+    :type sequences:    list
+    :param index:       The minimizer index of the sequences, as returned by build_index.
+    :type index:        dictionary
+    :param queried:     A 1 for each sequence that is also a query, and a 0 for each one that is not.
+    :type queried:      bytearray
+    :param settings:    The settings of the search (see main).
+    :type settings:     dictionary
+
+    """
+
+    global searchData
+    searchData = (names, sequences, index, queried, settings)
+
+def search_query(query):
+    """Find the sequences that are similar to a query.
+
+    :param query:   The name of the query, its index in the searched sequences (-1 if it is not one of them) and its sequence.
+    :type query:    tuple
+    :returns :      The sequence identity of each sequence similar to the query, keyed by the name of the sequence.
+    :type :         dictionary
+
+    """
+
+    names, sequences, index, queried, settings = searchData
+    name, queryIndex, querySequence = query
+
+    # Count the minimizers shared with each sequence on each diagonal.
+    diagonalCounts = {}
+    for minimizer, queryPosition in minimizers(querySequence, settings['kmerSize'], settings['windowSize']):
+        for target, targetPosition in index.get(minimizer, ()):
+            if target != queryIndex and not (queried[target] and target < queryIndex):
+                key = (target, queryPosition - targetPosition)
+                diagonalCounts[key] = diagonalCounts.get(key, 0) + 1
+
+    # Determine the best diagonal of each candidate.
+    candidates = {}
+    for (target, diagonal), count in diagonalCounts.items():
+        if count >= settings['minShared'] and count > candidates.get(target, (0, 0))[0]:
+            candidates[target] = (count, diagonal)
+
+    hitsFound = {}
+    for target in sorted(candidates):
+        identity, alignLength = align_on_diagonal(querySequence, sequences[target], candidates[target][1], settings['bandWidth'])
+        if identity >= settings['minIdentity'] and alignLength >= settings['minAlignLength']:
+            hitsFound[names[target]] = identity
+    return hitsFound
+
+def align_on_diagonal(sequenceA, sequenceB, diagonal, bandWidth):
+    """Determine the sequence identity of two sequences.
+
+    If the sequences are aligned well enough without gaps along the diagonal, then the identity of the ungapped alignment is used. Otherwise
+    the sequences are locally aligned (match 2, mismatch -1, gap -3), with the alignment restricted to a band around the diagonal.
+
+    :param sequenceA:   The first sequence.
+    :type sequenceA:    string
+    :param sequenceB:   The second sequence.
+    :type sequenceB:    string
+    :param diagonal:    The offset of sequenceA's positions from the aligned positions in sequenceB.
+    :type diagonal:     int
+    :param bandWidth:   The maximum distance from the diagonal that the alignment can stray.
+    :type bandWidth:    int
+    :returns :          The sequence identity (as a percentage, rounded to two decimal places, as PSI-BLAST reports it) and the length of
+                        the alignment.
+    :type :             float, int
+
+    """
+
+    # Try the ungapped alignment first, as it is much quicker and is sufficient for the most similar pairs.
+    overlapA = sequenceA[max(diagonal, 0):]
+    overlapB = sequenceB[max(-diagonal, 0):]
+    overlap = min(len(overlapA), len(overlapB))
+    if overlap:
+        matches = sum([i == j for i, j in zip(overlapA, overlapB)])
+        if matches >= 0.9 * overlap:
+            return round(100.0 * matches / overlap, 2), overlap
+
+    # Banded local alignment. Each cell holds the score, number of identical positions and length of the best alignment ending at it.
+    empty = (0, 0, 0)
+    previousRow = {}
+    best = empty
+    for i in range(1, len(sequenceA) + 1):
+        currentRow = {}
+        residueA = sequenceA[i - 1]
+        for j in range(max(1, i - diagonal - bandWidth), min(len(sequenceB), i - diagonal + bandWidth) + 1):
+            diagonalCell = previousRow.get(j - 1, empty)
+            if residueA == sequenceB[j - 1]:
+                cell = (diagonalCell[0] + 2, diagonalCell[1] + 1, diagonalCell[2] + 1)
+            else:
+                cell = (diagonalCell[0] - 1, diagonalCell[1], diagonalCell[2] + 1)
+            upCell = previousRow.get(j, empty)
+            if upCell[0] - 3 > cell[0]:
+                cell = (upCell[0] - 3, upCell[1], upCell[2] + 1)
+            leftCell = currentRow.get(j - 1, empty)
+            if leftCell[0] - 3 > cell[0]:
+                cell = (leftCell[0] - 3, leftCell[1], leftCell[2] + 1)
+            if cell[0] <= 0:
+                cell = empty
+            elif cell[0] > best[0]:
+                best = cell
+            currentRow[j] = cell
+        previousRow = currentRow
+
+    if not best[2]:
+        return 0.0, 0
+    return round(100.0 * best[1] / best[2], 2), best[2]
+
+def build_index(sequences, kmerSize, windowSize, maxOccurrences):
+    """Index the minimizers of a set of sequences.
+
+    :param sequences:       The sequences to index.
+    :type sequences:        list
+    :param kmerSize:        The length of the k-mers.
+    :type kmerSize:         int
+    :param windowSize:      The number of consecutive k-mers to choose each minimizer from.
+    :type windowSize:       int
+    :param maxOccurrences:  The maximum number of sequences a minimizer can occur in to be indexed.
+    :type maxOccurrences:   int
+    :returns :              The (sequence index, position) of each occurrence of each minimizer, keyed by the minimizer.
+    :type :                 dictionary
+
+    """
+
+    index = {}
+    for sequenceIndex, sequence in enumerate(sequences):
+        for minimizer, position in minimizers(sequence, kmerSize, windowSize):
+            if minimizer in index:
+                index[minimizer].append((sequenceIndex, position))
+            else:
+                index[minimizer] = [(sequenceIndex, position)]
+
+    for minimizer in [i for i in index if len(index[i]) > maxOccurrences]:
+        del index[minimizer]
+    return index
+
+def minimizers(sequence, kmerSize, windowSize):
+    """Determine the minimizers of a sequence.
+
+    The hash used is CRC-32, so that the minimizers are the same in every process.
+
+    :param sequence:    The sequence.
+    :type sequence:     string
+    :param kmerSize:    The length of the k-mers.
+    :type kmerSize:     int
+    :param windowSize:  The number of consecutive k-mers to choose each minimizer from.
+    :type windowSize:   int
+    :returns :          The (minimizer, position) of each distinct minimizer, in order of position.
+    :type :             list
+
+    """
+
+    encodedSequence = sequence.encode('ascii')
+    hashes = [zlib.crc32(encodedSequence[i:i + kmerSize]) for i in range(len(encodedSequence) - kmerSize + 1)]
+    found = []
+    lastPosition = -1
+    for start in range(max(len(hashes) - windowSize + 1, 1 if hashes else 0)):
+        window = hashes[start:start + windowSize]
+        position = start + window.index(min(window))
+        if position != lastPosition:
+            found.append((sequence[position:position + kmerSize], position))
+            lastPosition = position
+    return found
+
+def read_fasta(fileFasta):
+    """Read a FASTA file with one line per sequence.
+
+    :param fileFasta:   The location of the FASTA file.
+    :type fileFasta:    string
+    :returns :          The names (the identifier lines without the >) and the sequences.
+    :type :             list, list
+
+    """
+
+    names = []
+    sequences = []
+    readFasta = open(fileFasta, 'r')
+    while True:
+        # Read the file two lines at a time.
+        identifierLine = readFasta.readline().strip()
+        sequence = readFasta.readline().strip()
+        if not sequence:
+            # Reached the end of the file when there is no second line.
+            break
+        names.append(identifierLine[1:])
+        sequences.append(sequence)
+    readFasta.close()
+    return names, sequences
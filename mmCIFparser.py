@@ -1,153 +1,372 @@
-import gzip
+import codecs
+import mmap
+import os
 import re
+import zlib
 
-def main(mmCIFFile):
+# A single tokenizer for the item names and data values in a block. The alternatives are (in order of precedence):
+#   0) a bare value that does not start with a delimiter character (checked first as this is by far the most common case)
+#   1) a semi-colon delimited text field, which starts with a ; at the beginning of a line and ends at the next line that starts with a ;
+#   2) a '' delimited value, which ends at the first ' that is followed by whitespace
+#   3) a "" delimited value, which ends at the first " that is followed by whitespace
+#   4) a bare value, which is any run of non-whitespace characters
+# The tokens are returned with their delimiters still attached, so that findall() can be used to collect them.
+tokenizer = re.compile(r'''[^\s'";]\S*|^;[^\n]*(?:\n(?!;)[^\n]*)*\n;|'.*?'(?=\s|$)|".*?"(?=\s|$)|\S+''', re.MULTILINE)
+
+# Blocks that do not contain any of these can be tokenized with str.split().
+quotingCharacters = re.compile('[\'";]')
+
+# The line that separates the blocks of an mmCIF file.
+blockSeparator = '\n# \n'
+
+# The number of bytes of the gzipped file to read (and decompress) at a time.
+readSize = 1 << 20
+
+def main(mmCIFFile, requested=None, scanners=None, cacheDir=None):
     """Parse an mmCIF file that records one PDB entry in it.
 
+    Only the categories that are keys in requested are parsed. The blocks for all other categories are skipped without being tokenized.
+    If the value for a category is None then all of its items are recorded, otherwise only the items in the value are recorded.
+
+    A category can instead be handled by a scanner, which is given the text of the category's block and returns whatever is to be recorded
+    for the category. This allows large categories (e.g. _atom_site) to be summarised as they are read (see loop_rows), rather than having
+    every value recorded.
+
+    The file is decompressed and split into blocks as it is read, so only one block of the file is held in memory at a time.
+
     :param mmCIFFile:   The location of the gzipped mmCIF file to parse.
     :type mmCIFFile:    string
+    :param requested:   The categories (and their items) to parse, or None to parse the entire file.
+    :type requested:    dictionary
+    :param scanners:    The function to scan the block of a category with, keyed by the category.
+    :type scanners:     dictionary
+    :param cacheDir:    The directory to keep uncompressed copies of the mmCIF files in (see read_blocks), or None to not keep them.
+    :type cacheDir:     string
     :returns :          Tree structure of the mmCIF record along with the data.
     :type :             dictionary
 
     """
 
-    readFile = gzip.open(mmCIFFile, 'r')
-    mmCIFContent = readFile.read().decode('utf-8')
-    readFile.close()
+    dataDictionary = {}
+    for i in read_blocks(mmCIFFile, cacheDir):
+        if requested is None and not scanners:
+            parse_block(i, dataDictionary)
+        else:
+            category = block_category(i)
+            if scanners and category in scanners:
+                dataDictionary[category] = scanners[category](i)
+            elif requested is None:
+                parse_block(i, dataDictionary)
+            elif category in requested:
+                parse_block(i, dataDictionary, requested[category])
 
-    fileChunks = re.split('(?<=\n)# \n', mmCIFContent)[:-1]
+    return dataDictionary
 
-    entryID = fileChunks[1].split()[1]
-    dataDictionary = {}
-    entityIDs = []
-
-    for i in fileChunks[1:]:
-        # As the lines all end with newline characters, the final list element is always ''. [:-1] removes this.
-        # It is necessary to do it this way, rather than splitting (i.split()), as this method ensures that all lines that should end with a ' ' do so.
-        blockChunks = i.split('\n')[:-1]
-        if blockChunks[0] == 'loop_':
-            # A loop has been found, and therefore the block contains more than one data record.
-            blockDictionary = {}
-            # Record the name of the block.
-            blockName = re.match('_[a-zA-Z0-9_]+', blockChunks[1])
-            blockName = blockName.group(0)
-            subBlockNameOrder = []  # Stored the subBlockNames in the order that they are encountered.
-            currentNameOrderIndex = 0
-            subBlockData = ''
-            lookingAtLongDataReocrd = False
-            longDataRecordDelimiter = ''
-            secondLongDataReocrdDelimiter = False
-            lookingAtMultilineDataReocrd = False
-            dictSetUp = False
-            for j in blockChunks[1:]:
-                subBlockNameSearch = re.search('(?<=' + blockName + '.)[a-zA-Z0-9_]+', j)
-                if subBlockNameSearch:
-                    # If this is True, then the line contains something like _entity.id or _cell.angle_gamma_esd.
-                    subBlockNameOrder.append(subBlockNameSearch.group(0))
-                else:
-                    # If this is True, then the line contains a data record.
-                    if not dictSetUp:
-                        blockDictionary = dict([(k, []) for k in subBlockNameOrder])
-                        dictSetUp = True
-                    previousCharacter = ''
-                    for k in j:
-                        # Go through every character on the line.
-                        if lookingAtMultilineDataReocrd:
-                            if previousCharacter == '' and k == ';':
-                                # If this is True, then the beginning of a new line has been found, and the first character on the new line is a ;.
-                                # This means that the end of a multiline data record has been found.
-                                blockDictionary[subBlockNameOrder[currentNameOrderIndex]].append(subBlockData)
-                                lookingAtMultilineDataReocrd = False
-                                currentNameOrderIndex = (currentNameOrderIndex + 1) % len(subBlockNameOrder)
-                                subBlockData = ''
-                            else:
-                                # If this is True, then the current character is in the middle of a multiline data record.
-                                subBlockData += k
-                            previousCharacter = k
-                        elif lookingAtLongDataReocrd:
-                            if k == longDataRecordDelimiter:
-                                # If this is True, then the end of a '' or "" delimited data record has been found.
-                                subBlockData += k
-                                secondLongDataReocrdDelimiter = True
-                            elif previousCharacter == longDataRecordDelimiter and k == ' ' and secondLongDataReocrdDelimiter:
-                                lookingAtLongDataReocrd = False
-                                longDataRecordDelimiter = ''
-                                blockDictionary[subBlockNameOrder[currentNameOrderIndex]].append(subBlockData[:-1])
-                                currentNameOrderIndex = (currentNameOrderIndex + 1) % len(subBlockNameOrder)
-                                subBlockData = ''
-                            else:
-                                # If this is True, then the current character is in the middle of a long data record.
-                                subBlockData += k
-                            previousCharacter = k
-                        else:
-                            if previousCharacter == '' and k == ';':
-                                # If this is True, then the beginning of a multiline data record has been found.
-                                lookingAtMultilineDataReocrd = True
-                                previousCharacter = k
-                            elif k == '\'' or k == '"':
-                                # If this is True, then the beginning of a long data record has been found.
-                                lookingAtLongDataReocrd = True
-                                secondLongDataReocrdDelimiter = False
-                                longDataRecordDelimiter = k
-                                previousCharacter = k
-                            elif k == ' ':
-                                if subBlockData != '':
-                                    # If this is True, then the end of the current data record has been found.
-                                    blockDictionary[subBlockNameOrder[currentNameOrderIndex]].append(subBlockData)
-                                    currentNameOrderIndex = (currentNameOrderIndex + 1) % len(subBlockNameOrder)
-                                    subBlockData = ''
-                                previousCharacter = k
-                            else:
-                                # If this is True, then the current character is in the middle of a data record.
-                                subBlockData += k
-                                previousCharacter = k
+def read_blocks(mmCIFFile, cacheDir=None):
+    """Read the blocks (the text between two # lines) of a gzipped mmCIF file one at a time.
+
+    If a cache directory is given, then an uncompressed copy of the file is kept in it, and the copy is memory-mapped and read instead of the
+    gzipped file for as long as the gzipped file is not modified. The cached copies can be deleted at any time.
+
+    :param mmCIFFile:   The location of the gzipped mmCIF file to read.
+    :type mmCIFFile:    string
+    :param cacheDir:    The directory to keep uncompressed copies of the mmCIF files in, or None to not keep them.
+    :type cacheDir:     string
+    :returns :          A generator of the text of each block. The text before the first # line (the data_ line) and after the last one are
+                        not blocks, and are not generated.
+    :type :             generator
+
+    """
+
+    if cacheDir is None:
+        chunks = split_blocks(decompress_file(mmCIFFile))
+    else:
+        cachedFile = cacheDir + '/' + os.path.basename(mmCIFFile)[:-3]
+        if os.path.exists(cachedFile) and os.stat(cachedFile).st_mtime_ns == os.stat(mmCIFFile).st_mtime_ns:
+            chunks = mapped_blocks(cachedFile)
         else:
-            # There is no loop, and therefore the block only contains one data record.
-            blockDictionary = {}
-            # Record the name of the block.
-            blockName = re.match('_[a-zA-Z0-9_]+', blockChunks[0])
-            blockName = blockName.group(0)
-            lookingAtMultilineDataReocrd = False
-            for j in blockChunks:
-                subBlockNameSearch = re.search('(?<=' + blockName + '.)[a-zA-Z0-9_]+', j)
-                if subBlockNameSearch:
-                    # If this is True, then the line contains something like _entity.id or _cell.angle_gamma_esd.
-                    subBlockName = subBlockNameSearch.group(0)
-                    subBlockChunks = j.split(None, 1)
-                    if len(subBlockChunks) > 1:
-                        # If this is True, then there is data on the line along with the subBlockName.
-                        subBlockData = subBlockChunks[1].strip()
-                        if subBlockData[-1] == '\'' or subBlockData[-1] == '"':
-                            # Strip off leading and trailing '' or "".
-                            blockDictionary[subBlockName] = [subBlockData[1:-1]]
-                        else:
-                            blockDictionary[subBlockName] = [subBlockData]
-                    else:
-                        # There is no data on the line with the subBlockName. This means that the data is spread over
-                        # multiple lines, and is flanked by semi-colons.
-                        pass
-                else:
-                    # There is no subBlockName on the line. This means that the line contains some data to go along with
-                    # the most recently found subBlockName.
-                    if lookingAtMultilineDataReocrd:
-                        if j.strip() == ';':
-                            # If this is True, then the line ends a data record.
-                            lookingAtMultilineDataReocrd = False
-                            blockDictionary[subBlockName] = [subBlockData]
-                        else:
-                            subBlockData += j
-                    elif (j[0] == '\'' and j[-2:] == '\' ') or (j[0] == '"' and j[-2:] == '" '):
-                        # If this is true then the line is taken up with a long piece of data that is surrounded by '' or "".
-                        blockDictionary[subBlockName] = [j.strip()[1:-1]]
-                    elif j[0] == ';':
-                        # If this is True, then the line starts a data record.
-                        lookingAtMultilineDataReocrd = True
-                        subBlockData = j[1:]
+            chunks = split_blocks(decompress_file(mmCIFFile, cachedFile))
+
+    # Hold back one chunk, so that the chunk after the last # line is not generated.
+    next(chunks, None)
+    previousChunk = next(chunks, None)
+    for i in chunks:
+        yield previousChunk
+        previousChunk = i
+
+def decompress_file(mmCIFFile, cachedFile=None):
+    """Decompress a gzipped mmCIF file a piece at a time.
+
+    :param mmCIFFile:   The location of the gzipped mmCIF file.
+    :type mmCIFFile:    string
+    :param cachedFile:  The location to write an uncompressed copy of the file to, or None to not write one. The copy is given the same
+                        modification time as the gzipped file once it has been completely written, and is removed if the file cannot be
+                        completely read.
+    :type cachedFile:   string
+    :returns :          A generator of the decoded text of each piece.
+    :type :             generator
+
+    """
+
+    decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)  # Automatically detect the gzip header.
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    memberOpen = False
+    writeCache = open(cachedFile + '.tmp', 'wb') if cachedFile is not None else None
+    try:
+        with open(mmCIFFile, 'rb') as readFile:
+            while True:
+                compressed = readFile.read(readSize)
+                if not compressed:
+                    break
+                while compressed:
+                    # The output is limited to readSize bytes at a time, so that highly compressed data does not produce a large piece.
+                    uncompressed = decompressor.decompress(compressed, readSize)
+                    if writeCache:
+                        writeCache.write(uncompressed)
+                    yield decoder.decode(uncompressed)
+                    memberOpen = True
+                    if decompressor.eof:
+                        # A gzipped file can consist of multiple gzip members, each of which needs its own decompressor.
+                        compressed = decompressor.unused_data
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 32)
+                        memberOpen = False
                     else:
-                        # If this is True, then the line just contains a data record that is too long for one line, but does not need/use
-                        # the '' or "" long data record delimiters.
-                        blockDictionary[subBlockName] = [j.strip()]
+                        compressed = decompressor.unconsumed_tail
+        uncompressed = decompressor.flush()
+        if memberOpen:
+            raise EOFError(mmCIFFile + ' ended before the end of its last gzip member.')
+        if writeCache:
+            writeCache.write(uncompressed)
+            writeCache.close()
+            os.utime(cachedFile + '.tmp', ns=(os.stat(mmCIFFile).st_atime_ns, os.stat(mmCIFFile).st_mtime_ns))
+            os.replace(cachedFile + '.tmp', cachedFile)
+        yield decoder.decode(uncompressed, True)
+    finally:
+        # If the file could not be completely read (or the reading was abandoned), then the partial copy is discarded.
+        if writeCache:
+            writeCache.close()
+            if os.path.exists(cachedFile + '.tmp'):
+                os.remove(cachedFile + '.tmp')
+
+def split_blocks(pieces):
+    """Split text into blocks at the # lines, where the text is supplied a piece at a time.
+
+    :param pieces:  The pieces of the text.
+    :type pieces:   iterable
+    :returns :      A generator of the text between each # line (including the text before the first and after the last).
+    :type :         generator
+
+    """
+
+    blockPieces = []
+    tail = ''
+    for text in pieces:
+        text = tail + text
+        start = 0
+        end = text.find(blockSeparator)
+        while end != -1:
+            blockPieces.append(text[start:end])
+            yield ''.join(blockPieces)
+            blockPieces = []
+            start = end + len(blockSeparator)
+            end = text.find(blockSeparator, start)
+        # Hold back the end of the text, as it may be the start of a separator that finishes in the next piece.
+        keep = max(start, len(text) - len(blockSeparator) + 1)
+        blockPieces.append(text[start:keep])
+        tail = text[keep:]
+    blockPieces.append(tail)
+    yield ''.join(blockPieces)
+
+def mapped_blocks(cachedFile):
+    """Split an uncompressed mmCIF file into blocks at the # lines, by memory-mapping it and decoding one block at a time.
+
+    :param cachedFile:  The location of the uncompressed mmCIF file.
+    :type cachedFile:   string
+    :returns :          A generator of the text between each # line (including the text before the first and after the last).
+    :type :             generator
+
+    """
+
+    with open(cachedFile, 'rb') as readFile:
+        if os.fstat(readFile.fileno()).st_size == 0:
+            yield ''
+            return
+        fileMap = mmap.mmap(readFile.fileno(), 0, access=mmap.ACCESS_READ)
+    separator = blockSeparator.encode('utf-8')
+    start = 0
+    end = fileMap.find(separator)
+    while end != -1:
+        yield fileMap[start:end].decode('utf-8')
+        start = end + len(separator)
+        end = fileMap.find(separator, start)
+    yield fileMap[start:].decode('utf-8')
+    fileMap.close()
+
+def block_category(block):
+    """Determine the category of a block (the text between two # lines) of an mmCIF file without tokenizing it.
+
+    :param block:   The text of the block.
+    :type block:    string
+    :returns :      The category of the block (e.g. _entity or _atom_site).
+    :type :         string
+
+    """
 
-        dataDictionary[blockName] = blockDictionary
+    start = 6 if block.startswith('loop_\n') else 0
+    return block[start:block.find('.', start)]
+
+def parse_block(block, dataDictionary, itemsToKeep=None):
+    """Parse one block (the text between two # lines) of an mmCIF file.
+
+    The data in the block is added to dataDictionary, with each item of the block being recorded as
+    dataDictionary[category][item] = [values]. Multi-line values have their line breaks removed.
+
+    :param block:           The text of the block.
+    :type block:            string
+    :param dataDictionary:  The dictionary to record the data from the block in.
+    :type dataDictionary:   dictionary
+    :param itemsToKeep:     The items of the block to record, or None to record all items.
+    :type itemsToKeep:      set
+
+    """
+
+    tokens = tokenize(block)
+    if not tokens:
+        return
+
+    if tokens[0] == 'loop_':
+        # A loop has been found, and therefore the block contains more than one data record.
+        numberOfItems = 1
+        while numberOfItems < len(tokens) and tokens[numberOfItems].startswith('_'):
+            numberOfItems += 1
+        items = tokens[1:numberOfItems]
+        values = tokens[numberOfItems:]
+        numberOfItems -= 1
+        for index, i in enumerate(items):
+            category, item = i.split('.', 1)
+            if itemsToKeep is None or item in itemsToKeep:
+                # Only the columns of the loop that are wanted are sliced out of the values.
+                dataDictionary.setdefault(category, {})[item] = values[index::numberOfItems]
+    else:
+        # There is no loop, and therefore the block contains alternating item names and (single) data values.
+        for i, j in zip(tokens[0::2], tokens[1::2]):
+            category, item = i.split('.', 1)
+            if itemsToKeep is None or item in itemsToKeep:
+                dataDictionary.setdefault(category, {})[item] = [j]
+
+def loop_rows(block):
+    """Read the records of a block (the text between two # lines) of an mmCIF file one at a time.
+
+    Each line of the block is tokenized as it is read, so only the tokens of the current record are held at once. A block that is not a loop
+    is treated as a loop with a single record.
+
+    :param block:   The text of the block.
+    :type block:    string
+    :returns :      The items of the block (without the category), and a generator of the values of each record.
+    :type :         list, generator
+
+    """
+
+    if not block.startswith('loop_\n'):
+        tokens = tokenize(block)
+        return [i.split('.', 1)[1] for i in tokens[0::2]], iter([tokens[1::2]])
+
+    lines = block_lines(block)
+    next(lines)  # Skip the loop_ line.
+    items = []
+    line = next(lines, '')
+    while line.startswith('_'):
+        items.append(line.strip().split('.', 1)[1])
+        line = next(lines, '')
+    return items, record_generator(line, lines, len(items))
+
+def block_lines(block):
+    """Generate the lines of a block one at a time, slicing each out of the block as it is reached rather than copying the block.
+
+    :param block:   The text of the block.
+    :type block:    string
+    :returns :      A generator of the lines of the block, each with its line break (if it has one).
+    :type :         generator
+
+    """
+
+    start = 0
+    end = block.find('\n')
+    while end != -1:
+        yield block[start:end + 1]
+        start = end + 1
+        end = block.find('\n', start)
+    if start < len(block):
+        yield block[start:]
+
+def record_generator(line, lines, numberOfItems):
+    """Generate the records of a loop from the lines of its values.
+
+    :param line:            The first line of the values.
+    :type line:             string
+    :param lines:           The remaining lines of the values.
+    :type lines:            iterator
+    :param numberOfItems:   The number of items (values) in each record.
+    :type numberOfItems:    int
+    :returns :              A generator of the values of each record.
+    :type :                 generator
+
+    """
+
+    pending = []
+    while line:
+        if line[0] == ';':
+            # A semi-colon delimited text field, which runs until the next line that starts with a ;.
+            fieldLines = [line]
+            line = next(lines, '')
+            while line and line[0] != ';':
+                fieldLines.append(line)
+                line = next(lines, '')
+            tokens = [strip_delimiters(''.join(fieldLines) + ';')] + tokenize(line[1:])
+        else:
+            tokens = tokenize(line)
+
+        if not pending and len(tokens) == numberOfItems:
+            # By far the most common case of a record being on a single line.
+            yield tokens
+        else:
+            pending.extend(tokens)
+            while len(pending) >= numberOfItems:
+                yield pending[:numberOfItems]
+                del pending[:numberOfItems]
+        line = next(lines, '')
+
+def tokenize(block):
+    """Split a block of an mmCIF file into its item names and data values.
+
+    :param block:   The text of the block.
+    :type block:    string
+    :returns :      The item names and data values in the order that they appear in the block, with any delimiters removed.
+    :type :         list
+
+    """
+
+    if not quotingCharacters.search(block):
+        # There are no delimited values in the block, so all tokens are separated by whitespace.
+        return block.split()
+
+    return [strip_delimiters(i) if i[0] in '\'";' else i for i in tokenizer.findall(block)]
+
+def strip_delimiters(token):
+    """Remove the delimiters from a delimited data value.
+
+    Semi-colon delimited text fields also have their line breaks removed.
+
+    :param token:   The data value to remove the delimiters from.
+    :type token:    string
+    :returns :      The data value without its delimiters.
+    :type :         string
+
+    """
 
-    return dataDictionary
\ No newline at end of file
+    if token[0] == ';':
+        if '\n' in token:
+            return token[1:-2].replace('\n', '')
+    elif len(token) > 1 and token[-1] == token[0]:
+        return token[1:-1]
+    return token
@@ -1,6 +1,6 @@
 import mmCIFparser
 
-def extract_info(mmCIFFile, tokens='all'):
+def extract_info(mmCIFFile, tokens='all', scanners=None, cacheDir=None):
     """The parsing basically returns a dictionary with the same structure as the mmCIF file. all the top level block names like _entity and _entry
     have an entry in the returned token dictionary. The keys for each of these top level entries are the sub block names like id and type. Each data
     entry (so for example the data recorded at tokenDict['_entry']['id'] is a list. If there was a loop in the block then the list will have more
@@ -12,17 +12,35 @@ def extract_info(mmCIFFile, tokens='all'):
     :type mmCIFFile:    string
     :param tokens:      The tokens (and their associated data) that should be exctracted from the file.
     :type tokens:       list
+    :param scanners:    The function to scan each main token with instead of recording its data (see mmCIFparser.main), keyed by the token.
+    :type scanners:     dictionary
+    :param cacheDir:    The directory to keep an uncompressed copy of the file in (see mmCIFparser.read_blocks), or None to not keep one.
+    :type cacheDir:     string
     :returns :          The dictionary of requested tokens (and their associated data), along with an error message.
     :type :             dictionary, string
 
     """
 
-    tokenDict = mmCIFparser.main(mmCIFFile)
-
     errorMessage = ''
     if tokens == 'all':
+        tokenDict = mmCIFparser.main(mmCIFFile, None, scanners, cacheDir)
         return tokenDict, errorMessage
 
+    # Only parse the categories (and items within them) that are requested.
+    requested = {}
+    for i in tokens:
+        if '.' in i:
+            # If this is True, then only the sub-token of the main token needs recording.
+            mainToken, subToken = i.split('.', 1)
+            if mainToken not in requested:
+                requested[mainToken] = set()
+            if requested[mainToken] is not None:
+                requested[mainToken].add(subToken)
+        else:
+            # If this is True, then all sub-tokens of the main token need recording.
+            requested[i] = None
+    tokenDict = mmCIFparser.main(mmCIFFile, requested, scanners, cacheDir)
+
     tokensFound = tokenDict.keys()
     subDict = {}
     for i in tokens:
@@ -48,17 +66,25 @@ def extract_info(mmCIFFile, tokens='all'):
                 subDict[i] = tokenDict[i]
             else:
                 errorMessage += 'Main token ' + i + ' not found.\n'
+    for i in (scanners or {}):
+        if i in tokensFound:
+            subDict[i] = tokenDict[i]
+        else:
+            errorMessage += 'Main token ' + i + ' not found.\n'
     return subDict, errorMessage
 
-def main(fileToParse):
+def main(fileToParse, cacheDir=None):
     """Extract the desired data from an mmCIF file.
 
     :param fileToParse: The mmCIF file from which the data should be extracted.
     :type fileToParse:  string
+    :param cacheDir:    The directory to keep an uncompressed copy of the file in (see mmCIFparser.read_blocks), or None to not keep one.
+    :type cacheDir:     string
 
     """
 
-    parsedData, errorMessage = extract_info(fileToParse, ['_entry.id', '_entity', '_entity_poly', '_exptl.method', '_atom_site.label_atom_id', '_atom_site.label_entity_id', '_refine', '_reflns', '_struct_ref', '_entity_src_gen', '_entity_src_nat', '_pdbx_entity_src_syn'])
+    parsedData, errorMessage = extract_info(fileToParse, ['_entry.id', '_entity', '_entity_poly', '_exptl.method', '_refine', '_reflns', '_struct_ref', '_entity_src_gen', '_entity_src_nat', '_pdbx_entity_src_syn'],
+                                            {'_atom_site' : scan_atom_site}, cacheDir)
     entryID = parsedData['_entry']['id']
     entityRecords = {}
 
@@ -180,13 +206,84 @@ def main(fileToParse):
         rFactorObs = 1
         rFactorFree = 1
 
-    # Determine structures with only alpha carbon atoms.
-    onlyAlphaCarbon = dict([(i, True) for i in parsedData['_entity']['id']])
-    for i in range(len(parsedData['_atom_site']['label_entity_id'])):
-        if parsedData['_atom_site']['label_atom_id'][i] != 'CA':
-            onlyAlphaCarbon[parsedData['_atom_site']['label_entity_id'][i]] = False
-    for i in onlyAlphaCarbon.keys():
+    # Determine structures with only alpha carbon atoms, and the size of the structure of each chain.
+    entitiesWithOtherAtoms, structureCounts = parsedData['_atom_site']
+    for i in parsedData['_entity']['id']:
         if 'sequence' in entityRecords[i]:
-            entityRecords[i]['onlyAlphaCarbon'] = onlyAlphaCarbon[i]
+            entityRecords[i]['onlyAlphaCarbon'] = not i in entitiesWithOtherAtoms
+            chains = entityRecords[i]['chains']
+            if (i, None) in structureCounts:
+                # The chain of each atom is not recorded, so the number of atoms, alpha carbons and residues of each chain is not known.
+                entityRecords[i]['structureCounts'] = dict([(j, (None, None, None)) for j in chains])
+            else:
+                entityRecords[i]['structureCounts'] = dict([(j, tuple(structureCounts.get((i, j), (0, 0, 0)))) for j in chains])
+
+    return entryID, entityRecords, experimentalType, resolution, rFactorObs, rFactorFree
+
+def scan_atom_site(block):
+    """Summarise the _atom_site block of an mmCIF file without recording the data for every atom.
+
+    :param block:   The text of the _atom_site block.
+    :type block:    string
+    :returns :      The entities that have an atom other than an alpha carbon, and the number of atoms, alpha carbons and residues of each chain
+                    in the first model, keyed by the (entity, author chain) that the chain belongs to. If the block does not record the chain
+                    of each atom then the chain is None, and if it does not record the residue then the number of residues is 0.
+    :type :         set, dictionary
+
+    """
+
+    items, records = mmCIFparser.loop_rows(block)
+    atomColumn = items.index('label_atom_id')
+    entityColumn = items.index('label_entity_id')
+    chainColumn = optional_column(items, ['auth_asym_id', 'label_asym_id'])
+    residueColumn = optional_column(items, ['label_seq_id'])
+    modelColumn = optional_column(items, ['pdbx_PDB_model_num'])
+
+    entitiesWithOtherAtoms = set([])
+    structureCounts = {}
+    firstModel = None
+    lastResidue = None
+    for record in records:
+        atom = record[atomColumn]
+        entity = record[entityColumn]
+        if atom != 'CA':
+            entitiesWithOtherAtoms.add(entity)
+
+        # Only the first model is counted, so that structures with multiple models (e.g. from NMR) are not counted multiple times.
+        if modelColumn is not None:
+            if firstModel is None:
+                firstModel = record[modelColumn]
+            elif record[modelColumn] != firstModel:
+                continue
+        chain = (entity, None if chainColumn is None else record[chainColumn])
+        if chain in structureCounts:
+            counts = structureCounts[chain]
+        else:
+            counts = structureCounts[chain] = [0, 0, 0]
+        counts[0] += 1
+        if atom == 'CA':
+            counts[1] += 1
+        residue = (chain, None if residueColumn is None else record[residueColumn])
+        if residueColumn is not None and residue != lastResidue:
+            # The atoms of a residue are consecutive, so a new residue starts whenever the residue changes.
+            counts[2] += 1
+            lastResidue = residue
+
+    return entitiesWithOtherAtoms, structureCounts
+
+def optional_column(items, names):
+    """Find the column of the first of a number of items that is present in a loop.
+
+    :param items:   The items of the loop.
+    :type items:    list
+    :param names:   The items to look for, in order of preference.
+    :type names:    list
+    :returns :      The column of the first item found, or None if none of them are present.
+    :type :         int
+
+    """
 
-    return entryID, entityRecords, experimentalType, resolution, rFactorObs, rFactorFree
\ No newline at end of file
+    for i in names:
+        if i in items:
+            return items.index(i)
+    return None
@@ -0,0 +1,276 @@
+'''
+An in-process interface to the parsing and culling, for use by programs that want to cull their own lists of chains without writing and
+reading the intermediate files in parsedPDB.
+
+Chains are represented as ChainRecords, and similarities as iterables of (group, group, sequence identity) tuples, where the groups are the
+sequence grouping identifiers of the chains' sequences (see chainstore.sequence_group). The chains and similarities can come from parsing
+mmCIF files (parse_chains), from the outputs of a previous run of updatelocalPDB (load_chains and load_similarity_edges), or from anywhere
+else. The culling is the same as that used to generate the culled subsets.
+'''
+
+import array
+import collections
+import multiprocessing
+import sys
+import time
+
+import chainstore
+import edgestore
+import generateculledsubsets
+import parsePDBmmCIF
+
+# The information recorded about a chain. The experimental type is as written in Chains.tsv (e.g. XRAY or NMR), and the atoms, alpha
+# carbons and residues are counted over the first model of the chain's structure (and are None if they are not known).
+ChainRecord = collections.namedtuple('ChainRecord', ['chain', 'experimentalType', 'resolution', 'rFactorObs', 'rFactorFree', 'alphaCarbonOnly',
+                                                     'description', 'dbName', 'dbCode', 'scientificName', 'sequence', 'atoms', 'alphaCarbons',
+                                                     'residues'])
+
+def parse_chains(mmCIFFiles, workers=1, chunkSize=64, cacheDir=None):
+    """Parse mmCIF files, and generate a record for each protein chain in them.
+
+    Files that can not be parsed are reported and skipped.
+
+    :param mmCIFFiles:  The locations of the gzipped mmCIF files to parse.
+    :type mmCIFFiles:   list
+    :param workers:     The number of processes to use when parsing the files.
+    :type workers:      int
+    :param chunkSize:   The number of files to send to a parsing process at a time.
+    :type chunkSize:    int
+    :param cacheDir:    The directory to keep uncompressed copies of the files in (see mmCIFparser.read_blocks), or None to not keep them.
+    :type cacheDir:     string
+    :returns :          The records of the chains, in the order of the files (and the chains within each file).
+    :type :             generator
+
+    """
+
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        parsedFiles = pool.imap(parse_mmCIF_file, [(i, cacheDir) for i in mmCIFFiles], chunkSize)
+    else:
+        pool = None
+        parsedFiles = map(parse_mmCIF_file, [(i, cacheDir) for i in mmCIFFiles])
+
+    try:
+        for currentFile, parsedFile, errorMessage, parseTime in parsedFiles:
+            if parsedFile is None:
+                sys.stderr.write('Skipping ' + currentFile + ': ' + errorMessage + '\n')
+            else:
+                for i in chain_records(parsedFile):
+                    yield i
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def parse_mmCIF_file(fileToParse):
+    """Parse a single mmCIF file, catching any errors that occur so that one bad file does not stop the processing of the rest.
+
+    :param fileToParse: The location of the gzipped mmCIF file to parse, and the directory to keep an uncompressed copy of it in (None to not
+                        keep one).
+    :type fileToParse:  tuple
+    :returns :          The location of the file, the information parsed from it (None if the parsing failed), an error message and the
+                        time taken (in seconds) to parse the file.
+    :type :             string, tuple, string, float
+
+    """
+
+    mmCIFFile, cacheDir = fileToParse
+    startTime = time.perf_counter()
+    try:
+        return mmCIFFile, parsePDBmmCIF.main(mmCIFFile, cacheDir), '', time.perf_counter() - startTime
+    except Exception as e:
+        return mmCIFFile, None, repr(e), time.perf_counter() - startTime
+
+def chain_records(parsedFile):
+    """Determine the records of the protein chains in a parsed mmCIF file.
+
+    Only the chains of protein entities are recorded, and entities where at least 50% of the amino acids are X are deemed to not be proteins.
+
+    :param parsedFile:  The information parsed from the file, as returned by parsePDBmmCIF.main.
+    :type parsedFile:   tuple
+    :returns :          The records of the chains, in the order of the entities in the file (and the chains within each entity).
+    :type :             list
+
+    """
+
+    records = []
+    entryID, entityRecords, experimentalType, resolution, rFactorObs, rFactorFree = parsedFile
+
+    # For each record in the entry, examine the data about it. Each entry can have one or more record depending on the different chains
+    # recorded in the entry.
+    for j in entityRecords.keys():
+        if 'type' in entityRecords[j]:
+            # If the record contains type information than examine it further. Only those records with type information are of interest.
+            chains = [(entry + chain, chain) for entry in entryID for chain in entityRecords[j]['chains']]  # The chains in the record (and entry).
+            type = entityRecords[j]['type'].strip()  # The type of the record.
+
+            if type == 'Protein':
+                # Only interested in the record if it's a protein.
+                dbCode = entityRecords[j]['dbCode'].strip() if 'dbCode' in entityRecords[j] else ''  # External database identifier.
+                if dbCode in ['?', '.']:
+                    dbCode = ''
+                dbName = entityRecords[j]['dbName'].strip() if 'dbName' in entityRecords[j] else ''  # External database name.
+                if dbName in ['?', '.']:
+                    dbName = ''
+                description = entityRecords[j]['description'].strip() if 'description' in entityRecords[j] else ''  # Record description.
+                if description in ['?', '.']:
+                    description = ''
+                onlyAlphaCarbon = entityRecords[j]['onlyAlphaCarbon']  # Whether the structure for the record contains only alpha carbons.
+                structureCounts = entityRecords[j]['structureCounts']  # The number of atoms, alpha carbons and residues of each chain.
+                scientificName = entityRecords[j]['scientificName'].strip() if 'scientificName' in entityRecords[j] else ''  # Scientific name of the organism the chain belongs to.
+                if scientificName in ['?', '.']:
+                    scientificName = ''
+                sequence = entityRecords[j]['sequence'].upper()  # Sequence of the chain.
+                if sequence.count('X') / float(len(sequence)) < 0.5:
+                    # If at least 50% of the amino acids in the chain are X, then the 'protein' is deemed to not be a protein.
+                    for k, chain in chains:
+                        # Record the data about each chain.
+                        atoms, alphaCarbons, residues = structureCounts[chain]
+                        records.append(ChainRecord(k, experimentalType, resolution, rFactorObs, rFactorFree, onlyAlphaCarbon != 0, description,
+                                                   dbName, dbCode, scientificName, sequence, atoms, alphaCarbons, residues))
+
+    return records
+
+def identifier_line(record):
+    """Determine the FASTA identifier line (without the > and newline) of a chain, in the format of AllChains.fasta.
+
+    :param record:  The record of the chain.
+    :type record:   ChainRecord
+    :returns :      The identifier line.
+    :type :         string
+
+    """
+
+    return (record.chain + '\t' + str(len(record.sequence)) + '\t' + record.experimentalType + '\t' + str(record.resolution) + '\t' +
+            str(record.rFactorObs) + '\t' + str(record.rFactorFree) + '\t' + ('yes' if record.alphaCarbonOnly else 'no') + '\t' +
+            record.description + '\t<' + record.dbName + ' ' + record.dbCode + '>\t[' + record.scientificName + ']')
+
+def load_chains(fileChainStore):
+    """Load the records of the chains in a chain store (e.g. the ChainStore.bin written by updatelocalPDB).
+
+    :param fileChainStore:  The location of the chain store.
+    :type fileChainStore:   string
+    :returns :              The records of the chains, in the order that they appear in the store.
+    :type :                 list
+
+    """
+
+    store = chainstore.load(fileChainStore)
+    records = []
+    for i in range(store['numberOfChains']):
+        chunks = chainstore.identifier_line(store, i).decode('utf-8').split('\t')
+        dbName, dbCode = chunks[8][1:-1].split(' ', 1)
+        records.append(ChainRecord(chunks[0], chunks[2], store['res'][i], store['rFactorObs'][i], store['rFactorFree'][i],
+                                   store['alphaCarbonOnly'][i] == 1, chunks[7], dbName, dbCode, chunks[9][1:-1],
+                                   chainstore.unique_sequence(store, store['sequenceIndex'][i]).decode('utf-8'),
+                                   *[None if j[i] == chainstore.unknownCount else j[i] for j in [store['atoms'], store['alphaCarbons'], store['residues']]]))
+    return records
+
+def load_similarity_edges(fileEdges):
+    """Generate the similarities in a similarity store (e.g. the Similarity.bin written by updatelocalPDB), from most to least similar.
+
+    :param fileEdges:   The location of the similarity store.
+    :type fileEdges:    string
+    :returns :          The sequence grouping identifiers of each pair of similar groupings and their sequence identity (as a percentage).
+    :type :             generator
+
+    """
+
+    store = edgestore.load(fileEdges)
+    groups = [edgestore.group_id(store, i) for i in range(len(store['groupIDs']) // 16)]
+    for groupA, groupB, identity in zip(store['groupA'], store['groupB'], store['identity']):
+        yield groups[groupA], groups[groupB], identity / 100.0
+
+def prepare_culling(records, edges):
+    """Prepare a set of chains and the similarities between them for culling.
+
+    Culling many subsets of the same chains is quicker with the prepared chains and similarities (see cull_prepared) than with cull, as the
+    similarities only need to be indexed and sorted once.
+
+    :param records: The records of the chains.
+    :type records:  list
+    :param edges:   The sequence grouping identifiers of each pair of similar groupings and their sequence identity (as a percentage).
+                    Similarities involving groupings that none of the chains belong to are ignored, and the greatest sequence identity is
+                    used for a pair that is given more than once.
+    :type edges:    iterable
+    :returns :      The chain information and similarities in the forms used by generateculledsubsets.
+    :type :         dictionary, tuple
+
+    """
+
+    groupIndices = {}
+    reprGroup = []
+    for i in records:
+        group = chainstore.sequence_group(i.sequence)
+        if not group in groupIndices:
+            groupIndices[group] = len(groupIndices)
+        reprGroup.append(groupIndices[group])
+    chainTable = {'chain' : [i.chain for i in records], 'res' : [i.resolution for i in records], 'rVal' : [i.rFactorObs for i in records],
+                  'rFree' : [i.rFactorFree for i in records], 'seqLen' : [len(i.sequence) for i in records],
+                  'nonXRay' : [0 if i.experimentalType == 'XRAY' else 1 for i in records],
+                  'alphaCarbonOnly' : [1 if i.alphaCarbonOnly else 0 for i in records], 'atoms' : [i.atoms for i in records],
+                  'alphaCarbons' : [i.alphaCarbons for i in records], 'residues' : [i.residues for i in records], 'reprGroup' : reprGroup,
+                  'groups' : sorted(groupIndices, key=groupIndices.get), 'groupIndices' : groupIndices, 'masks' : {}}
+
+    # Keep the greatest sequence identity of each pair of groupings, keyed by the indices of the groupings packed into one integer. As in
+    # processPSIoutput, the first grouping of a pair is the one with the lesser identifier, so that the similarities are ordered (and
+    # therefore culled) in the same way as those in a similarity store.
+    pairs = {}
+    for groupA, groupB, identity in edges:
+        if groupA in groupIndices and groupB in groupIndices and groupA != groupB:
+            if groupB < groupA:
+                groupA, groupB = groupB, groupA
+            pair = (groupIndices[groupA] << 32) | groupIndices[groupB]
+            pairs[pair] = max(pairs.get(pair, 0), edgestore.quantise(identity))
+    similarities = edgestore.sort_similarities(array.array('Q', pairs.keys()), array.array('H', pairs.values()))
+
+    return chainTable, similarities
+
+def cull_prepared(preparedChains, resolution, rValue, seqIdentity, minLength=40, includeNonXrayAndCAOnly=False):
+    """Cull a set of prepared chains.
+
+    :param preparedChains:          The chain information and similarities, as returned by prepare_culling.
+    :type preparedChains:           tuple
+    :param resolution:              The maximum permissible resolution.
+    :type resolution:               float
+    :param rValue:                  The maximum permissible R value.
+    :type rValue:                   float
+    :param seqIdentity:             The sequence identity at or above which two sequence groupings are deemed redundant.
+    :type seqIdentity:              float
+    :param minLength:               The minimum permissible sequence length.
+    :type minLength:                int
+    :param includeNonXrayAndCAOnly: Whether non-X-ray and alpha carbon only chains are permissible.
+    :type includeNonXrayAndCAOnly:  boolean
+    :returns :                      The identifiers of the chains that are kept, in the order that they appear in the records.
+    :type :                         list
+
+    """
+
+    chainTable, similarities = preparedChains
+    chainsKept = generateculledsubsets.cull(chainTable, similarities, resolution, rValue, seqIdentity, minLength,
+                                            1 if includeNonXrayAndCAOnly else 0)
+    return [i for i in chainTable['chain'] if i in chainsKept]
+
+def cull(records, edges, resolution, rValue, seqIdentity, minLength=40, includeNonXrayAndCAOnly=False):
+    """Cull a set of chains.
+
+    :param records:                 The records of the chains.
+    :type records:                  list
+    :param edges:                   The similarities between the chains' sequence groupings (see prepare_culling).
+    :type edges:                    iterable
+    :param resolution:              The maximum permissible resolution.
+    :type resolution:               float
+    :param rValue:                  The maximum permissible R value.
+    :type rValue:                   float
+    :param seqIdentity:             The sequence identity at or above which two sequence groupings are deemed redundant.
+    :type seqIdentity:              float
+    :param minLength:               The minimum permissible sequence length.
+    :type minLength:                int
+    :param includeNonXrayAndCAOnly: Whether non-X-ray and alpha carbon only chains are permissible.
+    :type includeNonXrayAndCAOnly:  boolean
+    :returns :                      The identifiers of the chains that are kept, in the order that they appear in the records.
+    :type :                         list
+
+    """
+
+    return cull_prepared(prepare_culling(records, edges), resolution, rValue, seqIdentity, minLength, includeNonXrayAndCAOnly)
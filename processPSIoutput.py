@@ -4,57 +4,386 @@ Created on 11 Jan 2014
 @author: Simon Bull
 '''
 
-def main(PSIoutput, outputLocation, minAlignLength=20, maxEValue=1.0):
+import array
+import heapq
+import os
+import struct
+import tempfile
+import edgestore
+
+# The approximate number of bytes of memory used to hold one pair of chain groupings (and its similarity) in memory.
+bytesPerPair = 160
+
+# The format of the records in the sorted runs spilled to disk (the packed pair of chain grouping indices and the similarity).
+runRecord = struct.Struct('=Qd')
+
+# The format of the records in the sorted runs of the binary similarity store's similarities spilled to disk (65535 less the sequence
+# identity in hundredths of a percent, so that the records sort from most to least similar, and the indices of the pair of chain groupings).
+edgeRunRecord = struct.Struct('=HII')
+
+def main(PSIoutput, outputLocation, minAlignLength=20, maxEValue=1.0, memoryLimit=2 ** 30):
     """Extracts the relevant information from the PSI-BLAST output.
 
-    :param PSIoutput:       The location of the file containing the PSI-BLAST results.
-    :type PSIoutput:        string
+    The pairs of chain groupings are held in memory until they take up (approximately) memoryLimit bytes, at which point they are sorted and
+    spilled to disk. The spilled runs are merged when the similarity information is written out.
+
+    :param PSIoutput:       The location of the file containing the PSI-BLAST results, or a list of the locations of files containing them.
+    :type PSIoutput:        string or list
     :param outputLocation:  The location where the parsed similarity information will be written.
     :type outputLocation:   string
     :param minAlignLength:  The minimum permissible alignment length required for a similarity relationship to be included..
     :type minAlignLength:   int
     :param maxEValue:       The maximum permissible E value required for a similarity relationship to be included.
     :type maxEValue:        float
+    :param memoryLimit:     The approximate number of bytes of memory to use for holding the pairs of chain groupings.
+    :type memoryLimit:      int
+
+    """
+
+    if isinstance(PSIoutput, str):
+        PSIoutput = [PSIoutput]
+
+    similaritiesFound = open_similarities(outputLocation, memoryLimit)
+    for i in PSIoutput:
+        currentQuery = ''
+        hitsFound = {}
+        BLASTOutput = open(i, 'r')
+        for line in BLASTOutput:
+            if line[0] == '#':
+                if line.startswith('# Query:'):
+                    # The end of a round has been reached.
+                    nextQuery = line.split()[2]
+                    if currentQuery != nextQuery:
+                        # A new query has been found. Record the hits from the last query.
+                        record_hits(currentQuery, hitsFound, similaritiesFound)
+                    currentQuery = nextQuery
+                    hitsFound = {}
+            elif line.startswith(currentQuery):
+                chunks = line.split()
+                if len(chunks) == 5 and chunks[0] == currentQuery:
+                    # An alignment is recorded on the line if the line starts with the query protein.
+                    alignLength = int(chunks[3])
+                    evalue = float(chunks[4])
+                    if alignLength >= minAlignLength and evalue <= maxEValue:
+                        # Only record the hit if the alignment length is long enough and the evalue is large enough.
+                        hitsFound[chunks[1]] = float(chunks[2])
+        BLASTOutput.close()
+        record_hits(currentQuery, hitsFound, similaritiesFound)  # Record the hits from the final query in the file.
+
+    write_similarities(similaritiesFound)
+
+def record_hits(query, hitsFound, similaritiesFound):
+    """Record the hits found for a query in the final round of its PSI-BLAST search.
+
+    :param query:               The query that the hits were found for.
+    :type query:                string
+    :param hitsFound:           The similarity of the query to each hit.
+    :type hitsFound:            dictionary
+    :param similaritiesFound:   The similarities found so far, as returned by open_similarities. Updated with the hits for the query.
+    :type similaritiesFound:    dictionary
+
+    """
+
+    for hit in hitsFound:
+        if hit != query:
+            # Only record the similarity if the query and hit are not the same
+            add_similarity(similaritiesFound, query, hit, hitsFound[hit])
+
+def merge(similarityFiles, groupsToKeep, outputLocation, memoryLimit=2 ** 30, fileEdges=None, groupOrder=None, clusters=None):
+    """Combine the similarity information from multiple files, keeping the greatest similarity found for each pair of chain groupings.
+
+    The combined similarities can also be written out as a binary similarity store (see edgestore), which is what the culling loads.
+
+    If the chain groupings have been clustered (see sequenceclusters), then the similarities of each cluster's centroid are propagated to its
+    members, and the members of a cluster are made similar to each other. The similarity propagated from a centroid to a member is the
+    similarity of the centroid less the distance (100 - similarity) of the member to the centroid, and two members of a cluster are given
+    100 less the sum of their distances to the centroid. These are approximations, not measured identities (see propagate_similarity), and
+    a pair of groupings whose approximation is not positive is not recorded.
+
+    :param similarityFiles: The locations of the files containing the parsed similarity information.
+    :type similarityFiles:  list
+    :param groupsToKeep:    The chain groupings to keep the similarities of. Any pair containing a grouping not in here is discarded.
+    :type groupsToKeep:     set
+    :param outputLocation:  The location where the combined similarity information will be written. If None, then it is not written.
+    :type outputLocation:   string
+    :param memoryLimit:     The approximate number of bytes of memory to use for holding the pairs of chain groupings.
+    :type memoryLimit:      int
+    :param fileEdges:       The location where the binary similarity store will be written. If None, then it is not written.
+    :type fileEdges:        string
+    :param groupOrder:      The chain groupings in the order to index them by in the binary similarity store. Chain groupings not in here
+                            come after those that are, in sorted order.
+    :type groupOrder:       list
+    :param clusters:        The members of each cluster of chain groupings (and their similarity to the centroid), keyed by the centroid.
+    :type clusters:         dictionary
+
+    """
+
+    clusters = dict((i, [(i, 100.0)] + [j for j in clusters[i] if j[0] in groupsToKeep]) for i in (clusters or {}) if i in groupsToKeep)
+    similaritiesFound = open_similarities(outputLocation, memoryLimit, fileEdges)
+    for i in similarityFiles:
+        readSimilarities = open(i, 'r')
+        readSimilarities.readline()  # Strip the header.
+        for line in readSimilarities:
+            chunks = (line.strip()).split('\t')
+            if chunks[0] in groupsToKeep and chunks[1] in groupsToKeep:
+                if chunks[0] in clusters or chunks[1] in clusters:
+                    propagate_similarity(similaritiesFound, chunks[0], chunks[1], float(chunks[2]), clusters)
+                else:
+                    add_similarity(similaritiesFound, chunks[0], chunks[1], float(chunks[2]))
+        readSimilarities.close()
+
+    # Make the members of each cluster similar to each other (and the centroid).
+    for i in clusters:
+        members = clusters[i]
+        for indexA, (memberA, similarityA) in enumerate(members):
+            for memberB, similarityB in members[indexA + 1:]:
+                memberSimilarity = round(similarityA + similarityB - 100.0, 2)
+                if memberSimilarity > 0:
+                    add_similarity(similaritiesFound, memberA, memberB, memberSimilarity)
+
+    write_similarities(similaritiesFound, groupOrder)
+
+def propagate_similarity(similaritiesFound, groupA, groupB, similarity, clusters):
+    """Record the similarity between a pair of chain groupings, and propagate it to the members of any clusters that they are the centroid of.
+
+    The similarity propagated to a pair of members is not their sequence identity (they were never compared), but an approximation of it: the
+    similarity of the centroids less the distance (100 - similarity) of each member to its centroid. A pair whose approximation is not
+    positive is not recorded at all. The approximation is not a bound in either direction, as the identities it is made from are measured
+    over different regions of the sequences (a PSI-BLAST identity is over the local alignment, and a member's identity to its centroid over
+    the region of the centroid it covers). A propagated similarity can be lower than the members' true identity, so that a subset can keep
+    chains that a search of every grouping would remove. It can also be higher, e.g. a member lacking the tag of its centroid is given the
+    centroid's similarity to a grouping that only aligns with the tag, so that a subset can remove chains that a search would keep.
+
+    :param similaritiesFound:   The similarities found so far, as returned by open_similarities.
+    :type similaritiesFound:    dictionary
+    :param groupA:              One of the chain groupings.
+    :type groupA:               string
+    :param groupB:              The other chain grouping.
+    :type groupB:               string
+    :param similarity:          The similarity between the chain groupings.
+    :type similarity:           float
+    :param clusters:            The members of each cluster (including the centroid itself with a similarity of 100.0), keyed by the centroid.
+    :type clusters:             dictionary
+
+    """
+
+    for memberA, similarityA in clusters.get(groupA, [(groupA, 100.0)]):
+        for memberB, similarityB in clusters.get(groupB, [(groupB, 100.0)]):
+            propagatedSimilarity = round(similarity + similarityA + similarityB - 200.0, 2)
+            if propagatedSimilarity > 0 and memberA != memberB:
+                add_similarity(similaritiesFound, memberA, memberB, propagatedSimilarity)
+
+def open_similarities(outputLocation, memoryLimit, fileEdges=None):
+    """Start recording the similarities between pairs of chain groupings.
+
+    Each chain grouping is mapped to an integer, and each pair is packed into a single integer key. The greatest similarity for each key is
+    held in memory until the number of keys reaches the memory limit, at which point the keys are sorted and spilled to a run file on disk.
+
+    :param outputLocation:  The location where the similarity information will be written (None to not write it). The run files are created
+                            in the same directory.
+    :type outputLocation:   string
+    :param memoryLimit:     The approximate number of bytes of memory to use for holding the pairs of chain groupings.
+    :type memoryLimit:      int
+    :param fileEdges:       The location where the binary similarity store will be written (None to not write it).
+    :type fileEdges:        string
+    :returns :              The state of the similarities being recorded, to pass to add_similarity and write_similarities.
+    :type :                 dictionary
+
+    """
+
+    return {'outputLocation' : outputLocation, 'fileEdges' : fileEdges, 'maxPairs' : max(1, memoryLimit // bytesPerPair), 'groupIndices' : {},
+            'groups' : [], 'pairs' : {}, 'runs' : []}
+
+def add_similarity(similaritiesFound, groupA, groupB, similarity):
+    """Record the similarity between a pair of chain groupings, if it is greater than any similarity already recorded for the pair.
+
+    :param similaritiesFound:   The similarities found so far, as returned by open_similarities.
+    :type similaritiesFound:    dictionary
+    :param groupA:              One of the chain groupings.
+    :type groupA:               string
+    :param groupB:              The other chain grouping.
+    :type groupB:               string
+    :param similarity:          The similarity between the chain groupings.
+    :type similarity:           float
+
+    """
+
+    groupIndices = similaritiesFound['groupIndices']
+    if groupB < groupA:
+        groupA, groupB = groupB, groupA
+    for i in [groupA, groupB]:
+        if not i in groupIndices:
+            groupIndices[i] = len(similaritiesFound['groups'])
+            similaritiesFound['groups'].append(i)
+    pair = (groupIndices[groupA] << 32) | groupIndices[groupB]
+
+    pairs = similaritiesFound['pairs']
+    if not (pair in pairs and pairs[pair] >= similarity):
+        # If the pair exists and the recorded similarity is less than the newly found one or the pair does not exist,
+        # then record the new value for the similarity.
+        pairs[pair] = similarity
+        if len(pairs) >= similaritiesFound['maxPairs']:
+            spill_similarities(similaritiesFound)
+
+def spill_similarities(similaritiesFound):
+    """Write the similarities held in memory out to a sorted run file, and clear them from memory.
+
+    :param similaritiesFound:   The similarities found so far, as returned by open_similarities.
+    :type similaritiesFound:    dictionary
+
+    """
+
+    pairs = similaritiesFound['pairs']
+    keys = array.array('Q', sorted(pairs))
+    runFile, runLocation = tempfile.mkstemp(prefix='SimilarityRun_', dir=run_directory(similaritiesFound))
+    with os.fdopen(runFile, 'wb') as writeRun:
+        for i in range(0, len(keys), 65536):
+            writeRun.write(b''.join([runRecord.pack(j, pairs[j]) for j in keys[i:i + 65536]]))
+    similaritiesFound['runs'].append(runLocation)
+    pairs.clear()
+
+def spill_edges(similaritiesFound, edgePairs, edgeIdentity):
+    """Sort similarities destined for the binary similarity store, and write them out to a sorted run file.
+
+    :param similaritiesFound:   The similarities being recorded, as returned by open_similarities.
+    :type similaritiesFound:    dictionary
+    :param edgePairs:           The pair of each similarity, as the index of the first grouping in the store shifted 32 bits left and combined
+                                with the second.
+    :type edgePairs:            array
+    :param edgeIdentity:        The sequence identity of each similarity in hundredths of a percent.
+    :type edgeIdentity:         array
+    :returns :                  The location of the run file.
+    :type :                     string
+
+    """
+
+    runFile, runLocation = tempfile.mkstemp(prefix='SimilarityEdgeRun_', dir=run_directory(similaritiesFound))
+    with os.fdopen(runFile, 'wb') as writeRun:
+        block = []
+        for groupA, groupB, identity in zip(*edgestore.sort_similarities(edgePairs, edgeIdentity)):
+            block.append(edgeRunRecord.pack(65535 - identity, groupA, groupB))
+            if len(block) == 65536:
+                writeRun.write(b''.join(block))
+                block = []
+        writeRun.write(b''.join(block))
+    return runLocation
+
+def run_directory(similaritiesFound):
+    """Determine the directory that run files are written to (that of the similarity file, or the binary similarity store if there is none).
+
+    :param similaritiesFound:   The similarities being recorded, as returned by open_similarities.
+    :type similaritiesFound:    dictionary
+    :returns :                  The directory to write run files to.
+    :type :                     string
+
+    """
+
+    return os.path.dirname(os.path.abspath(similaritiesFound['outputLocation'] or similaritiesFound['fileEdges']))
+
+def read_run(runLocation, record=runRecord):
+    """Read the records from a sorted run file.
+
+    :param runLocation: The location of the run file.
+    :type runLocation:  string
+    :param record:      The format of the records (runRecord for the (packed pair, similarity) records, or edgeRunRecord).
+    :type record:       struct.Struct
+    :returns :          A generator of the records, in sorted order.
+    :type :             generator
+
+    """
+
+    with open(runLocation, 'rb') as readRun:
+        while True:
+            block = readRun.read(record.size * 65536)
+            if not block:
+                break
+            for i in record.iter_unpack(block):
+                yield i
+
+def write_similarities(similaritiesFound, groupOrder=None):
+    """Write out the greatest similarity recorded for each pair of chain groupings, and remove any run files.
+
+    The similarities for the binary similarity store are sorted in chunks of the same size as the pairs held in memory, each chunk is spilled
+    to a sorted run file, and the runs are merged as the store is written, so that the store can be written without holding every similarity
+    in memory.
+
+    :param similaritiesFound:   The similarities found, as returned by open_similarities.
+    :type similaritiesFound:    dictionary
+    :param groupOrder:          The chain groupings in the order to index them by in the binary similarity store. Chain groupings not in here
+                                come after those that are, in sorted order.
+    :type groupOrder:           list
+
+    """
+
+    # Merge the sorted runs with the sorted similarities still held in memory. As the records are sorted by pair, all records for a pair are
+    # adjacent to one another.
+    pairs = similaritiesFound['pairs']
+    records = heapq.merge(*([read_run(i) for i in similaritiesFound['runs']] + [[(i, pairs[i]) for i in sorted(pairs)]]))
+
+    # Determine the index of each chain grouping in the binary similarity store.
+    groups = similaritiesFound['groups']
+    fileEdges = similaritiesFound['fileEdges']
+    if fileEdges is not None:
+        edgeGroups = list(groupOrder or [])
+        edgeGroupSet = set(edgeGroups)
+        edgeGroups.extend(sorted([i for i in groups if not i in edgeGroupSet]))
+        edgeIndices = dict((group, index) for index, group in enumerate(edgeGroups))
+        edgeIndices = [edgeIndices[i] for i in groups]
+        edgePairs = array.array('Q')
+        edgeIdentity = array.array('H')
+        edgeRuns = []
+
+    # Write out the similarity results. A temporary file is used as the output location may also be one of the input files.
+    outputLocation = similaritiesFound['outputLocation']
+    writeSimilarities = open(outputLocation + '.tmp', 'w') if outputLocation is not None else None
+    if writeSimilarities:
+        writeSimilarities.write('ChainGroupingA\tChainGroupingB\tSimilarity\n')  # Write the header.
+    for pair, similarity in merge_pairs(records):
+        if writeSimilarities:
+            writeSimilarities.write(groups[pair >> 32] + '\t' + groups[pair & 0xFFFFFFFF] + '\t' + str(similarity) + '\n')
+        if fileEdges is not None:
+            edgePairs.append((edgeIndices[pair >> 32] << 32) | edgeIndices[pair & 0xFFFFFFFF])
+            edgeIdentity.append(edgestore.quantise(similarity))
+            if len(edgeIdentity) >= similaritiesFound['maxPairs']:
+                edgeRuns.append(spill_edges(similaritiesFound, edgePairs, edgeIdentity))
+                edgePairs = array.array('Q')
+                edgeIdentity = array.array('H')
+    if writeSimilarities:
+        writeSimilarities.close()
+        os.replace(outputLocation + '.tmp', outputLocation)
+    if fileEdges is not None:
+        if edgePairs:
+            edgeRuns.append(spill_edges(similaritiesFound, edgePairs, edgeIdentity))
+        del edgePairs, edgeIdentity
+        edgeRecords = heapq.merge(*[read_run(i, edgeRunRecord) for i in edgeRuns])
+        edgestore.write_sorted(fileEdges, edgeGroups, ((groupA, groupB, 65535 - identity) for identity, groupA, groupB in edgeRecords))
+        for i in edgeRuns:
+            os.remove(i)
+
+    for i in similaritiesFound['runs']:
+        os.remove(i)
+    similaritiesFound['runs'] = []
+    pairs.clear()
+
+def merge_pairs(records):
+    """Combine the records for the same pair of chain groupings, keeping the greatest similarity.
+
+    :param records: The (packed pair, similarity) records, sorted by pair.
+    :type records:  iterable
+    :returns :      A generator of the greatest similarity for each pair, in sorted order.
+    :type :         generator
 
     """
 
-    currentQuery = ''
-    hitsFound = {}
-    similaritiesFound = {}
-
-    BLASTOutput = open(PSIoutput, 'r')
-    for line in BLASTOutput:
-        chunks = line.split()
-        if len(chunks) == 0:
-            continue
-        elif chunks[0] == '#' and chunks[1] == 'Query:':
-            # The end of a round has been reached.
-            nextQuery = chunks[2]
-            if currentQuery != nextQuery:
-                # A new query has been found. Write out the hits from the last query.
-                for hit in hitsFound:
-                    if hit != currentQuery:
-                        # Only record the similarity if the query and hit are not the same
-                        pair = tuple(sorted([currentQuery, hit]))
-                        if not (pair in similaritiesFound and similaritiesFound[pair] >= hitsFound[hit]):
-                            # If the pair exists and the recorded similarity is less than the newly found one or the pair does not exist,
-                            # then record the new value for the similarity.
-                            similaritiesFound[pair] = hitsFound[hit]
-            currentQuery = nextQuery
-            hitsFound = {}
-        elif chunks[0] == currentQuery:
-            # An alignment is recorded on the line if the line starts with the query protein.
-            hit = chunks[1]
-            alignLength = int(chunks[3])
-            evalue = float(chunks[4])
-            if alignLength >= minAlignLength and evalue <= maxEValue:
-                # Only record the hit if the alignment length is long enough and the evalue is large enough.
-                hitsFound[hit] = float(chunks[2])
-    BLASTOutput.close()
-
-    # Write out the similarity results.
-    writeSimilarities = open(outputLocation, 'w')
-    writeSimilarities.write('ChainGroupingA\tChainGroupingB\tSimilarity\n')  # Write the header.
-    for k, v in similaritiesFound.items():
-        writeSimilarities.write(k[0] + '\t' + k[1] + '\t' + str(v) + '\n')
-    writeSimilarities.close()
\ No newline at end of file
+    currentPair = None
+    currentSimilarity = 0.0
+    for pair, similarity in records:
+        if pair != currentPair:
+            if currentPair is not None:
+                yield currentPair, currentSimilarity
+            currentPair = pair
+            currentSimilarity = similarity
+        elif similarity > currentSimilarity:
+            currentSimilarity = similarity
+    if currentPair is not None:
+        yield currentPair, currentSimilarity
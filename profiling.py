@@ -0,0 +1,251 @@
+'''
+Optional instrumentation of the stages of the processing, written out as a JSON report of where the time and memory went.
+
+Profiling is off unless start is called, and every function here returns immediately when it is off, so the instrumentation left in the
+processing costs a function call per stage or recorded item. A stage records the wall time, the CPU time of this process and of its finished
+child processes (e.g. the parsing pool and the BLAST processes, once they have been waited on), the peak resident set size of this process
+during the stage, the peak resident set size of the largest child process finished so far, and the rate that items were processed at.
+Stages started while another stage is running are recorded as its sub-stages.
+
+The peak resident set size of this process during a stage (peakRSSBytes) is measured by resetting the high water mark of the process at
+the start of the stage (by writing 5 to /proc/self/clear_refs) and reading it (VmHWM in /proc/self/status) at the end. Where that is not
+possible (i.e. anywhere but Linux), only the peak since the process started is available, and it is recorded as peakRSSSoFarBytes instead
+to make it clear that it includes the memory used before the stage began. The peak of the child processes can not be reset, so it is always
+recorded as childPeakRSSSoFarBytes. Individual measurements that are too numerous to keep in full (e.g. the time taken to parse each mmCIF
+file) are recorded as the largest few of each kind.
+'''
+
+import heapq
+import json
+import os
+import time
+
+try:
+    import resource
+except ImportError:
+    # The peak memory use is not available on platforms without the resource module.
+    resource = None
+
+# The state of the current profiling run, or None if profiling is off.
+runProfile = None
+
+def start(largestKept=20):
+    """Turn profiling on, discarding any stages and measurements recorded so far.
+
+    :param largestKept: The number of measurements of each kind to keep when only the largest are kept.
+    :type largestKept:  int
+
+    """
+
+    global runProfile
+    runProfile = {'started' : time.time(), 'startedWall' : time.perf_counter(), 'largestKept' : largestKept, 'stack' : [],
+                  'openStages' : [], 'stages' : [], 'measurements' : {}, 'largest' : {}, 'peakRSS' : None}
+    runProfile['resetPeak'] = rss_high_water() is not None and reset_rss_high_water()
+    note_peak_memory()
+
+def stop():
+    """Turn profiling off, discarding any stages and measurements recorded."""
+
+    global runProfile
+    runProfile = None
+
+def is_on():
+    """Determine whether profiling is on.
+
+    :returns :  Whether profiling is on.
+    :type :     boolean
+
+    """
+
+    return runProfile is not None
+
+def begin_stage(name):
+    """Start timing a stage of the processing. The stage is a sub-stage of any stage that has been begun but not yet ended.
+
+    :param name:    The name of the stage.
+    :type name:     string
+    :returns :      The state of the stage (to pass to end_stage), or None if profiling is off.
+    :type :         dictionary
+
+    """
+
+    if runProfile is None:
+        return None
+    # Fold the peak so far into the enclosing stages before resetting it, so that their peaks still cover the whole of their run.
+    note_peak_memory()
+    if runProfile['resetPeak']:
+        reset_rss_high_water()
+    runProfile['stack'].append(name)
+    stage = {'name' : '/'.join(runProfile['stack']), 'depth' : len(runProfile['stack']), 'peakRSS' : None}
+    runProfile['openStages'].append(stage)
+    note_peak_memory()
+    stage['wall'], stage['cpu'], stage['childCPU'] = current_times()
+    return stage
+
+def end_stage(stage, items=None):
+    """Finish timing a stage of the processing, and record it.
+
+    :param stage:   The state of the stage, as returned by begin_stage.
+    :type stage:    dictionary
+    :param items:   The number of items (e.g. files or sequences) processed by the stage, or None if the stage does not process items.
+    :type items:    int
+
+    """
+
+    if stage is None or runProfile is None:
+        return
+    wall, cpu, childCPU = current_times()
+    note_peak_memory()
+    del runProfile['stack'][stage['depth'] - 1:]
+    del runProfile['openStages'][stage['depth'] - 1:]
+    record = {'stage' : stage['name'], 'wallSeconds' : round(wall - stage['wall'], 6), 'cpuSeconds' : round(cpu - stage['cpu'], 6),
+              'childCPUSeconds' : round(childCPU - stage['childCPU'], 6)}
+    peakSoFar, record['childPeakRSSSoFarBytes'] = peak_memory()
+    if runProfile['resetPeak']:
+        record['peakRSSBytes'] = stage['peakRSS']
+    else:
+        record['peakRSSSoFarBytes'] = peakSoFar
+    if items is not None:
+        record['items'] = items
+        record['itemsPerSecond'] = round(items / record['wallSeconds'], 3) if record['wallSeconds'] > 0 else None
+    runProfile['stages'].append(record)
+
+def record(kind, name, seconds, **details):
+    """Record a single measurement, e.g. the time taken to BLAST one shard.
+
+    :param kind:    The kind of measurement.
+    :type kind:     string
+    :param name:    The name of the thing measured.
+    :type name:     string
+    :param seconds: The time taken.
+    :type seconds:  float
+    :param details: Any other information about the thing measured.
+    :type details:  dictionary
+
+    """
+
+    if runProfile is None:
+        return
+    measurement = {'name' : name, 'seconds' : round(seconds, 6)}
+    measurement.update(details)
+    runProfile['measurements'].setdefault(kind, []).append(measurement)
+
+def record_largest(kind, name, seconds):
+    """Record a single measurement, keeping only the largest measurements of its kind (e.g. the slowest mmCIF files to parse).
+
+    :param kind:    The kind of measurement.
+    :type kind:     string
+    :param name:    The name of the thing measured.
+    :type name:     string
+    :param seconds: The time taken.
+    :type seconds:  float
+
+    """
+
+    if runProfile is None:
+        return
+    largest = runProfile['largest'].setdefault(kind, [])
+    if len(largest) < runProfile['largestKept']:
+        heapq.heappush(largest, (seconds, name))
+    elif seconds > largest[0][0]:
+        heapq.heapreplace(largest, (seconds, name))
+
+def write_report(fileReport):
+    """Write out the stages and measurements recorded as a JSON report.
+
+    The report is written to a temporary file first, so that an interrupted write does not leave a partial report behind.
+
+    :param fileReport:  The location to write the report to.
+    :type fileReport:   string
+
+    """
+
+    if runProfile is None:
+        return
+    wall, cpu, childCPU = current_times()
+    report = {'started' : time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(runProfile['started'])),
+              'wallSeconds' : round(wall - runProfile['startedWall'], 6), 'stages' : runProfile['stages'],
+              'measurements' : runProfile['measurements']}
+    note_peak_memory()
+    report['peakRSSBytes'], report['childPeakRSSBytes'] = peak_memory()
+    if runProfile['resetPeak']:
+        # Resetting the high water mark also resets the peak reported by getrusage, so use the peak noted since profiling started instead.
+        report['peakRSSBytes'] = runProfile['peakRSS']
+    for kind, largest in runProfile['largest'].items():
+        report['measurements'][kind] = [{'name' : name, 'seconds' : round(seconds, 6)} for seconds, name in sorted(largest, reverse=True)]
+
+    with open(fileReport + '.tmp', 'w') as writeReport:
+        json.dump(report, writeReport, indent=1)
+    os.replace(fileReport + '.tmp', fileReport)
+
+def current_times():
+    """Determine the current wall time, and the CPU time used by this process and by its finished child processes.
+
+    :returns :  The wall time, the CPU time of this process and the CPU time of its finished child processes (all in seconds).
+    :type :     float, float, float
+
+    """
+
+    times = os.times()
+    return time.perf_counter(), times.user + times.system, times.children_user + times.children_system
+
+def peak_memory():
+    """Determine the peak resident set size of this process and of its largest finished child process.
+
+    :returns :  The peak resident set sizes in bytes, or None if they can not be determined on this platform.
+    :type :     int, int
+
+    """
+
+    if resource is None:
+        return None, None
+    # The peak resident set size is reported in kilobytes on Linux, but in bytes on macOS.
+    scale = 1 if os.uname().sysname == 'Darwin' else 1024
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale)
+
+def note_peak_memory():
+    """Fold the current high water mark of the resident set size of this process into the peaks of the run and the running stages.
+
+    The high water mark has to be noted before each reset, as the reset loses the peaks reached by the stages still running.
+
+    """
+
+    highWater = rss_high_water()
+    if highWater is None:
+        return
+    for i in runProfile['openStages'] + [runProfile]:
+        if i['peakRSS'] is None or highWater > i['peakRSS']:
+            i['peakRSS'] = highWater
+
+def rss_high_water():
+    """Determine the high water mark of the resident set size of this process since it started or was last reset.
+
+    :returns :  The high water mark in bytes, or None if it can not be determined on this platform.
+    :type :     int
+
+    """
+
+    try:
+        with open('/proc/self/status', 'r') as readStatus:
+            for line in readStatus:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+def reset_rss_high_water():
+    """Reset the high water mark of the resident set size of this process to its current resident set size.
+
+    :returns :  Whether the high water mark could be reset.
+    :type :     boolean
+
+    """
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as writeClear:
+            writeClear.write('5')
+    except OSError:
+        return False
+    return True
@@ -0,0 +1,131 @@
+'''
+Cluster near-duplicate sequences, so that only one sequence from each cluster (its centroid) needs to be searched for similar sequences.
+
+A sequence is a member of a cluster if it covers most of the centroid and is near-identical to it over the region it covers, e.g. a chain
+that only differs from the centroid by a missing tag, a truncated terminus or a point mutation. The sequences are clustered from longest to
+shortest, so a centroid is always at least as long as its members. The centroids are indexed by their minimizers (see kmersimilarity), and a
+sequence is checked against the centroids it shares the most minimizers with on a diagonal. A sequence contained within a centroid is
+identical to it over the region it covers, and otherwise the identity of the ungapped alignment along the diagonal is used.
+'''
+
+import kmersimilarity
+
+def main(fileReprFasta, fileClusters, minIdentity=95.0, minCoverage=0.9, kmerSize=10, windowSize=10, candidatesChecked=5):
+    """Cluster the sequences in a FASTA file, and write out the cluster that each non-centroid sequence belongs to.
+
+    :param fileReprFasta:       The FASTA file of the sequences to cluster (normally ReprChains.fasta).
+    :type fileReprFasta:        string
+    :param fileClusters:        The location where the members of the clusters will be written.
+    :type fileClusters:         string
+    :param minIdentity:         The minimum sequence identity (as a percentage) of a member to its centroid.
+    :type minIdentity:          float
+    :param minCoverage:         The minimum fraction of the centroid that a member must cover.
+    :type minCoverage:          float
+    :param kmerSize:            The length of the k-mers the minimizers are chosen from.
+    :type kmerSize:             int
+    :param windowSize:          The number of consecutive k-mers to choose each minimizer from.
+    :type windowSize:           int
+    :param candidatesChecked:   The maximum number of centroids that each sequence is checked against.
+    :type candidatesChecked:    int
+    :returns :                  The members of each cluster (and their identity to the centroid), keyed by the centroid.
+    :type :                     dictionary
+
+    """
+
+    names, sequences = kmersimilarity.read_fasta(fileReprFasta)
+    clusters = cluster_sequences(names, sequences, minIdentity, minCoverage, kmerSize, windowSize, candidatesChecked)
+
+    writeClusters = open(fileClusters, 'w')
+    writeClusters.write('Member\tCentroid\tIdentity\n')  # Write the header.
+    for centroid in sorted(clusters):
+        for member, identity in clusters[centroid]:
+            writeClusters.write(member + '\t' + centroid + '\t' + str(identity) + '\n')
+    writeClusters.close()
+
+    return clusters
+
+def cluster_sequences(names, sequences, minIdentity, minCoverage, kmerSize, windowSize, candidatesChecked):
+    """Cluster sequences by near-identity.
+
+    :param names:               The names of the sequences.
+    :type names:                list
+    :param sequences:           The sequences.
+    :type sequences:            list
+    :param minIdentity:         The minimum sequence identity (as a percentage) of a member to its centroid.
+    :type minIdentity:          float
+    :param minCoverage:         The minimum fraction of the centroid that a member must cover.
+    :type minCoverage:          float
+    :param kmerSize:            The length of the k-mers the minimizers are chosen from.
+    :type kmerSize:             int
+    :param windowSize:          The number of consecutive k-mers to choose each minimizer from.
+    :type windowSize:           int
+    :param candidatesChecked:   The maximum number of centroids that each sequence is checked against.
+    :type candidatesChecked:    int
+    :returns :                  The members of each cluster with at least one member (and their identity to the centroid), keyed by the
+                                centroid. The members are in the order that they appear in names.
+    :type :                     dictionary
+
+    """
+
+    clusters = {}
+    index = {}
+    for sequenceIndex in sorted(range(len(sequences)), key=lambda x : (-len(sequences[x]), x)):
+        sequence = sequences[sequenceIndex]
+        sequenceMinimizers = kmersimilarity.minimizers(sequence, kmerSize, windowSize)
+
+        # Count the minimizers shared with each centroid on each diagonal, and check the centroids sharing the most.
+        diagonalCounts = {}
+        for minimizer, position in sequenceMinimizers:
+            for centroid, centroidPosition in index.get(minimizer, ()):
+                key = (centroid, position - centroidPosition)
+                diagonalCounts[key] = diagonalCounts.get(key, 0) + 1
+        candidates = sorted(diagonalCounts, key=lambda x : (-diagonalCounts[x], x))[:candidatesChecked]
+
+        centroidFound = None
+        for centroid, diagonal in candidates:
+            identity = member_identity(sequence, sequences[centroid], diagonal, minCoverage)
+            if identity >= minIdentity:
+                centroidFound = centroid
+                break
+
+        if centroidFound is None:
+            # The sequence is not a member of any cluster, and is therefore the centroid of a new one.
+            for minimizer, position in sequenceMinimizers:
+                if minimizer in index:
+                    index[minimizer].append((sequenceIndex, position))
+                else:
+                    index[minimizer] = [(sequenceIndex, position)]
+        else:
+            clusters.setdefault(centroidFound, []).append((sequenceIndex, identity))
+
+    return dict((names[i], [(names[j], identity) for j, identity in sorted(clusters[i])]) for i in clusters)
+
+def member_identity(sequence, centroid, diagonal, minCoverage):
+    """Determine the sequence identity of a sequence to a centroid over the region of the centroid it covers.
+
+    :param sequence:    The sequence.
+    :type sequence:     string
+    :param centroid:    The centroid.
+    :type centroid:     string
+    :param diagonal:    The offset of the sequence's positions from the aligned positions in the centroid.
+    :type diagonal:     int
+    :param minCoverage: The minimum fraction of the centroid that the sequence must cover.
+    :type minCoverage:  float
+    :returns :          The sequence identity (as a percentage, rounded to two decimal places), or 0.0 if the sequence does not cover
+                        enough of the centroid.
+    :type :             float
+
+    """
+
+    if len(sequence) < minCoverage * len(centroid):
+        return 0.0
+    if sequence in centroid:
+        return 100.0
+
+    overlapSequence = sequence[max(diagonal, 0):]
+    overlapCentroid = centroid[max(-diagonal, 0):]
+    overlap = min(len(overlapSequence), len(overlapCentroid))
+    if overlap < minCoverage * len(centroid):
+        return 0.0
+    matches = sum([i == j for i, j in zip(overlapSequence, overlapCentroid)])
+    return round(100.0 * matches / overlap, 2)
@@ -0,0 +1,90 @@
+'''
+Randomised equivalence tests of Leafcull against the original Leaf algorithm (reference_Leafcull).
+
+The graphs are random graphs with cliques planted in them, in a range of densities, with their nodes in sorted order so that both
+implementations break ties between equally good nodes the same way.
+'''
+
+import copy
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import Leafcull
+import reference_Leafcull
+
+def random_graph(randomGenerator, numberOfNodes, edgeProbability, cliques):
+    """Generate a random symmetric adjacency list, with cliques planted in it and its nodes in sorted order.
+
+    Nodes without neighbours are left out of the adjacency list half of the time, as they can be when the culling builds its graph.
+
+    """
+
+    adjList = dict((i, set()) for i in range(numberOfNodes))
+    for i in range(numberOfNodes):
+        for j in range(i + 1, numberOfNodes):
+            if randomGenerator.random() < edgeProbability:
+                adjList[i].add(j)
+                adjList[j].add(i)
+    for i in range(cliques):
+        members = randomGenerator.sample(range(numberOfNodes), randomGenerator.randint(2, max(2, numberOfNodes // 4)))
+        for j in members:
+            adjList[j].update([k for k in members if k != j])
+    return dict((i, adjList[i]) for i in sorted(adjList) if adjList[i] or randomGenerator.random() < 0.5)
+
+class EquivalenceTests(unittest.TestCase):
+
+    def assert_equivalent(self, removeList, adjList):
+        expected = reference_Leafcull.main(copy.deepcopy(adjList))
+        self.assertEqual(sorted(removeList), sorted(expected))
+
+    def test_main(self):
+        randomGenerator = random.Random(0)
+        for i in range(1500):
+            adjList = random_graph(randomGenerator, randomGenerator.randint(2, 40), randomGenerator.choice([0.02, 0.1, 0.3, 0.6, 0.9]),
+                                   randomGenerator.randint(0, 3))
+            with self.subTest(graph=i):
+                originalAdjList = copy.deepcopy(adjList)
+                self.assert_equivalent(Leafcull.main(adjList), adjList)
+                self.assertEqual(adjList, originalAdjList)  # The graph is left unchanged.
+
+    def test_cull_component(self):
+        # cull_component gives the same result when given the whole graph rather than a single component.
+        randomGenerator = random.Random(1)
+        for i in range(500):
+            adjList = random_graph(randomGenerator, randomGenerator.randint(2, 30), randomGenerator.choice([0.05, 0.2, 0.5, 0.8]),
+                                   randomGenerator.randint(0, 2))
+            with self.subTest(graph=i):
+                self.assert_equivalent(Leafcull.cull_component(adjList), adjList)
+
+    def test_multiple_workers(self):
+        randomGenerator = random.Random(2)
+        for i in range(5):
+            adjList = random_graph(randomGenerator, 200, 0.01, 10)
+            with self.subTest(graph=i):
+                self.assert_equivalent(Leafcull.main(adjList, workers=2), adjList)
+
+    def test_statistics(self):
+        statistics = {}
+        adjList = {0 : set([1, 2]), 1 : set([0, 2]), 2 : set([0, 1]), 3 : set([4]), 4 : set([3]), 5 : set([])}
+        self.assertEqual(sorted(Leafcull.main(adjList, statistics=statistics)), [1, 2, 4])
+        self.assertEqual(statistics['components'], 3)
+        self.assertEqual(statistics['largestComponent'], 3)
+        self.assertEqual(statistics['cliqueIterations'], 1)
+
+    def test_removal_order(self):
+        # The removals are grouped by component, in the order that the components first appear in the graph.
+        adjList = {0 : set([1, 2]), 1 : set([0, 2]), 2 : set([0, 1]), 3 : set([4]), 4 : set([3]), 5 : set([6, 7]), 6 : set([5, 7]),
+                   7 : set([5, 6])}
+        self.assertEqual(Leafcull.main(adjList), [1, 2, 4, 6, 7])
+
+    def test_empty_graph(self):
+        self.assertEqual(Leafcull.main({}), [])
+        self.assertEqual(Leafcull.cull_component({}), [])
+
+if __name__ == '__main__':
+    unittest.main()
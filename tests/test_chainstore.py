@@ -0,0 +1,111 @@
+'''
+Tests of the binary chain store (chainstore): creating it from AllChains.fasta and exporting the FASTA and chain information files back out
+of it, the structure counts that are not known, and detecting stores that are truncated or from another version.
+'''
+
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chainstore
+
+baseSequence = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVK'
+
+# The chains as (chain, experimental type, resolution, R factor observed, R factor free, alpha carbon only, description, sequence, structure
+# counts). 1AAAB shares its sequence with 1AAAA, and the description of 2BBBA is not ASCII. There is an odd number of chains so that the
+# sections of the store need padding.
+chains = [('1AAAA', 'XRAY', '1.8', '0.19', '0.23', 'no', 'LYSOZYME', baseSequence + 'G', (480, 61, 61)),
+          ('1AAAB', 'XRAY', '1.8', '0.19', '0.23', 'no', 'LYSOZYME', baseSequence + 'G', (None, None, None)),
+          ('1AAAC', 'XRAY', '1.8', '0.19', '0.23', 'no', 'LYSOZYME', baseSequence[::-1], (470, 60, 60)),
+          ('2BBBA', 'NMR', '100.0', '1.0', '1.0', 'yes', 'PROTÉINE KINASE', baseSequence[:31], (31, 31, None)),
+          ('3CCCA', 'XRAY', '2.55', '0.201', '0.2498', 'no', 'HYDROLASE', 'GSHMDELLKKAEEWAKKNGLSPEEAVRLALELAKRGNPEVKEALERLLRRLEEEG', (0, 0, 0))]
+
+def identifier_line(chain):
+    """Create the identifier line of a chain in the format of AllChains.fasta."""
+
+    return '\t'.join([chain[0], str(len(chain[7])), chain[1], chain[2], chain[3], chain[4], chain[5], chain[6], '<UNP P00698>', '[GALLUS GALLUS]'])
+
+def chains_line(chain):
+    """Create the line of a chain in the format of Chains.tsv."""
+
+    return '\t'.join([chain[0], chain[2], chain[3], str(len(chain[7])), 'no' if chain[1] == 'XRAY' else 'yes', chain[5],
+                      chainstore.sequence_group(chain[7])] + ['NA' if i is None else str(i) for i in chain[8]]) + '\n'
+
+class StoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.fileStore = self.workDir + '/ChainStore.bin'
+        self.fileAllFasta = self.workDir + '/AllChains.fasta'
+        with open(self.fileAllFasta, 'w', encoding='utf-8') as writeAllFasta:
+            writeAllFasta.write(''.join('>' + identifier_line(i) + '\n' + i[7] + '\n' for i in chains))
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def read_file(self, fileName):
+        with open(self.workDir + '/' + fileName, 'rb') as readFile:
+            return readFile.read()
+
+    def write_store(self):
+        writer = chainstore.open_writer(self.fileStore)
+        for i in chains:
+            chainstore.add_chain(writer, identifier_line(i), i[7], i[8])
+        chainstore.close_writer(writer)
+
+    def test_fasta_round_trip(self):
+        chainstore.from_fasta(self.fileAllFasta, self.fileStore)
+        self.assertTrue(chainstore.is_current(self.fileStore))
+        store = chainstore.load(self.fileStore)
+        self.assertEqual(store['numberOfChains'], 5)
+        self.assertEqual(store['numberOfSequences'], 4)
+        chainstore.export_fasta(store, self.workDir + '/Exported.fasta')
+        self.assertEqual(self.read_file('Exported.fasta'), self.read_file('AllChains.fasta'))
+
+        # The FASTA file does not record the structure counts, so none of them are known.
+        self.assertEqual(set(store['atoms']) | set(store['alphaCarbons']) | set(store['residues']), set([chainstore.unknownCount]))
+        chainstore.export_chains(store, self.workDir + '/Chains.tsv')
+        self.assertTrue(all(i.endswith(b'\tNA\tNA\tNA') for i in self.read_file('Chains.tsv').splitlines()[1:]))
+
+    def test_chains_round_trip(self):
+        self.write_store()
+        store = chainstore.load(self.fileStore)
+        chainstore.export_chains(store, self.workDir + '/Chains.tsv')
+        expected = ('\t'.join(['Chain', 'Res', 'RVal', 'SeqLen', 'NonXRay', 'AlphaCarbonOnly', 'ReprGroup', 'Atoms', 'AlphaCarbons', 'Residues']) +
+                    '\n' + ''.join(chains_line(i) for i in chains))
+        self.assertEqual(self.read_file('Chains.tsv'), expected.encode('utf-8'))
+        chainstore.export_fasta(store, self.workDir + '/Exported.fasta')
+        self.assertEqual(self.read_file('Exported.fasta'), self.read_file('AllChains.fasta'))
+
+        # Counts that are not known are stored as unknownCount, while a count of 0 is known.
+        self.assertEqual(list(store['atoms']), [480, chainstore.unknownCount, 470, 31, 0])
+        self.assertEqual(list(store['residues']), [61, chainstore.unknownCount, 60, chainstore.unknownCount, 0])
+        self.assertEqual(store['sequenceIndex'][0], store['sequenceIndex'][1])
+        self.assertEqual([chainstore.group_id(store, i) for i in store['sequenceIndex']], [chainstore.sequence_group(i[7]) for i in chains])
+
+    def test_truncated(self):
+        self.write_store()
+        storeContents = self.read_file('ChainStore.bin')
+        for size in [0, struct.calcsize(chainstore.headerFormat) - 1, struct.calcsize(chainstore.headerFormat), len(storeContents) - 8]:
+            with open(self.fileStore, 'wb') as writeStore:
+                writeStore.write(storeContents[:size])
+            self.assertFalse(chainstore.is_current(self.fileStore))
+            if size >= struct.calcsize(chainstore.headerFormat):
+                self.assertRaises(ValueError, chainstore.load, self.fileStore)
+
+    def test_wrong_version(self):
+        self.write_store()
+        storeContents = self.read_file('ChainStore.bin')
+        with open(self.fileStore, 'wb') as writeStore:
+            writeStore.write(storeContents[:8] + struct.pack('=I', chainstore.storeVersion + 1) + storeContents[12:])
+        self.assertFalse(chainstore.is_current(self.fileStore))
+        self.assertRaises(ValueError, chainstore.load, self.fileStore)
+        self.assertFalse(chainstore.is_current(self.workDir + '/Missing.bin'))
+
+if __name__ == '__main__':
+    unittest.main()
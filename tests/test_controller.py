@@ -0,0 +1,34 @@
+'''
+Tests of running the whole processing through controller.
+'''
+
+import os
+import sys
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import controller
+
+class ControllerTests(unittest.TestCase):
+
+    def run_controller(self, **keywords):
+        with unittest.mock.patch.object(controller.updatelocalPDB, 'main') as updateMain, \
+             unittest.mock.patch.object(controller.generateculledsubsets, 'main') as cullMain:
+            controller.main('mmCIF', 'parsedPDB', 'blast', 4, **keywords)
+        cullMain.assert_called_once_with('parsedPDB', 4, fileSubsetSpec=keywords.get('fileSubsetSpec'))
+        return updateMain
+
+    def test_default_settings(self):
+        self.run_controller().assert_called_once_with('mmCIF', 'parsedPDB', 'blast', 4)
+
+    def test_update_settings(self):
+        # The settings of the similarity search are passed through to updatelocalPDB.
+        updateSettings = {'blastJobs' : 3, 'blastThreads' : 1, 'blastShardSize' : 50, 'similarityBackend' : 'kmer', 'kmerMinIdentity' : 80.0,
+                          'clusterIdentity' : 95.0, 'mmCIFCacheDir' : 'cache'}
+        updateMain = self.run_controller(fileSubsetSpec='Subsets.json', updateSettings=updateSettings)
+        updateMain.assert_called_once_with('mmCIF', 'parsedPDB', 'blast', 4, **updateSettings)
+
+if __name__ == '__main__':
+    unittest.main()
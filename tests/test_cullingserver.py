@@ -0,0 +1,99 @@
+'''
+Tests that the culling server answers a request that fails with an error, answers the requests waiting on the same culling with an error,
+and keeps serving afterwards (including after a worker process dies).
+'''
+
+import asyncio
+import os
+import random
+import shutil
+import signal
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmarks
+import cullingserver
+
+# The query string of the query that fails.
+failingQuery = 'resolution=2.5&rValue=0.3&seqIdentity=25'
+
+# The query string of a query that succeeds.
+workingQuery = 'resolution=3.0&rValue=0.3&seqIdentity=40'
+
+originalCull = cullingserver.cull_query
+
+def failing_cull(query):
+    """Cull the chains, failing for the failing query after giving identical requests time to start waiting on it."""
+
+    if query[2] == 25.0:
+        time.sleep(0.2)
+        raise RuntimeError('Culling failed.')
+    return originalCull(query)
+
+async def get(port, target):
+    """Send a GET request on a new connection, and return the status code of the response and its body."""
+
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(('GET ' + target + ' HTTP/1.1\r\nConnection: close\r\n\r\n').encode('latin-1'))
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    header, _, body = response.partition(b'\r\n\r\n')
+    return int(header.split()[1]), body
+
+class TestFailedRequests(unittest.TestCase):
+
+    def setUp(self):
+        self.parsedPDB = tempfile.mkdtemp()
+        benchmarks.generate_culling_stores(self.parsedPDB, 0.05, random.Random(0))
+
+    def tearDown(self):
+        cullingserver.cull_query = originalCull
+        shutil.rmtree(self.parsedPDB)
+
+    def serve_requests(self, workers, killWorker=False):
+        """Send two identical failing requests concurrently, and then a working request, to a server."""
+
+        serverState = cullingserver.open_server(self.parsedPDB, workers)
+        if killWorker:
+            # Kill a worker process, which leaves the pool of worker processes unusable.
+            os.kill(serverState['executor'].submit(os.getpid).result(), signal.SIGKILL)
+
+        async def run():
+            server = await asyncio.start_server(lambda reader, writer : cullingserver.handle_connection(serverState, reader, writer),
+                                                '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                failed = await asyncio.wait_for(asyncio.gather(get(port, '/cull?' + failingQuery), get(port, '/cull?' + failingQuery)), 30)
+                working = await asyncio.wait_for(get(port, '/cull?' + workingQuery), 30)
+                status = await get(port, '/status')
+            return failed, working, status
+
+        try:
+            return asyncio.run(run())
+        finally:
+            serverState['executor'].shutdown()
+
+    def test_exception(self):
+        cullingserver.cull_query = failing_cull
+        failed, working, status = self.serve_requests(1)
+        # The second request waits on the culling of the first, and so receives the same error.
+        self.assertEqual([i[0] for i in failed], [500, 500])
+        self.assertIn(b'Culling failed.', failed[0][1])
+        self.assertEqual(working[0], 200)
+        self.assertIn(b'"errors": 2', status[1])
+
+    @unittest.skipUnless(hasattr(signal, 'SIGKILL'), 'worker processes can not be killed on this platform')
+    def test_worker_death(self):
+        failed, working, status = self.serve_requests(2, True)
+        self.assertIn(500, [i[0] for i in failed])
+        # The broken pool of worker processes is replaced, so the next query is culled.
+        self.assertEqual(working[0], 200)
+        self.assertIn(b'"chains": ["', working[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,158 @@
+'''
+Tests of the binary similarity store (edgestore): writing and loading it, its checksum, the quantisation of the sequence identities, and the
+binary search for the similarities at or above a sequence identity.
+'''
+
+import array
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import edgestore
+import processPSIoutput
+
+def group_name(index):
+    """Generate the 16 character identifier of a sequence grouping."""
+
+    return 'G' + str(index).zfill(15)
+
+def random_similarities(randomGenerator, numberOfGroups, numberOfSimilarities):
+    """Generate similarities, to two decimal places, between random pairs of sequence groupings."""
+
+    similarities = {}
+    while len(similarities) < numberOfSimilarities:
+        pair = tuple(sorted(randomGenerator.sample(range(numberOfGroups), 2)))
+        similarities[pair] = round(randomGenerator.choice([randomGenerator.uniform(0.0, 100.0), randomGenerator.randint(0, 100)]), 2)
+    return similarities
+
+class StoreTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.fileStore = self.workDir + '/SimilarityEdges.bin'
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def write_random(self, numberOfGroups, numberOfSimilarities):
+        similarities = random_similarities(random.Random(0), numberOfGroups, numberOfSimilarities)
+        pairs = array.array('Q', [(i << 32) | j for i, j in similarities])
+        identity = array.array('H', [edgestore.quantise(i) for i in similarities.values()])
+        groupA, groupB, identity = edgestore.sort_similarities(pairs, identity)
+        groups = [group_name(i) for i in range(numberOfGroups)]
+        edgestore.write(self.fileStore, groups, groupA, groupB, identity)
+        return groups, groupA, groupB, identity
+
+    def test_round_trip(self):
+        # More similarities than are written in a single block, and an odd number of groupings and similarities so the sections are padded.
+        for numberOfGroups, numberOfSimilarities in [(3, 0), (5, 7), (1001, 70001)]:
+            groups, groupA, groupB, identity = self.write_random(numberOfGroups, numberOfSimilarities)
+            store = edgestore.load(self.fileStore)
+            self.assertEqual(store['numberOfGroups'], numberOfGroups)
+            self.assertEqual(store['numberOfSimilarities'], numberOfSimilarities)
+            self.assertEqual([edgestore.group_id(store, i) for i in range(numberOfGroups)], groups)
+            self.assertEqual(array.array('I', store['groupA']), groupA)
+            self.assertEqual(array.array('I', store['groupB']), groupB)
+            self.assertEqual(array.array('H', store['identity']), identity)
+            for name in ['groupIDs', 'groupA', 'groupB', 'identity']:
+                store[name].release()
+            store['mmap'].close()
+            self.assertEqual(os.listdir(self.workDir), ['SimilarityEdges.bin'])
+
+    def test_sorted(self):
+        groups, groupA, groupB, identity = self.write_random(50, 500)
+        records = list(zip(identity, groupA, groupB))
+        self.assertEqual(records, sorted(records, key=lambda record : (-record[0], record[1], record[2])))
+
+    def test_corrupt(self):
+        self.write_random(20, 100)
+        with open(self.fileStore, 'rb') as readStore:
+            contents = bytearray(readStore.read())
+        # Corrupt the last similarity's sequence identity.
+        contents[-1 - (-2 * 100 % 8)] ^= 0x01
+        with open(self.fileStore, 'wb') as writeStore:
+            writeStore.write(contents)
+        self.assertRaisesRegex(ValueError, 'checksum mismatch', edgestore.load, self.fileStore)
+        # The corruption goes unnoticed when the store is not verified.
+        self.assertEqual(edgestore.load(self.fileStore, False)['numberOfSimilarities'], 100)
+
+        with open(self.fileStore, 'wb') as writeStore:
+            writeStore.write(b'PDBCHAIN' + bytes(contents[8:]))
+        self.assertRaisesRegex(ValueError, 'not a version 1 similarity store', edgestore.load, self.fileStore)
+
+    def test_group_identifiers(self):
+        self.assertRaises(ValueError, edgestore.write, self.fileStore, ['short'], array.array('I'), array.array('I'), array.array('H'))
+        self.assertFalse(os.path.exists(self.fileStore))
+
+class QuantiseTests(unittest.TestCase):
+
+    def test_hundredths(self):
+        # Every sequence identity to two decimal places is stored exactly, including those (such as 2.05 or 0.29) whose product with 100
+        # falls just below the hundredth in floating point.
+        self.assertLess(2.05 * 100, 205)
+        self.assertEqual(edgestore.quantise(2.05), 205)
+        self.assertEqual(edgestore.quantise(30.05), 3005)
+        self.assertEqual(edgestore.quantise(0.29), 29)
+        self.assertEqual([edgestore.quantise(round(i / 100.0, 2)) for i in range(10001)], list(range(10001)))
+        self.assertEqual([edgestore.quantise(i / 100.0) for i in range(10001)], list(range(10001)))
+
+    def test_truncated(self):
+        # Sequence identities between hundredths are truncated, so none is raised to a threshold it was below.
+        self.assertEqual(edgestore.quantise(29.996), 2999)
+        self.assertEqual(edgestore.quantise(30.054), 3005)
+        self.assertEqual(edgestore.quantise(30.059999), 3005)
+        self.assertEqual(edgestore.quantise(100.0), 10000)
+        self.assertEqual(edgestore.quantise(0.0), 0)
+
+    def test_edges_at_boundaries(self):
+        identity = array.array('H', [10000, 3005, 3005, 3004, 3000, 2999, 0])
+        self.assertEqual(edgestore.edges_at_identity(identity, 100.0), 1)
+        self.assertEqual(edgestore.edges_at_identity(identity, 30.06), 1)
+        self.assertEqual(edgestore.edges_at_identity(identity, 30.05), 3)
+        # The threshold is truncated in the same way as the sequence identities, so 30.045 finds the similarities at or above 30.04.
+        self.assertEqual(edgestore.edges_at_identity(identity, 30.045), 4)
+        self.assertEqual(edgestore.edges_at_identity(identity, 30.0), 5)
+        self.assertEqual(edgestore.edges_at_identity(identity, 0.0), 7)
+        self.assertEqual(edgestore.edges_at_identity(array.array('H'), 30.0), 0)
+
+class SearchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def test_matches_tsv(self):
+        # The similarities at or above each sequence identity found by the binary search on the store are those at or above it in the
+        # similarity file written alongside it. A small memory limit spills the similarities to runs on disk.
+        similarities = random_similarities(random.Random(1), 100, 2000)
+        with open(self.workDir + '/Similarity.tsv', 'w') as writeSimilarity:
+            writeSimilarity.write('ChainGroupingA\tChainGroupingB\tSimilarity\n')
+            for (groupA, groupB), similarity in similarities.items():
+                writeSimilarity.write(group_name(groupA) + '\t' + group_name(groupB) + '\t' + str(similarity) + '\n')
+        groups = [group_name(i) for i in range(100)]
+        processPSIoutput.merge([self.workDir + '/Similarity.tsv'], set(groups), self.workDir + '/Merged.tsv', processPSIoutput.bytesPerPair * 300,
+                               self.workDir + '/SimilarityEdges.bin')
+
+        with open(self.workDir + '/Merged.tsv', 'r') as readMerged:
+            readMerged.readline()
+            merged = [(tuple(sorted(i[:2])), float(i[2])) for i in (j.split('\t') for j in readMerged)]
+        self.assertEqual(len(merged), len(similarities))
+        store = edgestore.load(self.workDir + '/SimilarityEdges.bin')
+        storePairs = [tuple(sorted([edgestore.group_id(store, i), edgestore.group_id(store, j)])) for i, j in zip(store['groupA'], store['groupB'])]
+
+        thresholds = set([i / 100.0 for i in range(0, 10001, 5)])
+        for similarity in set(i[1] for i in merged):
+            thresholds.update([similarity, round(similarity - 0.01, 2), round(similarity + 0.01, 2)])
+        for seqIdentity in sorted(thresholds):
+            numberOfEdges = edgestore.edges_at_identity(store['identity'], seqIdentity)
+            self.assertEqual(set(storePairs[:numberOfEdges]), set([i[0] for i in merged if i[1] >= seqIdentity]), seqIdentity)
+
+if __name__ == '__main__':
+    unittest.main()
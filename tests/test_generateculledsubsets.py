@@ -0,0 +1,305 @@
+'''
+Tests of the generation of the culled subsets (generateculledsubsets): the expansion of subset specifications into subsets, the filter
+predicates that select the chains of each subset, and the writing of the subsets and their manifest.
+'''
+
+import array
+import gzip
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmarks
+import chainstore
+import generateculledsubsets
+
+# The subsets generated from the synthetic stores.
+testSubsetSpec = {'subsets' : [
+    {'name' : 'SeqIden_{seqIdentity}_Res_{resolution}.fasta.gz', 'grid' : {'resolution' : [2.0, 3.0], 'seqIdentity' : [20, 25, 30]},
+     'filters' : [['length', '>=', 40]]},
+    {'name' : 'SeqIden_{seqIdentity}_All.fasta.gz', 'grid' : {'seqIdentity' : [20, 30]}}
+    ]}
+
+class SubsetSpecTests(unittest.TestCase):
+
+    def test_valid_spec(self):
+        subsetSpec = {'subsets' : [
+            {'name' : 'SeqIden_{seqIdentity}_Res_{resolution}.fasta.gz', 'grid' : {'resolution' : [2.0, 3.0], 'seqIdentity' : [30, 90]},
+             'filters' : [['length', '>=', 40], ['nonXRay', '==', 0]]},
+            {'name' : 'SeqIden_{seqIdentity}_Len_{minLength}.fasta.gz', 'grid' : {'minLength' : [100], 'seqIdentity' : [50]}}
+            ]}
+        self.assertEqual(generateculledsubsets.expand_subset_spec(subsetSpec), [
+            ((('length', '>=', 40), ('nonXRay', '==', 0), ('resolution', '<=', 2.0)), 30, 'SeqIden_30_Res_2.0.fasta.gz'),
+            ((('length', '>=', 40), ('nonXRay', '==', 0), ('resolution', '<=', 2.0)), 90, 'SeqIden_90_Res_2.0.fasta.gz'),
+            ((('length', '>=', 40), ('nonXRay', '==', 0), ('resolution', '<=', 3.0)), 30, 'SeqIden_30_Res_3.0.fasta.gz'),
+            ((('length', '>=', 40), ('nonXRay', '==', 0), ('resolution', '<=', 3.0)), 90, 'SeqIden_90_Res_3.0.fasta.gz'),
+            ((('length', '>=', 100),), 50, 'SeqIden_50_Len_100.fasta.gz')])
+
+    def test_default_spec(self):
+        # The default subsets are the fixed grid of subsets that were generated before subsets could be specified.
+        subsets = generateculledsubsets.expand_subset_spec(generateculledsubsets.defaultSubsetSpec)
+        self.assertEqual(len(subsets), 9 * 4 * 9 + 9)
+        self.assertEqual(len(set([i[2] for i in subsets])), len(subsets))
+        self.assertIn(((('alphaCarbonOnly', '==', 0), ('length', '>=', 40), ('nonXRay', '==', 0), ('rValue', '<=', 0.25),
+                        ('resolution', '<=', 1.6)), 20, 'SeqIden_20_Res_1.6_RVal_0.25.fasta.gz'), subsets)
+        self.assertIn(((('length', '>=', 40), ('rValue', '<=', 1.0), ('resolution', '<=', 100.0)), 90,
+                       'SeqIden_90_Res_100.0_RVal_1.0_INCLNONXRAY_INCLCAONLY.fasta.gz'), subsets)
+
+    def test_malformed_spec(self):
+        grid = {'seqIdentity' : [30]}
+        for subsetGrid, message in [({'grid' : grid}, 'name template'),
+                                    ({'name' : '{seqIdentity}.fasta.gz', 'grid' : {'resolution' : [2.0]}}, 'seqIdentity'),
+                                    ({'name' : '{seqIdentity}.fasta.gz', 'grid' : {'seqIdentity' : []}}, 'seqIdentity'),
+                                    ({'name' : '{seqIdentity}.fasta.gz', 'grid' : {'seqIdentity' : [30], 'rFree' : [0.3]}}, 'axis rFree'),
+                                    ({'name' : 'Subset.fasta.gz', 'grid' : {'seqIdentity' : [30, 40]}}, 'named Subset.fasta.gz'),
+                                    ({'name' : '{seqIdentity}.fasta.gz', 'grid' : grid, 'filters' : [['length', '>=']]}, 'values to unpack')]:
+            self.assertRaisesRegex(ValueError, message, generateculledsubsets.expand_subset_spec, {'subsets' : [subsetGrid]})
+        # Names must also be unique across the grids.
+        subsetGrid = {'name' : '{seqIdentity}.fasta.gz', 'grid' : grid}
+        self.assertRaisesRegex(ValueError, 'named 30.fasta.gz', generateculledsubsets.expand_subset_spec, {'subsets' : [subsetGrid, subsetGrid]})
+
+    def test_unknown_predicate(self):
+        for predicate in [['sequence', '==', 'MKT'], ['length', '=~', 40], ['Length', '>=', 40]]:
+            subsetSpec = {'subsets' : [{'name' : '{seqIdentity}.fasta.gz', 'grid' : {'seqIdentity' : [30]}, 'filters' : [predicate]}]}
+            self.assertRaisesRegex(ValueError, 'Unknown subset filter ' + ' '.join([str(i) for i in predicate]),
+                                   generateculledsubsets.expand_subset_spec, subsetSpec)
+
+class PredicateMaskTests(unittest.TestCase):
+
+    def setUp(self):
+        self.chainTable = {'chain' : ['1ABCA', '1ABCB', '2DEFA', '3GHIA'], 'res' : [1.5, 2.0, 2.5, 100.0], 'seqLen' : [39, 40, 41, 200],
+                           'nonXRay' : [0, 0, 0, 1], 'atoms' : [120, 0, chainstore.unknownCount, None]}
+
+    def test_comparisons(self):
+        mask = generateculledsubsets.predicate_mask
+        self.assertEqual(mask(self.chainTable, ('resolution', '<=', 2.0)), bytearray([1, 1, 0, 0]))
+        self.assertEqual(mask(self.chainTable, ('resolution', '<', 2.0)), bytearray([1, 0, 0, 0]))
+        self.assertEqual(mask(self.chainTable, ('length', '>=', 40)), bytearray([0, 1, 1, 1]))
+        self.assertEqual(mask(self.chainTable, ('length', '>', 40)), bytearray([0, 0, 1, 1]))
+        self.assertEqual(mask(self.chainTable, ('nonXRay', '==', 0)), bytearray([1, 1, 1, 0]))
+        self.assertEqual(mask(self.chainTable, ('nonXRay', '!=', 0)), bytearray([0, 0, 0, 1]))
+
+    def test_unknown_counts(self):
+        # A chain whose count is not known satisfies no predicate on the count, whichever way the comparison goes.
+        mask = generateculledsubsets.predicate_mask
+        self.assertEqual(mask(self.chainTable, ('atoms', '>=', 0)), bytearray([1, 1, 0, 0]))
+        self.assertEqual(mask(self.chainTable, ('atoms', '<', 100)), bytearray([0, 1, 0, 0]))
+        self.assertEqual(mask(self.chainTable, ('atoms', '!=', 0)), bytearray([1, 0, 0, 0]))
+
+    def test_cached(self):
+        # The mask of a predicate is only computed once, whether the predicate is a tuple or (as read from a specification) a list.
+        mask = generateculledsubsets.predicate_mask(self.chainTable, ('length', '>=', 40))
+        self.assertIs(generateculledsubsets.predicate_mask(self.chainTable, ['length', '>=', 40]), mask)
+        self.assertEqual(list(self.chainTable['masks']), [('length', '>=', 40)])
+
+    def test_filter_mask(self):
+        predicates = [('length', '>=', 40), ('resolution', '<=', 2.5), ('nonXRay', '==', 0)]
+        self.assertEqual(generateculledsubsets.filter_mask(self.chainTable, predicates), bytearray([0, 1, 1, 0]))
+        self.assertEqual(generateculledsubsets.filter_mask(self.chainTable, []), bytearray([1, 1, 1, 1]))
+
+    def test_unknown_column(self):
+        self.assertRaises(KeyError, generateculledsubsets.predicate_mask, self.chainTable, ('sequence', '==', 'MKT'))
+
+class CullAtIdentityTests(unittest.TestCase):
+
+    def setUp(self):
+        randomGenerator = random.Random(0)
+        identity = array.array('H', sorted([randomGenerator.randint(1500, 10000) for i in range(600)], reverse=True))
+        groupA = array.array('I', [randomGenerator.randrange(150) for i in identity])
+        groupB = array.array('I', [(i + randomGenerator.randrange(1, 150)) % 150 for i in groupA])
+        self.similarities = (groupA, groupB, identity)
+        self.toCull = dict((i, 1000 + i) for i in range(150) if randomGenerator.random() < 0.6)
+
+    def test_extension_matches_rebuild(self):
+        # Extending the graph of each sequence identity from that of the one above gives the same chains and statistics as examining every
+        # similarity at or above the sequence identity from scratch.
+        graph = {'adjList' : {}, 'edges' : 0, 'eligibleEdges' : 0}
+        for seqIdentity in [90, 70, 42.5, 30, 20]:
+            extendedStatistics = {}
+            rebuiltStatistics = {}
+            extended = generateculledsubsets.cull_at_identity(self.toCull, self.similarities, seqIdentity, extendedStatistics, graph)
+            rebuilt = generateculledsubsets.cull_at_identity(self.toCull, self.similarities, seqIdentity, rebuiltStatistics)
+            self.assertEqual(extended, rebuilt)
+            self.assertEqual(extendedStatistics, rebuiltStatistics)
+
+    def test_only_eligible_similarities(self):
+        # Only the similarities between eligible groups at or above the sequence identity are in the graph.
+        groupA, groupB, identity = self.similarities
+        graph = {'adjList' : {}, 'edges' : 0, 'eligibleEdges' : 0}
+        statistics = {}
+        generateculledsubsets.cull_at_identity(self.toCull, self.similarities, 42.5, statistics, graph)
+        expected = [(a, b) for a, b, c in zip(groupA, groupB, identity) if a in self.toCull and b in self.toCull and c >= 4250]
+        self.assertEqual(statistics['similarities'], len(expected))
+        self.assertEqual(dict((i, graph['adjList'][i]) for i in graph['adjList'] if graph['adjList'][i]),
+                         dict((i, set([b for a, b in expected if a == i] + [a for a, b in expected if b == i]))
+                              for i in set([j for k in expected for j in k])))
+
+class PrepareStoresTests(unittest.TestCase):
+
+    def setUp(self):
+        self.parsedPDB = tempfile.mkdtemp()
+        benchmarks.generate_culling_stores(self.parsedPDB, 0.05, random.Random(0))
+        self.edgesState = self.file_state('Similarity.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.parsedPDB)
+
+    def file_state(self, fileName):
+        return os.stat(self.parsedPDB + '/' + fileName).st_ino, os.stat(self.parsedPDB + '/' + fileName).st_mtime_ns
+
+    def test_current(self):
+        self.assertEqual(generateculledsubsets.prepare_stores(self.parsedPDB),
+                         (self.parsedPDB + '/ChainStore.bin', self.parsedPDB + '/Similarity.bin'))
+        self.assertEqual(self.file_state('Similarity.bin'), self.edgesState)
+
+    def test_similarity_file_newer(self):
+        modificationTime = os.path.getmtime(self.parsedPDB + '/Similarity.bin') + 1
+        os.utime(self.parsedPDB + '/Similarity.tsv', (modificationTime, modificationTime))
+        generateculledsubsets.prepare_stores(self.parsedPDB)
+        self.assertNotEqual(self.file_state('Similarity.bin'), self.edgesState)
+
+    def test_similarity_file_missing(self):
+        # Without the similarity file, the similarity store is used as long as it matches the chain store.
+        os.remove(self.parsedPDB + '/Similarity.tsv')
+        generateculledsubsets.prepare_stores(self.parsedPDB)
+        self.assertEqual(self.file_state('Similarity.bin'), self.edgesState)
+
+        # A similarity store that does not match the chain store can not be recreated without the similarity file.
+        otherDir = tempfile.mkdtemp()
+        try:
+            benchmarks.generate_culling_stores(otherDir, 0.05, random.Random(1))
+            shutil.copyfile(otherDir + '/ChainStore.bin', self.parsedPDB + '/ChainStore.bin')
+        finally:
+            shutil.rmtree(otherDir)
+        self.assertRaises(FileNotFoundError, generateculledsubsets.prepare_stores, self.parsedPDB)
+
+class WriteSubsetsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.parsedPDB = tempfile.mkdtemp()
+        self.subsetsDir = self.parsedPDB + '/CulledSubsets'
+        benchmarks.generate_culling_stores(self.parsedPDB, 0.05, random.Random(0))
+        self.write_spec(testSubsetSpec)
+
+    def tearDown(self):
+        shutil.rmtree(self.parsedPDB)
+
+    def write_spec(self, subsetSpec):
+        with open(self.parsedPDB + '/SubsetSpec.json', 'w') as writeSubsetSpec:
+            json.dump(subsetSpec, writeSubsetSpec)
+
+    def generate(self, **keywords):
+        generateculledsubsets.main(self.parsedPDB, fileSubsetSpec=self.parsedPDB + '/SubsetSpec.json', **keywords)
+        with open(self.subsetsDir + '/Manifest.json', 'r') as readManifest:
+            return json.load(readManifest)
+
+    def file_states(self):
+        # A file that is rewritten is replaced by a new file, and so has a new inode as well as a new modification time.
+        return dict((i, (os.stat(self.subsetsDir + '/' + i).st_ino, os.stat(self.subsetsDir + '/' + i).st_mtime_ns))
+                    for i in os.listdir(self.subsetsDir))
+
+    def test_manifest_hashes(self):
+        manifest = self.generate()
+        subsets = [i[2] for i in generateculledsubsets.expand_subset_spec(testSubsetSpec)]
+        self.assertEqual(sorted(manifest), sorted(subsets))
+        self.assertEqual(sorted(os.listdir(self.subsetsDir)), sorted(subsets + ['Manifest.json']))
+        for i in subsets:
+            self.assertEqual(manifest[i]['output'], generateculledsubsets.file_digest([self.subsetsDir + '/' + i]))
+        # Every subset has different inputs, as its predicates or sequence identity differ.
+        self.assertEqual(len(set([manifest[i]['inputs'] for i in subsets])), len(subsets))
+
+    def test_second_run_rewrites_nothing(self):
+        manifest = self.generate()
+        fileStates = self.file_states()
+        self.assertEqual(self.generate(), manifest)
+        self.assertEqual(self.file_states(), fileStates)
+
+        # When forced, every subset is regenerated, but the files are the same bytes, so are still left untouched.
+        self.assertEqual(self.generate(force=True), manifest)
+        self.assertEqual(self.file_states(), fileStates)
+
+    def test_changed_spec(self):
+        manifest = self.generate()
+        fileStates = self.file_states()
+        subsetSpec = json.loads(json.dumps(testSubsetSpec))
+        subsetSpec['subsets'][0]['filters'] = [['length', '>=', 100]]
+        self.write_spec(subsetSpec)
+        newManifest = self.generate()
+        newStates = self.file_states()
+
+        # Only the subsets of the grid whose filters changed are regenerated.
+        for i in manifest:
+            if i.endswith('_All.fasta.gz'):
+                self.assertEqual(newManifest[i], manifest[i])
+                self.assertEqual(newStates[i], fileStates[i])
+            else:
+                self.assertNotEqual(newManifest[i]['inputs'], manifest[i]['inputs'])
+                self.assertNotEqual(newManifest[i]['output'], manifest[i]['output'])
+                self.assertNotEqual(newStates[i], fileStates[i])
+
+    def test_changed_similarities(self):
+        manifest = self.generate()
+        fileStates = self.file_states()
+
+        # Remove the similarities below 25%, which only affects the subsets culled at a sequence identity below 25%.
+        with open(self.parsedPDB + '/Similarity.tsv', 'r') as readSimilarity:
+            lines = readSimilarity.readlines()
+        with open(self.parsedPDB + '/Similarity.tsv', 'w') as writeSimilarity:
+            writeSimilarity.write(lines[0])
+            writeSimilarity.write(''.join([i for i in lines[1:] if float(i.split('\t')[2]) >= 25.0]))
+        modificationTime = os.path.getmtime(self.parsedPDB + '/Similarity.bin') + 1
+        os.utime(self.parsedPDB + '/Similarity.tsv', (modificationTime, modificationTime))
+        newManifest = self.generate()
+        newStates = self.file_states()
+
+        # The inputs of every subset have changed, but only the files of the subsets culled at 20% are rewritten.
+        for i in manifest:
+            self.assertNotEqual(newManifest[i]['inputs'], manifest[i]['inputs'])
+            if i.startswith('SeqIden_20_'):
+                self.assertNotEqual(newManifest[i]['output'], manifest[i]['output'])
+                self.assertNotEqual(newStates[i], fileStates[i])
+            else:
+                self.assertEqual(newManifest[i]['output'], manifest[i]['output'])
+                self.assertEqual(newStates[i], fileStates[i])
+
+    def test_identical_gzip(self):
+        # The gzip files record no modification time, so a subset written again (e.g. after being deleted) is the same bytes.
+        manifest = self.generate()
+        fileSubset = self.subsetsDir + '/SeqIden_25_Res_3.0.fasta.gz'
+        with open(fileSubset, 'rb') as readSubset:
+            contents = readSubset.read()
+        self.assertEqual(contents[4:8], b'\x00\x00\x00\x00')
+        self.assertTrue(contents[10:].startswith(b'SeqIden_25_Res_3.0.fasta\x00'))
+        with gzip.open(fileSubset, 'rt') as readSubset:
+            self.assertTrue(readSubset.read().startswith('>'))
+        os.remove(fileSubset)
+        self.assertEqual(self.generate(), manifest)
+        with open(fileSubset, 'rb') as readSubset:
+            self.assertEqual(readSubset.read(), contents)
+        self.assertEqual([i for i in os.listdir(self.subsetsDir) if i.endswith('.tmp')], [])
+
+    def test_workers(self):
+        # The subsets generated by a pool of worker processes are the same bytes as those generated by a single process.
+        self.write_spec(generateculledsubsets.defaultSubsetSpec)
+        outputs = []
+        for workers in [1, 2]:
+            manifest = self.generate(workers=workers, force=True)
+            contents = {}
+            for i in manifest:
+                with open(self.subsetsDir + '/' + i, 'rb') as readSubset:
+                    contents[i] = readSubset.read()
+            outputs.append((manifest, contents))
+            shutil.rmtree(self.subsetsDir)
+        self.assertEqual(len(outputs[0][1]), 9 * 4 * 9 + 9)
+        self.assertEqual(outputs[0][0], outputs[1][0])
+        for i in outputs[0][1]:
+            self.assertEqual(outputs[0][1][i], outputs[1][1][i], i)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+'''
+Tests of the minimizer-index similarity search (kmersimilarity).
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import kmersimilarity
+
+baseSequence = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVK'
+
+def write_fasta(fileFasta, records):
+    """Write (name, sequence) records to a FASTA file with one line per sequence."""
+
+    with open(fileFasta, 'w') as writeFasta:
+        writeFasta.write(''.join('>' + name + '\n' + sequence + '\n' for name, sequence in records))
+
+def read_similarities(fileSimilarity):
+    """Read a similarity file into a mapping from each pair of sequences to their similarity, checking that no pair appears twice."""
+
+    with open(fileSimilarity, 'r') as readSimilarity:
+        readSimilarity.readline()
+        pairs = [((i[0], i[1]), float(i[2])) for i in (j.split('\t') for j in readSimilarity)]
+    similarities = dict(pairs)
+    assert len(similarities) == len(pairs)
+    return similarities
+
+class MinimizerTests(unittest.TestCase):
+
+    def test_known_sequence(self):
+        self.assertEqual(kmersimilarity.minimizers('MKTAYIAKQRQISFVKSHFS', 3, 4),
+                         [('KTA', 1), ('TAY', 2), ('AKQ', 6), ('QRQ', 8), ('RQI', 9), ('QIS', 10), ('VKS', 14), ('KSH', 15), ('SHF', 16)])
+
+    def test_smallest_hash_in_each_window(self):
+        # Every window's k-mer with the smallest CRC-32 (the first if tied) is a minimizer, and nothing else is.
+        kmerSize = 4
+        windowSize = 6
+        expected = set([])
+        for start in range(len(baseSequence) - kmerSize - windowSize + 2):
+            window = [zlib.crc32(baseSequence[i:i + kmerSize].encode('ascii')) for i in range(start, start + windowSize)]
+            position = start + window.index(min(window))
+            expected.add((baseSequence[position:position + kmerSize], position))
+        found = kmersimilarity.minimizers(baseSequence, kmerSize, windowSize)
+        self.assertEqual(set(found), expected)
+        self.assertEqual(found, sorted(found, key=lambda x : x[1]))
+
+    def test_short_sequences(self):
+        # A sequence shorter than a k-mer has no minimizers, and one shorter than a window still has one.
+        self.assertEqual(kmersimilarity.minimizers('MK', 3, 4), [])
+        self.assertEqual(kmersimilarity.minimizers('MKTAY', 3, 4), [('KTA', 1)])
+
+    def test_index(self):
+        # The index records each occurrence of each minimizer, and drops minimizers that occur in too many sequences.
+        sequences = [baseSequence, baseSequence[10:], baseSequence[::-1]]
+        index = kmersimilarity.build_index(sequences, 5, 8, 10)
+        for sequenceIndex, sequence in enumerate(sequences):
+            for minimizer, position in kmersimilarity.minimizers(sequence, 5, 8):
+                self.assertIn((sequenceIndex, position), index[minimizer])
+        self.assertTrue(any(len(i) == 2 for i in index.values()))
+        self.assertTrue(all(len(i) < 2 for i in kmersimilarity.build_index(sequences, 5, 8, 1).values()))
+
+class AlignmentTests(unittest.TestCase):
+
+    def test_point_mutant(self):
+        mutant = baseSequence[:20] + 'W' + baseSequence[21:]
+        self.assertEqual(kmersimilarity.align_on_diagonal(mutant, baseSequence, 0, 16), (98.33, 60))
+
+    def test_indel(self):
+        # An insertion pushes the ungapped alignment off the diagonal, so the banded alignment gaps over it (in either direction).
+        inserted = baseSequence[:30] + 'GGG' + baseSequence[30:]
+        self.assertEqual(kmersimilarity.align_on_diagonal(inserted, baseSequence, 0, 16), (95.24, 63))
+        self.assertEqual(kmersimilarity.align_on_diagonal(baseSequence, inserted, 0, 16), (95.24, 63))
+
+    def test_offset_diagonal(self):
+        self.assertEqual(kmersimilarity.align_on_diagonal('GSHM' + baseSequence, baseSequence, 4, 16), (100.0, 60))
+
+    def test_unrelated(self):
+        # An unrelated pair only has short local alignments, which the minimum alignment length of a search excludes.
+        shuffled = ''.join(random.Random(1).sample(baseSequence, len(baseSequence)))
+        identity, alignLength = kmersimilarity.align_on_diagonal(shuffled, baseSequence, 0, 16)
+        self.assertLess(alignLength, 20)
+
+class SearchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.sequences = [('base', baseSequence), ('mutant', baseSequence[:20] + 'WW' + baseSequence[22:]),
+                          ('inserted', baseSequence[:30] + 'GGG' + baseSequence[30:]),
+                          ('unrelated', ''.join(random.Random(1).sample(baseSequence, len(baseSequence))))]
+        write_fasta(self.workDir + '/Repr.fasta', self.sequences)
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def search(self, queries, **keywords):
+        write_fasta(self.workDir + '/Query.fasta', [i for i in self.sequences if i[0] in queries])
+        kmersimilarity.main(self.workDir + '/Query.fasta', self.workDir + '/Repr.fasta', self.workDir + '/Similarity.tsv', **keywords)
+        return read_similarities(self.workDir + '/Similarity.tsv')
+
+    def test_pairs_found(self):
+        self.assertEqual(self.search(['base', 'mutant', 'inserted', 'unrelated']),
+                         {('base', 'inserted') : 95.24, ('base', 'mutant') : 96.67, ('inserted', 'mutant') : 92.06})
+
+    def test_min_identity(self):
+        self.assertEqual(self.search(['base', 'mutant', 'inserted', 'unrelated'], minIdentity=95.0),
+                         {('base', 'inserted') : 95.24, ('base', 'mutant') : 96.67})
+        self.assertEqual(self.search(['base', 'mutant', 'inserted', 'unrelated'], minIdentity=99.0), {})
+
+    def test_query_pairs_searched_once(self):
+        # A pair of queries is only searched for from the query that comes first in the searched sequences, while a query is searched
+        # against every sequence that is not a query.
+        names, sequences = kmersimilarity.read_fasta(self.workDir + '/Repr.fasta')
+        index = kmersimilarity.build_index(sequences, 5, 8, 2000)
+        settings = {'minIdentity' : 70.0, 'kmerSize' : 5, 'windowSize' : 8, 'minShared' : 2, 'bandWidth' : 16, 'minAlignLength' : 20}
+        kmersimilarity.set_search_data(names, sequences, index, bytearray([1, 1, 0, 0]), settings)
+        self.assertEqual(sorted(kmersimilarity.search_query(('base', 0, sequences[0]))), ['inserted', 'mutant'])
+        self.assertEqual(sorted(kmersimilarity.search_query(('mutant', 1, sequences[1]))), ['inserted'])
+
+        # Searching only some of the sequences finds their pairs with every sequence, and each pair is written once.
+        self.assertEqual(self.search(['mutant']), {('base', 'mutant') : 96.67, ('inserted', 'mutant') : 92.06})
+
+    def test_workers(self):
+        self.assertEqual(self.search(['base', 'mutant', 'inserted', 'unrelated'], workers=2),
+                         self.search(['base', 'mutant', 'inserted', 'unrelated']))
+
+if __name__ == '__main__':
+    unittest.main()
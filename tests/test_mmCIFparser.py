@@ -0,0 +1,225 @@
+'''
+Parity tests of mmCIFparser against the parser it replaced (reference_mmCIFparser).
+
+The entries below are written in the layout of the PDB's mmCIF files (values separated by single spaces, each line of a loop ending in a
+space, and blocks separated by # lines), as that is the layout the reference parser depends on. A directory of real gzipped mmCIF files
+can also be checked by setting the MMCIF_CORPUS environment variable to it.
+'''
+
+import gzip
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mmCIFparser
+import reference_mmCIFparser
+
+# An X-ray entry with quoted values (including ones containing the other quote character), and semi-colon delimited text fields both in
+# and outside of loops.
+xrayEntry = '''data_1ABC
+# 
+_entry.id   1ABC 
+# 
+_struct.entry_id                  1ABC 
+_struct.title                     "Protein 1's domain bound to a 'TEST' ligand" 
+_struct.pdbx_descriptor           'Lysozyme C (E.C.3.2.1.17)' 
+_struct.pdbx_CASP_flag            ? 
+# 
+_exptl.entry_id          1ABC 
+_exptl.method            'X-RAY DIFFRACTION' 
+_exptl.crystals_number   1 
+# 
+_refine.entry_id                                 1ABC 
+_refine.ls_d_res_high                            1.80 
+_refine.ls_R_factor_obs                          0.192 
+_refine.ls_R_factor_R_free                       0.231 
+_refine.details                                  
+;HYDROGENS HAVE BEEN ADDED IN THE RIDING
+POSITIONS
+;
+# 
+loop_
+_entity.id 
+_entity.type 
+_entity.src_method 
+_entity.pdbx_description 
+_entity.formula_weight 
+1 polymer     man "Protein 1's domain"  14331.160 
+2 polymer     nat "Hemoglobin alpha"    15150.000 
+3 non-polymer syn 'SODIUM ION'          22.990    
+4 water       nat water                 18.015    
+# 
+loop_
+_entity_poly.entity_id 
+_entity_poly.type 
+_entity_poly.nstd_linkage 
+_entity_poly.pdbx_seq_one_letter_code_can 
+_entity_poly.pdbx_strand_id 
+1 'polypeptide(L)' no 
+;KVFGRCELAAAMKRHGLDNYRGYSLGNWVCAAKFESNFNTQATNRNTDGSTDYGILQINSRWWCNDGRTPGSRNLCNIPCSALLSSDITASVNCAKKIV
+SDGNGMNAWVAWRNRCKGTDVQAWIRGCRL
+;
+A 
+2 'polypeptide(L)' no VLSPADKTNVKAAWGKVGAHAGEYGAEALERMFLSFPTTKTYFPHF B,C 
+# 
+loop_
+_struct_ref.id 
+_struct_ref.db_name 
+_struct_ref.db_code 
+_struct_ref.entity_id 
+1 UNP LYSC_CHICK 1 
+2 UNP HBA_HUMAN  2 
+# 
+loop_
+_atom_site.group_PDB 
+_atom_site.id 
+_atom_site.type_symbol 
+_atom_site.label_atom_id 
+_atom_site.label_comp_id 
+_atom_site.label_asym_id 
+_atom_site.label_entity_id 
+_atom_site.label_seq_id 
+_atom_site.auth_asym_id 
+_atom_site.pdbx_PDB_model_num 
+ATOM   1    N  N     LYS A 1 1 A 1 
+ATOM   2    C  CA    LYS A 1 1 A 1 
+ATOM   3    C  C     LYS A 1 1 A 1 
+ATOM   4    O  "O5'" VAL A 1 2 A 1 
+ATOM   5    C  CA    VAL B 2 1 B 1 
+HETATM 6    NA NA    NA  D 3 . A 1 
+# 
+'''
+
+# An NMR entry with a single entity (so _entity is not a loop), multiple models and a multi-line semi-colon delimited title.
+nmrEntry = '''data_2XYZ
+# 
+_entry.id   2XYZ 
+# 
+_struct.entry_id                  2XYZ 
+_struct.title                     
+;SOLUTION STRUCTURE OF THE N-TERMINAL DOMAIN OF
+A "DESIGNED" PROTEIN
+;
+# 
+_exptl.entry_id          2XYZ 
+_exptl.method            'SOLUTION NMR' 
+# 
+_entity.id                         1 
+_entity.type                       polymer 
+_entity.src_method                 syn 
+_entity.pdbx_description           "Designed peptide 5'-end" 
+# 
+_entity_poly.entity_id                      1 
+_entity_poly.type                           'polypeptide(L)' 
+_entity_poly.nstd_linkage                   no 
+_entity_poly.pdbx_seq_one_letter_code_can   GSHMLEDPVRKAWEQ 
+_entity_poly.pdbx_strand_id                 A 
+# 
+loop_
+_atom_site.group_PDB 
+_atom_site.id 
+_atom_site.label_atom_id 
+_atom_site.label_entity_id 
+_atom_site.label_seq_id 
+_atom_site.auth_asym_id 
+_atom_site.pdbx_PDB_model_num 
+ATOM 1 N  1 1 A 1 
+ATOM 2 CA 1 1 A 1 
+ATOM 3 N  1 1 A 2 
+ATOM 4 CA 1 1 A 2 
+# 
+'''
+
+class ParityTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def write_entry(self, name, entry, members=1):
+        """Write an entry out as a gzipped file, split into a number of gzip members at (roughly) evenly spaced points."""
+
+        fileEntry = self.workDir + '/' + name + '.cif.gz'
+        content = entry.encode('utf-8')
+        splits = [len(content) * i // members for i in range(members + 1)]
+        with open(fileEntry, 'wb') as writeEntry:
+            for start, end in zip(splits, splits[1:]):
+                writeEntry.write(gzip.compress(content[start:end]))
+        return fileEntry
+
+    def assert_parity(self, fileEntry):
+        expected = reference_mmCIFparser.main(fileEntry)
+        self.assertEqual(mmCIFparser.main(fileEntry), expected)
+
+        # The uncompressed cache gives the same result both when it is written and when it is read.
+        cacheDir = self.workDir + '/Cache'
+        if not os.path.exists(cacheDir):
+            os.mkdir(cacheDir)
+        self.assertEqual(mmCIFparser.main(fileEntry, cacheDir=cacheDir), expected)
+        self.assertEqual(mmCIFparser.main(fileEntry, cacheDir=cacheDir), expected)
+
+    def test_xray_entry(self):
+        self.assert_parity(self.write_entry('1ABC', xrayEntry))
+
+    def test_nmr_entry(self):
+        self.assert_parity(self.write_entry('2XYZ', nmrEntry))
+
+    def test_multiple_gzip_members(self):
+        # The members are split part of the way through lines, values and semi-colon delimited text fields.
+        for members in [2, 3, 7]:
+            fileEntry = self.write_entry('1ABC_' + str(members), xrayEntry, members)
+            self.assertEqual(mmCIFparser.main(fileEntry), reference_mmCIFparser.main(self.write_entry('1ABC', xrayEntry)))
+            self.assert_parity(fileEntry)
+
+    def test_small_reads(self):
+        # Reading a few bytes at a time splits the blocks, and the separators between them, across many pieces.
+        originalReadSize = mmCIFparser.readSize
+        try:
+            for readSize in [1, 7, 64]:
+                mmCIFparser.readSize = readSize
+                self.assert_parity(self.write_entry('1ABC_' + str(readSize), xrayEntry, 3))
+        finally:
+            mmCIFparser.readSize = originalReadSize
+
+    def test_quoted_values(self):
+        parsed = mmCIFparser.main(self.write_entry('1ABC', xrayEntry))
+        self.assertEqual(parsed['_struct']['title'], ["Protein 1's domain bound to a 'TEST' ligand"])
+        self.assertEqual(parsed['_entity']['pdbx_description'], ["Protein 1's domain", 'Hemoglobin alpha', 'SODIUM ION', 'water'])
+        self.assertEqual(parsed['_atom_site']['label_atom_id'][3], "O5'")
+        self.assertEqual(parsed['_refine']['details'], ['HYDROGENS HAVE BEEN ADDED IN THE RIDINGPOSITIONS'])
+
+    def test_requested_items(self):
+        fileEntry = self.write_entry('1ABC', xrayEntry)
+        expected = reference_mmCIFparser.main(fileEntry)
+        parsed = mmCIFparser.main(fileEntry, {'_entity' : set(['id', 'pdbx_description']), '_exptl' : None})
+        self.assertEqual(parsed, {'_entity' : {'id' : expected['_entity']['id'], 'pdbx_description' : expected['_entity']['pdbx_description']},
+                                  '_exptl' : expected['_exptl']})
+
+    def test_loop_rows(self):
+        # The records of a scanned loop are the same as the columns of the parsed loop.
+        expected = reference_mmCIFparser.main(self.write_entry('1ABC', xrayEntry))
+        for category in ['_entity_poly', '_atom_site']:
+            scanned = mmCIFparser.main(self.write_entry('1ABC', xrayEntry), {}, {category : mmCIFparser.loop_rows})[category]
+            items, records = scanned
+            columns = [list(i) for i in zip(*records)]
+            self.assertEqual(dict(zip(items, columns)), expected[category])
+
+    @unittest.skipUnless(os.environ.get('MMCIF_CORPUS'), 'MMCIF_CORPUS is not set to a directory of gzipped mmCIF files.')
+    def test_corpus(self):
+        corpusDir = os.environ['MMCIF_CORPUS']
+        for root, dirs, files in os.walk(corpusDir):
+            for i in sorted(files):
+                if i.endswith('.cif.gz'):
+                    with self.subTest(mmCIFFile=i):
+                        fileEntry = root + '/' + i
+                        self.assertEqual(mmCIFparser.main(fileEntry), reference_mmCIFparser.main(fileEntry))
+
+if __name__ == '__main__':
+    unittest.main()
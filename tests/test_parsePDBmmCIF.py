@@ -0,0 +1,143 @@
+'''
+Tests of the summary of the _atom_site block of mmCIF files (parsePDBmmCIF.scan_atom_site), and of the counts of the atoms, alpha carbons
+and residues of each chain that are exported from it.
+'''
+
+import gzip
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import benchmarks
+import chainstore
+import generateculledsubsets
+import parsePDBmmCIF
+import pdblibrary
+
+def atom_site_block(items, records):
+    """Write an _atom_site loop with the given items, and a record for each (atom, entity, residue, chain, model) tuple."""
+
+    return ('loop_\n' + ''.join(['_atom_site.' + i + ' \n' for i in items]) +
+            ''.join([' '.join([str(j) for j in record]) + ' \n' for record in records]))
+
+def residue_atoms(entity, residue, chain, model, atoms=('N', 'CA', 'C', 'O')):
+    """Generate the (atom, entity, residue, chain, model) tuples of the atoms of a residue."""
+
+    return [(i, entity, residue, chain, model) for i in atoms]
+
+class ScanAtomSiteTests(unittest.TestCase):
+
+    items = ['label_atom_id', 'label_entity_id', 'label_seq_id', 'auth_asym_id', 'pdbx_PDB_model_num']
+
+    def test_counts(self):
+        # Entity 1 has two chains (of 3 and 2 residues), and entity 2 has a single chain of alpha carbons only.
+        records = []
+        for residue in range(1, 4):
+            records.extend(residue_atoms('1', residue, 'A', '1'))
+        for residue in range(1, 3):
+            records.extend(residue_atoms('1', residue, 'B', '1', ('N', 'CA')))
+        for residue in range(5, 10):
+            records.extend(residue_atoms('2', residue, 'C', '1', ('CA',)))
+        entitiesWithOtherAtoms, structureCounts = parsePDBmmCIF.scan_atom_site(atom_site_block(self.items, records))
+        self.assertEqual(entitiesWithOtherAtoms, set(['1']))
+        self.assertEqual(structureCounts, {('1', 'A') : [12, 3, 3], ('1', 'B') : [4, 2, 2], ('2', 'C') : [5, 5, 5]})
+
+    def test_first_model_only(self):
+        # The atoms of the later models are not counted, but any atom other than an alpha carbon in them is still noticed.
+        records = residue_atoms('1', 1, 'A', '1', ('CA',)) + residue_atoms('1', 2, 'A', '1', ('CA',))
+        records += residue_atoms('1', 1, 'A', '2', ('CA', 'CB')) + residue_atoms('1', 2, 'A', '2', ('CA',))
+        entitiesWithOtherAtoms, structureCounts = parsePDBmmCIF.scan_atom_site(atom_site_block(self.items, records))
+        self.assertEqual(structureCounts, {('1', 'A') : [2, 2, 2]})
+        self.assertEqual(entitiesWithOtherAtoms, set(['1']))
+
+    def test_residues_change(self):
+        # A residue is counted each time the residue (or chain) changes from one atom to the next.
+        records = residue_atoms('1', 1, 'A', '1') + residue_atoms('1', 1, 'B', '1') + residue_atoms('1', 2, 'B', '1')
+        structureCounts = parsePDBmmCIF.scan_atom_site(atom_site_block(self.items, records))[1]
+        self.assertEqual(structureCounts, {('1', 'A') : [4, 1, 1], ('1', 'B') : [8, 2, 2]})
+
+    def test_chain_columns(self):
+        # The author chain is preferred to the label chain, which is used when there is no author chain.
+        records = [('CA', '1', 1, 'X', 'A', '1'), ('CA', '1', 2, 'X', 'A', '1'), ('CA', '1', 1, 'Y', 'B', '1')]
+        items = ['label_atom_id', 'label_entity_id', 'label_seq_id', 'label_asym_id', 'auth_asym_id', 'pdbx_PDB_model_num']
+        self.assertEqual(parsePDBmmCIF.scan_atom_site(atom_site_block(items, records))[1], {('1', 'A') : [2, 2, 2], ('1', 'B') : [1, 1, 1]})
+        items = ['label_atom_id', 'label_entity_id', 'label_seq_id', 'label_asym_id', 'pdbx_PDB_model_num']
+        records = [i[:4] + i[5:] for i in records]
+        self.assertEqual(parsePDBmmCIF.scan_atom_site(atom_site_block(items, records))[1], {('1', 'X') : [2, 2, 2], ('1', 'Y') : [1, 1, 1]})
+
+    def test_missing_columns(self):
+        # Without a chain column the atoms are counted for the entity as a whole, without a residue column no residues are counted, and
+        # without a model column every atom is counted.
+        records = [('CA', '1', 1), ('CB', '1', 1), ('CA', '1', 2), ('CA', '1', 1)]
+        self.assertEqual(parsePDBmmCIF.scan_atom_site(atom_site_block(['label_atom_id', 'label_entity_id', 'label_seq_id'], records))[1],
+                         {('1', None) : [4, 3, 3]})
+        records = [i[:2] for i in records]
+        self.assertEqual(parsePDBmmCIF.scan_atom_site(atom_site_block(['label_atom_id', 'label_entity_id'], records))[1],
+                         {('1', None) : [4, 3, 0]})
+
+class StructureCountTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.randomGenerator = random.Random(0)
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def test_multi_model_entry(self):
+        fileMmCIF = self.workDir + '/1abc.cif.gz'
+        benchmarks.generate_mmCIF(fileMmCIF, self.randomGenerator, '1ABC', ['MKTAYIAKQR', 'GSHMDE'], 3, 2, 4, 'SOLUTION NMR')
+        entityRecords = parsePDBmmCIF.main(fileMmCIF)[1]
+        self.assertEqual(entityRecords['1']['structureCounts'], {'A' : (30, 10, 10)})
+        self.assertEqual(entityRecords['2']['structureCounts'], {'B' : (18, 6, 6)})
+
+    def test_unknown_chain_counts(self):
+        # When the chain of each atom is not recorded, the counts of each chain are not known, rather than being made up from the counts
+        # of the entity.
+        fileMmCIF = self.workDir + '/1abc.cif.gz'
+        benchmarks.generate_mmCIF(fileMmCIF, self.randomGenerator, '1ABC', ['MKTAYIAKQR', 'GSHMDE'], 3)
+        with gzip.open(fileMmCIF, 'rt') as readMmCIF:
+            lines = readMmCIF.read().split('\n')
+        atomItems = [i.strip() for i in lines if i.startswith('_atom_site.')]
+        dropped = [atomItems.index('_atom_site.label_asym_id'), atomItems.index('_atom_site.auth_asym_id')]
+        rewritten = []
+        for line in lines:
+            if line.startswith('ATOM') or line.startswith('HETATM'):
+                line = ' '.join([j for k, j in enumerate(line.split()) if not k in dropped]) + ' '
+            elif line.strip() in ['_atom_site.label_asym_id', '_atom_site.auth_asym_id']:
+                continue
+            elif line.startswith('A ') or line.startswith('B '):
+                line = 'A,C ' if line.startswith('A ') else line  # Entity 1 has two chains.
+            rewritten.append(line)
+        with gzip.open(fileMmCIF, 'wt') as writeMmCIF:
+            writeMmCIF.write('\n'.join(rewritten))
+
+        entityRecords = parsePDBmmCIF.main(fileMmCIF)[1]
+        self.assertEqual(entityRecords['1']['structureCounts'], {'A' : (None, None, None), 'C' : (None, None, None)})
+
+        # The counts are stored as unknown, exported as NA and satisfy no filter predicate on them.
+        records = list(pdblibrary.parse_chains([fileMmCIF]))
+        self.assertEqual([(i.chain, i.atoms, i.alphaCarbons, i.residues) for i in records],
+                         [('1ABCA', None, None, None), ('1ABCC', None, None, None), ('1ABCB', None, None, None)])
+        writer = chainstore.open_writer(self.workDir + '/ChainStore.bin')
+        for record in records:
+            chainstore.add_chain(writer, pdblibrary.identifier_line(record), record.sequence, (record.atoms, record.alphaCarbons, record.residues))
+        chainstore.close_writer(writer)
+        store = chainstore.load(self.workDir + '/ChainStore.bin')
+        self.assertEqual(list(store['atoms']), [chainstore.unknownCount] * 3)
+        chainstore.export_chains(store, self.workDir + '/Chains.tsv')
+        with open(self.workDir + '/Chains.tsv', 'r') as readChains:
+            self.assertEqual([i.split('\t')[-3:] for i in readChains.read().split('\n')[1:-1]], [['NA', 'NA', 'NA']] * 3)
+        self.assertEqual([i.atoms for i in pdblibrary.load_chains(self.workDir + '/ChainStore.bin')], [None] * 3)
+        chainTable = generateculledsubsets.load_chains(self.workDir + '/ChainStore.bin')
+        self.assertEqual(list(generateculledsubsets.predicate_mask(chainTable, ('atoms', '>=', 0))), [0, 0, 0])
+        self.assertEqual(list(generateculledsubsets.predicate_mask(chainTable, ('residues', '<', 10 ** 6))), [0, 0, 0])
+        self.assertEqual(list(generateculledsubsets.predicate_mask(chainTable, ('length', '>=', 0))), [1, 1, 1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+'''
+Tests of the optional instrumentation (profiling): the stages and measurements written to the report, keeping only the largest
+measurements, and the peak memory use of the stages on platforms where the peak can and can not be reset.
+'''
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import profiling
+
+# Whether the high water mark of the resident set size can be read and reset (i.e. on Linux).
+canResetPeak = profiling.rss_high_water() is not None and os.access('/proc/self/clear_refs', os.W_OK)
+
+class ReportTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.fileReport = self.workDir + '/RunReport.json'
+
+    def tearDown(self):
+        profiling.stop()
+        shutil.rmtree(self.workDir)
+
+    def run_stages(self):
+        """Run a stage containing a sub-stage, and a stage that does not process items, and write out the report."""
+
+        profiling.start(largestKept=3)
+        parseStage = profiling.begin_stage('parse')
+        fileStage = profiling.begin_stage('files')
+        for i in range(10):
+            profiling.record_largest('parseSeconds', 'file' + str(i), (i * 7 % 10) / 10)
+        profiling.end_stage(fileStage, items=10)
+        profiling.end_stage(parseStage, items=4)
+        cullStage = profiling.begin_stage('cull')
+        profiling.record('shard', 'shard0', 0.25, queries=2)
+        profiling.end_stage(cullStage)
+        profiling.write_report(self.fileReport)
+        with open(self.fileReport, 'r') as readReport:
+            return json.load(readReport)
+
+    def test_report(self):
+        report = self.run_stages()
+        self.assertFalse(os.path.exists(self.fileReport + '.tmp'))
+        self.assertEqual([i['stage'] for i in report['stages']], ['parse/files', 'parse', 'cull'])
+        self.assertEqual([i.get('items') for i in report['stages']], [10, 4, None])
+        self.assertNotIn('itemsPerSecond', report['stages'][2])
+        self.assertTrue(all(i['wallSeconds'] >= 0 and i['cpuSeconds'] >= 0 for i in report['stages']))
+        self.assertGreaterEqual(report['wallSeconds'], report['stages'][1]['wallSeconds'])
+
+        # Only the three largest of the ten measurements are kept, largest first, while every measurement recorded in full is kept.
+        self.assertEqual(report['measurements']['parseSeconds'],
+                         [{'name' : 'file7', 'seconds' : 0.9}, {'name' : 'file4', 'seconds' : 0.8}, {'name' : 'file1', 'seconds' : 0.7}])
+        self.assertEqual(report['measurements']['shard'], [{'name' : 'shard0', 'seconds' : 0.25, 'queries' : 2}])
+
+    def test_off(self):
+        # Nothing is recorded or written when profiling is off, including after it has been stopped.
+        for i in range(2):
+            self.assertFalse(profiling.is_on())
+            self.assertIsNone(profiling.begin_stage('parse'))
+            profiling.end_stage(None, items=1)
+            profiling.record_largest('parseSeconds', 'file', 1.0)
+            profiling.write_report(self.fileReport)
+            self.assertFalse(os.path.exists(self.fileReport))
+            profiling.start()
+            self.assertTrue(profiling.is_on())
+            profiling.stop()
+
+    def test_peak_not_resettable(self):
+        # Where the high water mark can not be read, each stage records the peak since the process started.
+        with unittest.mock.patch.object(profiling, 'rss_high_water', return_value=None):
+            report = self.run_stages()
+        for i in report['stages']:
+            self.assertNotIn('peakRSSBytes', i)
+            self.assertIn('peakRSSSoFarBytes', i)
+            self.assertIn('childPeakRSSSoFarBytes', i)
+        if profiling.resource is not None:
+            self.assertGreaterEqual(report['peakRSSBytes'], report['stages'][0]['peakRSSSoFarBytes'])
+
+    @unittest.skipUnless(canResetPeak, 'the high water mark of the resident set size can only be reset on Linux')
+    def test_peak_reset(self):
+        # A stage's peak covers the memory used by its sub-stages, but not that used by an earlier stage.
+        profiling.start()
+        outerStage = profiling.begin_stage('outer')
+        largeStage = profiling.begin_stage('large')
+        allocation = bytearray(64 * 1024 * 1024)
+        allocation[::4096] = b'\x01' * len(allocation[::4096])  # Touch every page so that it is resident.
+        profiling.end_stage(largeStage)
+        del allocation
+        profiling.end_stage(outerStage)
+        smallStage = profiling.begin_stage('small')
+        profiling.end_stage(smallStage)
+        profiling.write_report(self.fileReport)
+        with open(self.fileReport, 'r') as readReport:
+            report = json.load(readReport)
+
+        large, outer, small = report['stages']
+        self.assertNotIn('peakRSSSoFarBytes', large)
+        self.assertGreaterEqual(outer['peakRSSBytes'], large['peakRSSBytes'])
+        self.assertLess(small['peakRSSBytes'], large['peakRSSBytes'] - 32 * 1024 * 1024)
+        self.assertGreaterEqual(report['peakRSSBytes'], large['peakRSSBytes'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+'''
+Tests of the clustering of near-duplicate sequences (sequenceclusters), and of the propagation of the similarities of the cluster centroids to
+the cluster members when the similarities are merged (processPSIoutput.merge).
+'''
+
+import os
+import random
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import processPSIoutput
+import sequenceclusters
+
+baseSequence = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVKALPDAQFEVVHSLAKWKRQTLGQHDFSAGEGLYTHMKALRPDEDRLSPLHSVYVDQWDWERVMGDGERQFSTLKSTVEAIWAGIKATEAAVSEEFGLAPFLPDQIHFVHSQELLSRYPDLDAKGRERAIAKDLGAVFLVGIGGKLSDGHRHDVRAPDYDDWUAGGLTSSLRDQIARL'
+
+def point_mutant(sequence, position):
+    """Substitute the residue at a position of a sequence with a different residue."""
+
+    return sequence[:position] + ('A' if sequence[position] != 'A' else 'G') + sequence[position + 1:]
+
+def write_similarities(fileSimilarity, similarities):
+    """Write similarities between pairs of sequence groupings in the format written by processPSIoutput."""
+
+    with open(fileSimilarity, 'w') as writeSimilarity:
+        writeSimilarity.write('ChainGroupingA\tChainGroupingB\tSimilarity\n')
+        for (groupA, groupB), similarity in sorted(similarities.items()):
+            writeSimilarity.write(groupA + '\t' + groupB + '\t' + str(similarity) + '\n')
+
+def read_similarities(fileSimilarity):
+    """Read a similarity file into a mapping from each pair of sequence groupings to their similarity."""
+
+    with open(fileSimilarity, 'r') as readSimilarity:
+        readSimilarity.readline()
+        return dict(((i[0], i[1]), float(i[2])) for i in (j.split('\t') for j in readSimilarity))
+
+class ClusteringTests(unittest.TestCase):
+
+    def cluster(self, sequences, minIdentity=95.0):
+        names = sorted(sequences)
+        return sequenceclusters.cluster_sequences(names, [sequences[i] for i in names], minIdentity, 0.9, 10, 10, 5)
+
+    def test_near_duplicates_clustered(self):
+        # A missing His-tag, a truncated terminus and a point mutation each leave a sequence in the cluster of the full sequence.
+        sequences = {'full' : 'HHHHHH' + baseSequence, 'untagged' : baseSequence, 'truncated' : 'HHHHHH' + baseSequence[:-10],
+                     'mutant' : point_mutant('HHHHHH' + baseSequence, 100), 'unrelated' : baseSequence[::-1]}
+        clusters = self.cluster(sequences)
+        self.assertEqual(set(clusters), set(['full']))
+        members = dict(clusters['full'])
+        self.assertEqual(set(members), set(['mutant', 'truncated', 'untagged']))
+        # The contained sequences are identical to the centroid over the region they cover.
+        self.assertEqual(members['untagged'], 100.0)
+        self.assertEqual(members['truncated'], 100.0)
+        self.assertEqual(members['mutant'], round(100.0 * (len(sequences['full']) - 1) / len(sequences['full']), 2))
+
+    def test_centroid_longest(self):
+        # The clusters are formed from the longest sequence down, so the centroid is the longest, whatever the order of the sequences.
+        sequences = {'a' : baseSequence[5:], 'b' : baseSequence, 'c' : baseSequence[:-5]}
+        self.assertEqual(self.cluster(sequences), {'b' : [('a', 100.0), ('c', 100.0)]})
+
+    def test_thresholds(self):
+        # A sequence with too many substitutions, or too short to cover enough of the centroid, starts a cluster of its own.
+        mutant = baseSequence
+        for i in range(0, 100, 5):
+            mutant = point_mutant(mutant, i)
+        sequences = {'full' : baseSequence, 'mutant' : mutant, 'fragment' : baseSequence[:len(baseSequence) // 2]}
+        self.assertEqual(self.cluster(sequences), {})
+        self.assertEqual(self.cluster(sequences, 90.0), {'full' : [('mutant', round(100.0 * (len(baseSequence) - 20) / len(baseSequence), 2))]})
+
+    def test_member_identity(self):
+        centroid = baseSequence
+        self.assertEqual(sequenceclusters.member_identity(centroid[3:], centroid, -3, 0.9), 100.0)
+        self.assertEqual(sequenceclusters.member_identity(centroid[:len(centroid) // 2], centroid, 0, 0.9), 0.0)
+        mutant = point_mutant(centroid, 10)
+        self.assertEqual(sequenceclusters.member_identity(mutant, centroid, 0, 0.9), round(100.0 * (len(centroid) - 1) / len(centroid), 2))
+        # Off the diagonal, the sequence does not align.
+        self.assertLess(sequenceclusters.member_identity(mutant, centroid, 7, 0.9), 95.0)
+
+    def test_main_writes_clusters(self):
+        workDir = tempfile.mkdtemp()
+        try:
+            with open(workDir + '/ReprChains.fasta', 'w') as writeFasta:
+                writeFasta.write('>full\n' + baseSequence + '\n>truncated\n' + baseSequence[:-8] + '\n>unrelated\n' + baseSequence[::-1] + '\n')
+            clusters = sequenceclusters.main(workDir + '/ReprChains.fasta', workDir + '/Clusters.tsv')
+            self.assertEqual(clusters, {'full' : [('truncated', 100.0)]})
+            with open(workDir + '/Clusters.tsv', 'r') as readClusters:
+                self.assertEqual(readClusters.read(), 'Member\tCentroid\tIdentity\ntruncated\tfull\t100.0\n')
+        finally:
+            shutil.rmtree(workDir)
+
+class PropagationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workDir)
+
+    def merge(self, similarities, clusters, groupsToKeep):
+        write_similarities(self.workDir + '/Similarity.tsv', similarities)
+        processPSIoutput.merge([self.workDir + '/Similarity.tsv'], groupsToKeep, self.workDir + '/Merged.tsv', clusters=clusters)
+        return read_similarities(self.workDir + '/Merged.tsv')
+
+    def test_propagated_similarity(self):
+        # The similarity of a member to the hit of its centroid is the centroid's similarity less the member's distance (100 - similarity)
+        # to the centroid. The members of a cluster are given 100 less the sum of their distances to the centroid.
+        clusters = {'c1' : [('m1', 98.0), ('m2', 96.5)]}
+        merged = self.merge({('c1', 'h') : 60.0}, clusters, set(['c1', 'm1', 'm2', 'h']))
+        self.assertEqual(merged, {('c1', 'h') : 60.0, ('h', 'm1') : 58.0, ('h', 'm2') : 56.5, ('c1', 'm1') : 98.0, ('c1', 'm2') : 96.5,
+                                  ('m1', 'm2') : 94.5})
+
+    def test_both_centroids(self):
+        # A similarity between two centroids is propagated to every pair of their members, subtracting the distances of both members.
+        clusters = {'c1' : [('m1', 98.0)], 'c2' : [('m2', 97.0)]}
+        merged = self.merge({('c1', 'c2') : 40.0}, clusters, set(['c1', 'c2', 'm1', 'm2']))
+        self.assertEqual(merged[('c1', 'c2')], 40.0)
+        self.assertEqual(merged[('c2', 'm1')], 38.0)
+        self.assertEqual(merged[('c1', 'm2')], 37.0)
+        self.assertEqual(merged[('m1', 'm2')], 35.0)
+
+    def test_propagated_not_positive(self):
+        # Where the propagated similarity is not positive, the similarity is not propagated at all.
+        clusters = {'c1' : [('m1', 95.0)]}
+        merged = self.merge({('c1', 'h') : 4.0}, clusters, set(['c1', 'm1', 'h']))
+        self.assertEqual(merged, {('c1', 'h') : 4.0, ('c1', 'm1') : 95.0})
+
+    def test_hit_in_trimmed_region(self):
+        # The propagated similarity is not a lower bound. A member that lacks the His-tag of its centroid is contained in it (so is 100%
+        # identical to it), and is given the centroid's similarity to a grouping whose hit only aligns with the tag, despite sharing no
+        # aligned residues with that grouping.
+        tag = 'MGSSHHHHHHSSGLVPRGSH'
+        clusters = sequenceclusters.cluster_sequences(['tagged', 'untagged'], [tag + baseSequence, baseSequence], 90.0, 0.9, 10, 10, 5)
+        self.assertEqual(clusters, {'tagged' : [('untagged', 100.0)]})
+        self.assertNotIn(tag, baseSequence)
+        merged = self.merge({('tagHit', 'tagged') : 80.0}, clusters, set(['tagged', 'untagged', 'tagHit']))
+        self.assertEqual(merged[('tagHit', 'untagged')], 80.0)
+
+    def test_low_cluster_identity(self):
+        # Members clustered below 50% identity to their centroid have no positive similarity to each other, so the pair is
+        # not recorded (rather than recorded with a negative similarity that the binary similarity store cannot hold).
+        # The binary similarity store needs sequence grouping identifiers of 16 characters.
+        c1, m1, m2, m3 = [i.ljust(16, '0') for i in ['c1', 'm1', 'm2', 'm3']]
+        clusters = {c1 : [(m1, 45.0), (m2, 40.0), (m3, 60.0)]}
+        write_similarities(self.workDir + '/Similarity.tsv', {})
+        processPSIoutput.merge([self.workDir + '/Similarity.tsv'], set([c1, m1, m2, m3]), self.workDir + '/Merged.tsv',
+                               fileEdges=self.workDir + '/Similarity.bin', clusters=clusters)
+        merged = read_similarities(self.workDir + '/Merged.tsv')
+        self.assertEqual(merged, {(c1, m1) : 45.0, (c1, m2) : 40.0, (c1, m3) : 60.0, (m1, m3) : 5.0})
+
+    def test_members_not_kept(self):
+        # Members that are no longer present are not propagated to, and a member's own similarities are kept as they are.
+        clusters = {'c1' : [('m1', 98.0), ('gone', 99.0)]}
+        merged = self.merge({('c1', 'h') : 60.0, ('h', 'm1') : 70.0}, clusters, set(['c1', 'm1', 'h']))
+        self.assertEqual(merged, {('c1', 'h') : 60.0, ('h', 'm1') : 70.0, ('c1', 'm1') : 98.0})
+
+    def test_matches_unclustered_at_full_identity(self):
+        # When every member is identical to its centroid, the propagated similarities are the same as the centroid's.
+        randomGenerator = random.Random(0)
+        groups = ['g' + str(i) for i in range(20)]
+        similarities = dict((tuple(sorted(randomGenerator.sample(groups, 2))), round(randomGenerator.uniform(20.0, 100.0), 2)) for i in range(40))
+        clusters = {'g0' : [('m0', 100.0)]}
+        merged = self.merge(similarities, clusters, set(groups + ['m0']))
+        for (groupA, groupB), similarity in similarities.items():
+            if 'g0' in (groupA, groupB):
+                other = groupB if groupA == 'g0' else groupA
+                self.assertEqual(merged[tuple(sorted(['m0', other]))], merged[(groupA, groupB)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,332 @@
+'''
+Tests of the parse cache and the incremental similarity search of updatelocalPDB, using the stand-in BLAST+ executables in the fakeblast
+directory.
+'''
+
+import contextlib
+import io
+import os
+import pickle
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import unittest.mock
+
+testDir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(testDir))
+
+import benchmarks
+import chainstore
+import pdblibrary
+import updatelocalPDB
+
+# The sequences of the entries. The new entry's sequence extends that of 1AAA, so the stand-in PSI-BLAST (which measures identity over
+# the positions of the query) finds them 75% identical when the new sequence is the query, but 100% identical the other way around. The
+# incremental search therefore only gives the same similarity as a full search if it searches in both directions.
+baseSequence = 'MKTAYIAKQRQISFVKSHFSRQLEERLGLIEVQAPILSRVGDGTQDNLSGAEKAVQVKVK'
+entrySequences = {'1AAA' : baseSequence, '2BBB' : baseSequence[:30] + baseSequence[30:][::-1],
+                  '3CCC' : 'GSHMDELLKKAEEWAKKNGLSPEEAVRLALELAKRGNPEVKEALERLLRRLEEEGRYDEA'}
+newEntry = ('4DDD', baseSequence + 'GGSGGSGGSGGSGGSGGSGG')
+allFiles = sorted([i.lower() + '.cif.gz' for i in entrySequences])
+
+def read_similarities(fileSimilarity):
+    """Read a similarity file into a mapping from each pair of sequence groupings to their similarity."""
+
+    with open(fileSimilarity, 'r') as readSimilarity:
+        readSimilarity.readline()
+        return dict(((i[0], i[1]), float(i[2])) for i in (j.split('\t') for j in readSimilarity))
+
+class UpdateTestCase(unittest.TestCase):
+    """The set up shared by the tests that run updatelocalPDB on a directory of synthetic mmCIF files."""
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.mmCIFDir = self.workDir + '/mmCIF'
+        os.mkdir(self.mmCIFDir)
+        self.searchLog = self.workDir + '/SearchLog.txt'
+        os.environ['FAKEBLAST_LOG'] = self.searchLog
+        self.randomGenerator = random.Random(0)
+        for entryID in sorted(entrySequences):
+            self.add_entry(entryID, entrySequences[entryID])
+
+    def tearDown(self):
+        del os.environ['FAKEBLAST_LOG']
+        shutil.rmtree(self.workDir)
+
+    def entry_file(self, entryID):
+        return self.mmCIFDir + '/' + entryID[1:3].lower() + '/' + entryID.lower() + '.cif.gz'
+
+    def add_entry(self, entryID, sequence):
+        entryDir = self.mmCIFDir + '/' + entryID[1:3].lower()
+        if not os.path.exists(entryDir):
+            os.mkdir(entryDir)
+        benchmarks.generate_mmCIF(self.entry_file(entryID), self.randomGenerator, entryID, [sequence], 2)
+
+    def run_update(self, parsedPDB, **keywords):
+        """Run updatelocalPDB, and determine the sequence groupings searched by the run and the groupings each was searched against."""
+
+        if os.path.exists(self.searchLog):
+            os.remove(self.searchLog)
+        updatelocalPDB.main(self.mmCIFDir, parsedPDB, testDir + '/fakeblast', **keywords)
+        if not os.path.exists(self.searchLog):
+            return {}
+        with open(self.searchLog, 'r') as readLog:
+            return dict((i[0], set(i[1].split(','))) for i in (j.split() for j in readLog))
+
+class IncrementalSearchTests(UpdateTestCase):
+
+    def test_only_new_groups_searched(self):
+        parsedPDB = self.workDir + '/Parsed'
+        oldGroups = set([chainstore.sequence_group(i) for i in entrySequences.values()])
+        self.assertEqual(self.run_update(parsedPDB), dict((i, oldGroups) for i in oldGroups))
+        firstSimilarities = read_similarities(parsedPDB + '/Similarity.tsv')
+
+        # On the second run, the new sequence grouping is searched against all the groupings, and the old groupings only against the new one.
+        self.add_entry(*newEntry)
+        newGroup = chainstore.sequence_group(newEntry[1])
+        expectedSearches = dict((i, set([newGroup])) for i in oldGroups)
+        expectedSearches[newGroup] = oldGroups | set([newGroup])
+        self.assertEqual(self.run_update(parsedPDB), expectedSearches)
+
+        # The similarities from the first run are kept, and the hits in both directions are merged in, keeping the greater similarity (the
+        # pairs are ordered by grouping, as they are written by processPSIoutput).
+        secondSimilarities = read_similarities(parsedPDB + '/Similarity.tsv')
+        for i in firstSimilarities:
+            self.assertEqual(secondSimilarities[i], firstSimilarities[i])
+        newPair = tuple(sorted([chainstore.sequence_group(baseSequence), newGroup]))
+        self.assertEqual(secondSimilarities[newPair], 100.0)
+
+        # With the stand-in PSI-BLAST (whose identities do not depend on the database searched), the incremental run finds the same
+        # similarities as a full run over all the entries. This is not a property of the real PSI-BLAST, whose iteration profiles are built
+        # from the hits in the database searched, so an incremental run of it only approximates a full run.
+        fullParsedPDB = self.workDir + '/Full'
+        self.run_update(fullParsedPDB)
+        self.assertEqual(secondSimilarities, read_similarities(fullParsedPDB + '/Similarity.tsv'))
+        with open(parsedPDB + '/Similarity.tsv', 'rb') as readIncremental, open(fullParsedPDB + '/Similarity.tsv', 'rb') as readFull:
+            self.assertEqual(readIncremental.read(), readFull.read())
+
+    def test_searches_given_full_database_size(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.run_update(parsedPDB)
+        self.add_entry(*newEntry)
+        self.run_update(parsedPDB)
+
+        # The reverse search is against only the new grouping, but its E-values are calculated for a database of every grouping.
+        fullSize = updatelocalPDB.database_size(parsedPDB + '/ReprChains.fasta')
+        with open(self.searchLog, 'r') as readLog:
+            databaseSizes = set(i.split()[2] for i in readLog)
+        self.assertEqual(databaseSizes, set([str(fullSize)]))
+
+    def test_low_cluster_identity_rejected(self):
+        with self.assertRaises(ValueError):
+            updatelocalPDB.main(self.mmCIFDir, self.workDir + '/Parsed', testDir + '/fakeblast', clusterIdentity=40.0)
+        self.assertFalse(os.path.exists(self.workDir + '/Parsed'))
+
+    def test_unchanged_rerun_searches_nothing(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.run_update(parsedPDB)
+        firstSimilarities = read_similarities(parsedPDB + '/Similarity.tsv')
+        self.assertEqual(self.run_update(parsedPDB), {})
+        self.assertEqual(read_similarities(parsedPDB + '/Similarity.tsv'), firstSimilarities)
+
+class ShardedSearchTests(unittest.TestCase):
+
+    def setUp(self):
+        self.workDir = tempfile.mkdtemp()
+        self.searchLog = self.workDir + '/SearchLog.txt'
+        os.environ['FAKEBLAST_LOG'] = self.searchLog
+        self.queries = ['Q%015d' % i for i in range(6)]
+        self.write_fasta(self.workDir + '/Query.fasta', self.queries)
+        self.write_fasta(self.workDir + '/Database.fasta', self.queries)
+
+    def tearDown(self):
+        del os.environ['FAKEBLAST_LOG']
+        os.environ.pop('FAKEBLAST_FAIL', None)
+        shutil.rmtree(self.workDir)
+
+    def write_fasta(self, fileFasta, names):
+        with open(fileFasta, 'w') as writeFasta:
+            writeFasta.write(''.join('>' + name + '\n' + baseSequence[index:] + '\n' for index, name in enumerate(names)))
+
+    def search(self, arguments=updatelocalPDB.psiblastArguments):
+        """BLAST the queries in shards of two, and determine the queries that were searched."""
+
+        if os.path.exists(self.searchLog):
+            os.remove(self.searchLog)
+        shutil.copy(self.workDir + '/Database.fasta', self.workDir + '/TempDB.fasta')
+        results = updatelocalPDB.sharded_BLAST(self.workDir + '/Query.fasta', self.workDir + '/Shards', self.workDir + '/TempDB',
+                                               testDir + '/fakeblast/psiblast', 1, 2, 2, self.workDir + '/Database.fasta', arguments)
+        self.assertEqual(len(results), 3)
+        self.assertTrue(all(os.path.exists(i) for i in results))
+        if not os.path.exists(self.searchLog):
+            return []
+        with open(self.searchLog, 'r') as readLog:
+            return sorted(i.split()[0] for i in readLog)
+
+    def test_failed_shard_resumed(self):
+        # The search of the second shard fails, so its results are not kept, but those of the other shards are.
+        os.environ['FAKEBLAST_FAIL'] = self.queries[3]
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.search()
+        with open(self.searchLog, 'r') as readLog:
+            self.assertEqual(sorted(i.split()[0] for i in readLog), self.queries[:2] + self.queries[4:])
+        del os.environ['FAKEBLAST_FAIL']
+
+        # Rerunning only searches the shard that failed, and a further rerun searches nothing.
+        self.assertEqual(self.search(), self.queries[2:4])
+        self.assertEqual(self.search(), [])
+
+    def test_changes_invalidate_shards(self):
+        self.assertEqual(self.search(), self.queries)
+
+        # Changing the PSI-BLAST arguments searches every shard again, and the results of the old search are removed.
+        oldShards = set(os.listdir(self.workDir + '/Shards'))
+        changedArguments = list(updatelocalPDB.psiblastArguments)
+        changedArguments[changedArguments.index('-evalue') + 1] = '0.1'
+        self.assertEqual(self.search(changedArguments), self.queries)
+        self.assertEqual(set(os.listdir(self.workDir + '/Shards')) & oldShards, set([]))
+
+        # So does changing the database.
+        self.write_fasta(self.workDir + '/Database.fasta', self.queries + ['Q%015d' % 6])
+        self.assertEqual(self.search(changedArguments), self.queries)
+        self.assertEqual(self.search(changedArguments), [])
+
+class ParallelParsingTests(UpdateTestCase):
+
+    def read_outputs(self, parsedPDB):
+        outputs = {}
+        for i in ['AllChains.fasta', 'Chains.tsv', 'ChainStore.bin']:
+            with open(parsedPDB + '/' + i, 'rb') as readOutput:
+                outputs[i] = readOutput.read()
+        return outputs
+
+    def test_same_output_as_one_process(self):
+        for i in range(8):
+            self.add_entry('%dE%02d' % (5 + i % 4, i), baseSequence[i:] + entrySequences['3CCC'][:i])
+        self.run_update(self.workDir + '/Single')
+        self.run_update(self.workDir + '/Parallel', workers=3, chunkSize=2)
+        self.assertEqual(self.read_outputs(self.workDir + '/Parallel'), self.read_outputs(self.workDir + '/Single'))
+
+    def test_bad_files_skipped(self):
+        # A file that is not gzipped, and one whose compressed data is cut short, are reported and skipped, and the other files are parsed.
+        self.add_entry('5EEE', newEntry[1])
+        with open(self.entry_file('5EEE'), 'rb') as readEntry:
+            entryContent = readEntry.read()
+        with open(self.entry_file('5EEE'), 'wb') as writeEntry:
+            writeEntry.write(entryContent[:len(entryContent) // 2])
+        self.add_entry('6FFF', newEntry[1])
+        with open(self.entry_file('6FFF'), 'wb') as writeEntry:
+            writeEntry.write(b'data_6FFF\n_entry.id 6FFF\n')
+
+        for workers in [1, 2]:
+            parsedPDB = self.workDir + '/Parsed' + str(workers)
+            with contextlib.redirect_stderr(io.StringIO()) as errors:
+                self.run_update(parsedPDB, workers=workers)
+            reported = sorted(os.path.basename(i.split(':')[0]) for i in errors.getvalue().splitlines() if i.startswith('Skipping '))
+            self.assertEqual(reported, ['5eee.cif.gz', '6fff.cif.gz'])
+            with open(parsedPDB + '/AllChains.fasta', 'r') as readAllFasta:
+                chains = readAllFasta.read()
+            self.assertEqual(sorted(i[1:5] for i in chains.split('\n')[0::2] if i), sorted(entrySequences))
+
+class KmerBackendTests(UpdateTestCase):
+
+    def test_same_format_as_psiblast(self):
+        # The k-mer backend writes Similarity.tsv in the same format as the PSI-BLAST backend, so a pair that both find at 100% identity has
+        # the same line in both files.
+        self.add_entry(*newEntry)
+        self.run_update(self.workDir + '/PSIBLAST')
+        self.run_update(self.workDir + '/Kmer', similarityBackend='kmer')
+        with open(self.workDir + '/PSIBLAST/Similarity.tsv', 'r') as readPSIBLAST, open(self.workDir + '/Kmer/Similarity.tsv', 'r') as readKmer:
+            psiblastLines = readPSIBLAST.readlines()
+            kmerLines = readKmer.readlines()
+        self.assertEqual(kmerLines[0], psiblastLines[0])
+        newPair = tuple(sorted([chainstore.sequence_group(baseSequence), chainstore.sequence_group(newEntry[1])]))
+        self.assertEqual([i for i in kmerLines[1:] if tuple(i.split('\t')[:2]) == newPair],
+                         [i for i in psiblastLines[1:] if tuple(i.split('\t')[:2]) == newPair])
+        for line in kmerLines[1:]:
+            groupA, groupB, similarity = line.rstrip('\n').split('\t')
+            self.assertLess(groupA, groupB)
+            self.assertGreaterEqual(float(similarity), 70.0)
+        self.assertEqual(read_similarities(self.workDir + '/Kmer/Similarity.tsv')[newPair], 100.0)
+
+        # The binary similarity store that the culling loads is written from either backend.
+        self.assertTrue(os.path.exists(self.workDir + '/Kmer/Similarity.bin'))
+
+class ParseCacheTests(UpdateTestCase):
+
+    def parse_update(self, parsedPDB):
+        """Run updatelocalPDB, and determine the mmCIF files that it parsed (rather than took from the parse cache)."""
+
+        filesParsed = []
+        def record_parse(fileToParse):
+            filesParsed.append(os.path.basename(fileToParse[0]))
+            return parseFile(fileToParse)
+        parseFile = pdblibrary.parse_mmCIF_file
+        with unittest.mock.patch.object(pdblibrary, 'parse_mmCIF_file', record_parse):
+            self.run_update(parsedPDB)
+        return sorted(filesParsed)
+
+    def cached_files(self, parsedPDB):
+        with open(parsedPDB + '/ParseCache.pkl', 'rb') as readCache:
+            return sorted(os.path.basename(i) for i in pickle.load(readCache)[1])
+
+    def test_unchanged_rerun_parses_nothing(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.assertEqual(self.parse_update(parsedPDB), allFiles)
+        with open(parsedPDB + '/AllChains.fasta', 'rb') as readAllFasta:
+            firstChains = readAllFasta.read()
+        self.assertEqual(self.parse_update(parsedPDB), [])
+        with open(parsedPDB + '/AllChains.fasta', 'rb') as readAllFasta:
+            self.assertEqual(readAllFasta.read(), firstChains)
+
+    def test_changed_files_reparsed(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.parse_update(parsedPDB)
+
+        # A file whose modification time has changed is parsed again, even though its contents have not.
+        stats = os.stat(self.entry_file('1AAA'))
+        os.utime(self.entry_file('1AAA'), ns=(stats.st_atime_ns, stats.st_mtime_ns + 10 ** 9))
+        self.assertEqual(self.parse_update(parsedPDB), ['1aaa.cif.gz'])
+
+        # So is a file whose size has changed (with its modification time restored).
+        stats = os.stat(self.entry_file('3CCC'))
+        self.add_entry('3CCC', baseSequence)
+        os.utime(self.entry_file('3CCC'), ns=(stats.st_atime_ns, stats.st_mtime_ns))
+        self.assertNotEqual(os.stat(self.entry_file('3CCC')).st_size, stats.st_size)
+        self.assertEqual(self.parse_update(parsedPDB), ['3ccc.cif.gz'])
+        with open(parsedPDB + '/AllChains.fasta', 'r') as readAllFasta:
+            self.assertNotIn(entrySequences['3CCC'], readAllFasta.read())
+
+    def test_parser_version_change_discards_cache(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.parse_update(parsedPDB)
+        with unittest.mock.patch.object(updatelocalPDB, 'parser_version', lambda : 'changed'):
+            self.assertEqual(self.parse_update(parsedPDB), allFiles)
+        self.assertEqual(self.parse_update(parsedPDB), allFiles)
+
+    def test_unreadable_cache_ignored(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.parse_update(parsedPDB)
+        for corruptCache in [lambda x : x[:len(x) // 2], lambda x : b'not a pickle']:
+            with open(parsedPDB + '/ParseCache.pkl', 'rb') as readCache:
+                cacheContent = readCache.read()
+            with open(parsedPDB + '/ParseCache.pkl', 'wb') as writeCache:
+                writeCache.write(corruptCache(cacheContent))
+            with contextlib.redirect_stderr(io.StringIO()) as errors:
+                self.assertEqual(self.parse_update(parsedPDB), allFiles)
+            self.assertIn('Ignoring unreadable parse cache', errors.getvalue())
+            self.assertEqual(self.cached_files(parsedPDB), allFiles)
+
+    def test_deleted_files_dropped(self):
+        parsedPDB = self.workDir + '/Parsed'
+        self.parse_update(parsedPDB)
+        self.assertEqual(self.cached_files(parsedPDB), allFiles)
+        os.remove(self.entry_file('2BBB'))
+        self.assertEqual(self.parse_update(parsedPDB), [])
+        self.assertEqual(self.cached_files(parsedPDB), ['1aaa.cif.gz', '3ccc.cif.gz'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,11 +1,32 @@
+import concurrent.futures
+import hashlib
+import multiprocessing
 import os
+import pickle
 import shutil
 import subprocess
+import sys
+import time
 
+import chainstore
+import kmersimilarity
+import mmCIFparser
 import parsePDBmmCIF
+import pdblibrary
 import processPSIoutput
+import profiling
+import sequenceclusters
 
-def main(mmCIFDir, parsedPDB, blastExecutables):
+# The version of the format of the parse cache. Changing this (or the code of the mmCIF parsing modules) invalidates any existing cache.
+parseCacheFormat = 1
+
+# The arguments that every PSI-BLAST search is run with (in addition to the query, output, database and number of threads).
+psiblastArguments = ['-evalue', '1', '-num_iterations', '3', '-gap_trigger', '18', '-num_descriptions', '10000', '-num_alignments', '10000',
+                     '-dbsize', '0', '-outfmt', '7 qseqid sseqid pident length evalue']
+
+def main(mmCIFDir, parsedPDB, blastExecutables, workers=1, chunkSize=64, useParseCache=True, blastJobs=1, blastThreads=2, blastShardSize=500,
+         similarityMemory=2 ** 30, similarityBackend='psiblast', kmerMinIdentity=70.0,
+         clusterIdentity=None, mmCIFCacheDir=None):
     """Process the entire PDB in order to extract the relevant information about the proteins in it.
 
     :param mmCIFDir:            The directory containing the mmCIF files for the PDB.
@@ -14,9 +35,44 @@ def main(mmCIFDir, parsedPDB, blastExecutables):
     :type parsedPDB:            string
     :param blastExecutables:    The location of the BLAST+ executables.
     :type blastExecutables:     string
+    :param workers:             The number of processes to use when parsing the mmCIF files.
+    :type workers:              int
+    :param chunkSize:           The number of mmCIF files to send to a parsing process at a time.
+    :type chunkSize:            int
+    :param useParseCache:       Whether to only parse the mmCIF files that are new or have changed since the last run.
+    :type useParseCache:        boolean
+    :param blastJobs:           The number of PSI-BLAST processes to run at once.
+    :type blastJobs:            int
+    :param blastThreads:        The number of threads each PSI-BLAST process uses.
+    :type blastThreads:         int
+    :param blastShardSize:      The number of sequences to BLAST in each PSI-BLAST process.
+    :type blastShardSize:       int
+    :param similarityMemory:    The approximate number of bytes of memory to use for holding similarities before spilling them to disk.
+    :type similarityMemory:     int
+    :param similarityBackend:   The method used to find the similarities between sequence groupings, one of the keys of similarityBackends.
+                                The 'kmer' backend only finds similarities at or above kmerMinIdentity, so subsets culled at lower sequence
+                                identities will contain redundant chains.
+    :type similarityBackend:    string
+    :param kmerMinIdentity:     The minimum sequence identity of the similarities found by the 'kmer' backend.
+    :type kmerMinIdentity:      float
+    :param clusterIdentity:     If not None, the near-duplicate sequence groupings are clustered at this sequence identity (see
+                                sequenceclusters), only the centroid of each cluster is searched, and the similarities of the centroids are
+                                propagated to the other members of their clusters. The propagated similarities approximate the true ones
+                                (see processPSIoutput.propagate_similarity), so the culled subsets can keep some redundant chains and remove
+                                some non-redundant ones. Must be at least 50.
+    :type clusterIdentity:      float
+    :param mmCIFCacheDir:       If not None, the directory to keep uncompressed copies of the mmCIF files in, so that they do not need to be
+                                decompressed again when they are next parsed (e.g. when the parsing code changes).
+    :type mmCIFCacheDir:        string
 
     """
 
+    if not similarityBackend in similarityBackends:
+        raise ValueError('Unknown similarity backend ' + similarityBackend + '.')
+    if clusterIdentity is not None and clusterIdentity < 50.0:
+        # The similarity given to two members of a cluster is only positive if they are over 50% identical to their centroid.
+        raise ValueError('The cluster identity must be at least 50, not ' + str(clusterIdentity) + '.')
+
     # Define output files in the TSV format expected by the App Engine bulk uploader (TSV with header).
     if not os.path.exists(parsedPDB):
         os.mkdir(parsedPDB)
@@ -24,118 +80,372 @@ def main(mmCIFDir, parsedPDB, blastExecutables):
     fileSimilarity = parsedPDB + '/Similarity.tsv'
     fileAllFasta = parsedPDB + '/AllChains.fasta'
     fileReprFasta = parsedPDB + '/ReprChains.fasta'
+    fileChainStore = parsedPDB + '/ChainStore.bin'
+    fileParseCache = parsedPDB + '/ParseCache.pkl'
+    fileSearchedGroups = parsedPDB + '/SearchedGroups.txt'
+    fileNewReprFasta = parsedPDB + '/NewReprChains.fasta'
+    fileClusters = parsedPDB + '/Clusters.tsv'
+    fileCentroidFasta = parsedPDB + '/CentroidChains.fasta'
+    fileNewSimilarity = parsedPDB + '/NewSimilarity.tsv'
+    fileSearchedReprFasta = parsedPDB + '/SearchedReprChains.fasta'
+    fileReverseSimilarity = parsedPDB + '/ReverseSimilarity.tsv'
+    fileEdges = parsedPDB + '/Similarity.bin'
 
     ##################################################################
     # Go through the mmCIF files and extract the desired information #
     ##################################################################
-    writeAllFasta = open(fileAllFasta, 'w')
-    uniqueSequences = set([])
-    mmCIFDirs = os.listdir(mmCIFDir)
-    for i in mmCIFDirs:
-        mmCIFFolder = mmCIFDir + '/' + i
-        mmCIFFiles = os.listdir(mmCIFFolder)  # Get the files from each subfolder.
-
-        # Process each mmCIF file.
-        for j in mmCIFFiles:
-            currentFile = mmCIFFolder + '/' + j
-            entryID, entityRecords, experimentalType, resolution, rFactorObs, rFactorFree = parsePDBmmCIF.main(currentFile)  # Parse the file.
-
-            # For each record in the entry, examine the data about it. Each entry can have one or more record depending on the different chains
-            # recorded in the entry.
-            for j in entityRecords.keys():
-                if 'type' in entityRecords[j]:
-                    # If the record contains type information than examine it further. Only those records with type information are of interest.
-                    chains = [entry + chain for entry in entryID for chain in entityRecords[j]['chains']]  # The chains in the record.
-                    type = entityRecords[j]['type'].strip()  # The type of the record.
-
-                    if type == 'Protein':
-                        # Only interested in the record if it's a protein.
-                        dbCode = entityRecords[j]['dbCode'].strip() if 'dbCode' in entityRecords[j] else ''  # External database identifier.
-                        if dbCode in ['?', '.']:
-                            dbCode = ''
-                        dbName = entityRecords[j]['dbName'].strip() if 'dbName' in entityRecords[j] else ''  # External database name.
-                        if dbName in ['?', '.']:
-                            dbName = ''
-                        description = entityRecords[j]['description'].strip() if 'description' in entityRecords[j] else ''  # Record description.
-                        if description in ['?', '.']:
-                            description = ''
-                        onlyAlphaCarbon = entityRecords[j]['onlyAlphaCarbon']  # Whether the structure for the record contains only alpha carbons.
-                        scientificName = entityRecords[j]['scientificName'].strip() if 'scientificName' in entityRecords[j] else ''  # Scientific name of the organism the chain belongs to.
-                        if scientificName in ['?', '.']:
-                            scientificName = ''
-                        sequence = entityRecords[j]['sequence'].upper()  # Sequence of the chain.
-                        if sequence.count('X') / float(len(sequence)) < 0.5:
-                            # If at least 50% of the amino acids in the chain are X, then the 'protein' is deemed to not be a protein.
-                            uniqueSequences.add(sequence)
-                            for k in chains:
-                                # Record the data about each chain.
-                                writeAllFasta.write('>' + k + '\t' + str(len(sequence)) + '\t' + experimentalType + '\t' + str(resolution) + '\t' +
-                                                    str(rFactorObs) + '\t' + str(rFactorFree) + '\t' + ('no' if onlyAlphaCarbon == 0 else 'yes') + '\t' +
-                                                    description + '\t<' + dbName + ' ' + dbCode + '>\t[' + scientificName + ']\n' + sequence + '\n')
-
-    writeAllFasta.close()
+    # Determine the mmCIF files in each subfolder. These are sorted so that the output is the same no matter how the parsing is performed.
+    parseStage = profiling.begin_stage('parse')
+    mmCIFFiles = [mmCIFDir + '/' + i + '/' + j for i in sorted(os.listdir(mmCIFDir)) for j in sorted(os.listdir(mmCIFDir + '/' + i))]
+
+    # Determine the mmCIF files that have been added or changed since the parse cache was created. The cached results are used for all other files.
+    fileStats = {}
+    for i in mmCIFFiles:
+        stats = os.stat(i)
+        fileStats[i] = (stats.st_size, stats.st_mtime_ns)
+    cachedFiles = load_parse_cache(fileParseCache) if useParseCache else {}
+    filesToParse = [i for i in mmCIFFiles if i not in cachedFiles or cachedFiles[i][0] != fileStats[i]]
+
+    # Parse the mmCIF files. The results are returned in the same order as the files, regardless of the number of processes used.
+    if mmCIFCacheDir is not None and not os.path.exists(mmCIFCacheDir):
+        os.mkdir(mmCIFCacheDir)
+    if workers > 1:
+        pool = multiprocessing.Pool(workers)
+        parsedFiles = pool.imap(pdblibrary.parse_mmCIF_file, [(i, mmCIFCacheDir) for i in filesToParse], chunkSize)
+    else:
+        pool = None
+        parsedFiles = map(pdblibrary.parse_mmCIF_file, [(i, mmCIFCacheDir) for i in filesToParse])
+
+    chainWriter = chainstore.open_writer(fileChainStore)
+    updatedCache = {}  # Only the files that are still present are recorded, so entries for obsolete files are dropped from the cache.
+    filesToParse = set(filesToParse)
+    for currentFile in mmCIFFiles:
+        if currentFile in filesToParse:
+            currentFile, parsedFile, errorMessage, parseTime = next(parsedFiles)
+            profiling.record_largest('slowest mmCIF files', currentFile, parseTime)
+            if parsedFile is None:
+                # The file could not be parsed, so report it and move on to the next one.
+                sys.stderr.write('Skipping ' + currentFile + ': ' + errorMessage + '\n')
+                continue
+        else:
+            parsedFile = cachedFiles[currentFile][1]
+        updatedCache[currentFile] = (fileStats[currentFile], parsedFile)
+        for record in pdblibrary.chain_records(parsedFile):
+            chainstore.add_chain(chainWriter, pdblibrary.identifier_line(record), record.sequence,
+                                 (record.atoms, record.alphaCarbons, record.residues))
+
+    chainstore.close_writer(chainWriter)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    if useParseCache:
+        save_parse_cache(fileParseCache, updatedCache)
+    profiling.end_stage(parseStage, len(mmCIFFiles))
 
     ####################################
     # Determine sequences for BLASTing #
     ####################################
-    uniqueSequences = dict((i, index) for index, i in enumerate(uniqueSequences))
-    sequencesUsed = set([])
-    writeChains = open(fileChains, 'w')
-    writeChains.write('\t'.join(['Chain', 'Res', 'RVal', 'SeqLen', 'NonXRay', 'AlphaCarbonOnly', 'ReprGroup']) + '\n')  # Write the header for the chains file.
-    writeReprFasta = open(fileReprFasta, 'w')
-    readAllFasta = open(fileAllFasta, 'r')
-    while True:
-        # Read the file two lines at a time.
-        identifierLine = readAllFasta.readline().strip()[1:]  # Strip off any whitespace and the > at the front.
-        sequence = readAllFasta.readline().strip()
-        if not sequence:
-            # Reached the end of the file when there is no second line.
-            break
+    # Write out the chain information in the text formats used by the later stages and the App Engine bulk uploader.
+    exportStage = profiling.begin_stage('export')
+    chainStore = chainstore.load(fileChainStore)
+    chainstore.export_fasta(chainStore, fileAllFasta)
+    chainstore.export_chains(chainStore, fileChains)
+    sequencesUsed = chainstore.export_representatives(chainStore, fileReprFasta)
+    profiling.end_stage(exportStage, chainStore['numberOfChains'])
+
+    # Determine the sequence groupings that were searched on a previous run. The similarities found for these are reused from the existing
+    # similarity file, and only the sequence groupings that have not been seen before are searched. If the previous run used a different
+    # similarity backend (files without a backend line were written by the PSI-BLAST backend), then every sequence grouping is searched again.
+    backendLine = '# ' + similarityBackend + (' ' + str(kmerMinIdentity) if similarityBackend == 'kmer' else '') + '\n'
+    searchedGroups = set([])
+    if os.path.exists(fileSearchedGroups) and os.path.exists(fileSimilarity):
+        with open(fileSearchedGroups, 'r') as readSearchedGroups:
+            searchedContent = readSearchedGroups.read()
+        if not searchedContent.startswith('#'):
+            searchedContent = '# psiblast\n' + searchedContent
+        if searchedContent.startswith(backendLine):
+            searchedGroups = set(searchedContent[len(backendLine):].split())
+
+    # Cluster the near-duplicate sequence groupings, so that only the centroid of each cluster needs to be searched (and searched against).
+    clusters = {}
+    clusterMembers = set([])
+    searchedFasta = fileReprFasta
+    if clusterIdentity is not None:
+        clusterStage = profiling.begin_stage('cluster')
+        clusters = sequenceclusters.main(fileReprFasta, fileClusters, clusterIdentity)
+        clusterMembers = set([j[0] for i in clusters.values() for j in i])
+        chainstore.export_representatives(chainStore, fileCentroidFasta, clusterMembers)
+        searchedFasta = fileCentroidFasta
+        profiling.end_stage(clusterStage, len(sequencesUsed))
+    newGroupsFound = len(chainstore.export_representatives(chainStore, fileNewReprFasta, searchedGroups | clusterMembers)) > 0
+
+    #########################
+    # Find the similarities #
+    #########################
+    # Search the new sequence groupings against all the sequence groupings. The similarity of a pair depends on which of the pair is the
+    # query, so the previously searched groupings are also searched against only the new ones. Together with the similarities from the
+    # previous runs, this searches every pair in both directions, and the greater similarity is kept when they are merged.
+    # This only approximates a full run. PSI-BLAST builds the profile for each iteration from the hits in the database it searches, so a
+    # search against only the new groupings (or against the smaller database of a previous run) can find different hits and identities to
+    # a search against every grouping. To keep the E-values comparable, every search is given the size of the full database.
+    similarityFiles = [fileSimilarity] if searchedGroups else []
+    if newGroupsFound:
+        searchStage = profiling.begin_stage('search')
+        backendSettings = {'parsedPDB' : parsedPDB, 'blastExecutables' : blastExecutables, 'blastJobs' : blastJobs, 'blastThreads' : blastThreads,
+                           'blastShardSize' : blastShardSize, 'similarityMemory' : similarityMemory, 'workers' : workers,
+                           'kmerMinIdentity' : kmerMinIdentity, 'searchName' : '', 'databaseSize' : database_size(searchedFasta)}
+        similarityBackends[similarityBackend](fileNewReprFasta, searchedFasta, fileNewSimilarity, backendSettings)
+        similarityFiles.append(fileNewSimilarity)
+        previouslySearched = chainstore.export_representatives(chainStore, fileSearchedReprFasta,
+                                                               sequencesUsed - ((searchedGroups & sequencesUsed) - clusterMembers))
+        if previouslySearched:
+            backendSettings['searchName'] = 'Reverse'
+            similarityBackends[similarityBackend](fileSearchedReprFasta, fileNewReprFasta, fileReverseSimilarity, backendSettings)
+            similarityFiles.append(fileReverseSimilarity)
+        profiling.end_stage(searchStage, len(sequencesUsed - searchedGroups - clusterMembers))
+
+    # Combine the new similarities with those from previous runs, dropping any sequence groupings that are no longer in the PDB. The binary
+    # similarity store indexes the sequence groupings in the same order as the chain store. The members of clusters were not searched, so
+    # they are only recorded as searched if they were searched on a previous run.
+    mergeStage = profiling.begin_stage('merge')
+    processPSIoutput.merge(similarityFiles, sequencesUsed, fileSimilarity, similarityMemory, fileEdges,
+                           [chainstore.group_id(chainStore, i) for i in range(chainStore['numberOfSequences'])], clusters)
+    searchedGroups = (sequencesUsed - clusterMembers) | (searchedGroups & sequencesUsed)
+    with open(fileSearchedGroups, 'w') as writeSearchedGroups:
+        writeSearchedGroups.write(backendLine + ''.join(i + '\n' for i in sorted(searchedGroups)))
+    profiling.end_stage(mergeStage, len(sequencesUsed))
+
+
+def parser_version():
+    """Determine the version of the mmCIF parsing code.
+
+    The version is a hash of the cache format and the source of the parsing modules, so that any change to the parsing invalidates the cache.
+
+    :returns :  The version of the parsing code.
+    :type :     string
+
+    """
+
+    version = hashlib.sha1(str(parseCacheFormat).encode('utf-8'))
+    for i in [mmCIFparser, parsePDBmmCIF]:
+        with open(i.__file__, 'rb') as readSource:
+            version.update(readSource.read())
+    return version.hexdigest()
+
+def load_parse_cache(cacheFile):
+    """Load the results of parsing the mmCIF files on a previous run.
+
+    :param cacheFile:   The location of the parse cache.
+    :type cacheFile:    string
+    :returns :          A mapping from each cached mmCIF file to its (size, modification time) and the tuple returned by parsePDBmmCIF.main.
+                        The mapping is empty if there is no cache, or if the cache was created by a different version of the parsing code.
+    :type :             dictionary
+
+    """
+
+    if not os.path.exists(cacheFile):
+        return {}
+    try:
+        with open(cacheFile, 'rb') as readCache:
+            version, cachedFiles = pickle.load(readCache)
+    except Exception as e:
+        sys.stderr.write('Ignoring unreadable parse cache ' + cacheFile + ': ' + repr(e) + '\n')
+        return {}
+    return cachedFiles if version == parser_version() else {}
+
+def save_parse_cache(cacheFile, cachedFiles):
+    """Save the results of parsing the mmCIF files for use on the next run.
+
+    The cache is written to a temporary file first, so that an interrupted write does not leave a corrupt cache behind.
+
+    :param cacheFile:   The location of the parse cache.
+    :type cacheFile:    string
+    :param cachedFiles: A mapping from each mmCIF file to its (size, modification time) and the tuple returned by parsePDBmmCIF.main.
+    :type cachedFiles:  dictionary
+
+    """
+
+    with open(cacheFile + '.tmp', 'wb') as writeCache:
+        pickle.dump((parser_version(), cachedFiles), writeCache, pickle.HIGHEST_PROTOCOL)
+    os.replace(cacheFile + '.tmp', cacheFile)
+
+def database_size(fileFasta):
+    """Determine the number of residues in a FASTA file (the size of a BLAST database made from it).
+
+    :param fileFasta:   The FASTA file, with each sequence on a single line.
+    :type fileFasta:    string
+    :returns :          The total length of the sequences in the file.
+    :type :             int
+
+    """
+
+    residues = 0
+    with open(fileFasta, 'r') as readFasta:
+        for line in readFasta:
+            if not line.startswith('>'):
+                residues += len(line.strip())
+    return residues
+
+def psiblast_similarities(fileQueryFasta, fileReprFasta, outputLocation, backendSettings):
+    """Find the similarities between sequence groupings by PSI-BLASTing the query sequences against all the representative sequences.
+
+    If the databaseSize setting is given, then it is used as the effective size of the database when calculating E-values (rather than the
+    size of the database made from fileReprFasta).
+
+    :param fileQueryFasta:  The FASTA file of the sequence groupings to search for the similar groupings of.
+    :type fileQueryFasta:   string
+    :param fileReprFasta:   The FASTA file of the sequence groupings to search against.
+    :type fileReprFasta:    string
+    :param outputLocation:  The location where the similarity information will be written.
+    :type outputLocation:   string
+    :param backendSettings: The settings of the similarity search (see main).
+    :type backendSettings:  dictionary
+
+    """
 
-        # Write the chain information into the App Engine TSV file.
-        sequenceGrouping = uniqueSequences[sequence]
-        chunks = identifierLine.split('\t')
-        chain = chunks[0]
-        resolution = chunks[3]
-        rVal = chunks[4]
-        nonXRay = 'no' if chunks[2] == 'XRAY' else 'yes'
-        alphaCarbonOnly = chunks[6]
-        writeChains.write(chain + '\t' + resolution + '\t' + rVal + '\t' + str(len(sequence)) + '\t' + nonXRay + '\t' + alphaCarbonOnly + '\t' +
-                          str(sequenceGrouping) + '\n')
-
-        # Record the representative fasta file for BLASTing.
-        if not sequenceGrouping in sequencesUsed:
-            # Only record the chain if no other chain from its sequence grouping has been recorded.
-            writeReprFasta.write('>' + str(sequenceGrouping) + '\n' + sequence + '\n')
-
-        # Update the record of the sequence groupings that have been recorded in the BLASTing file.
-        sequencesUsed.add(sequenceGrouping)
-    readAllFasta.close()
-    writeReprFasta.close()
-    writeChains.close()
-
-    ################
-    # Run BLASTing #
-    ################
     # Generate BLAST database.
-    databaseDir = parsedPDB + '/BLASTdatabase'
+    databaseStage = profiling.begin_stage('makeblastdb')
+    parsedPDB = backendSettings['parsedPDB']
+    blastExecutables = backendSettings['blastExecutables']
+    databaseDir = parsedPDB + '/BLASTdatabase' + backendSettings['searchName']
     if os.path.exists(databaseDir):
         shutil.rmtree(databaseDir)
     os.mkdir(databaseDir)
     makeDBArgs = [blastExecutables + '/makeblastdb', '-in', fileReprFasta, '-out', databaseDir + '/TempDB', '-dbtype', 'prot']
     subprocess.call(makeDBArgs, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    profiling.end_stage(databaseStage)
+
+    # BLAST the query sequences against all the representative sequences.
+    blastStage = profiling.begin_stage('psiblast')
+    arguments = list(psiblastArguments)
+    if backendSettings.get('databaseSize'):
+        arguments[arguments.index('-dbsize') + 1] = str(backendSettings['databaseSize'])
+    resultsShards = sharded_BLAST(fileQueryFasta, parsedPDB + '/ResultsBLAST' + backendSettings['searchName'], databaseDir + '/TempDB', blastExecutables + '/psiblast',
+                                  backendSettings['blastThreads'], backendSettings['blastJobs'], backendSettings['blastShardSize'],
+                                  fileReprFasta, arguments)
+    profiling.end_stage(blastStage, len(resultsShards))
+    extractStage = profiling.begin_stage('extract')
+    processPSIoutput.main(resultsShards, outputLocation, memoryLimit=backendSettings['similarityMemory'])
+    profiling.end_stage(extractStage, len(resultsShards))
 
-    # BLAST chains.
-    resultsBLAST = parsedPDB + '/ResultsBLAST.txt'
-    if os.path.exists(resultsBLAST):
-        os.remove(resultsBLAST)
-    sequence_BLAST(fileReprFasta, resultsBLAST, databaseDir + '/TempDB', blastExecutables + '/psiblast.exe', 2)
-    processPSIoutput.main(resultsBLAST, fileSimilarity)
+def kmer_similarities(fileQueryFasta, fileReprFasta, outputLocation, backendSettings):
+    """Find the high identity similarities between sequence groupings with a minimizer index of the representative sequences.
+
+    :param fileQueryFasta:  The FASTA file of the sequence groupings to search for the similar groupings of.
+    :type fileQueryFasta:   string
+    :param fileReprFasta:   The FASTA file of the sequence groupings to search against.
+    :type fileReprFasta:    string
+    :param outputLocation:  The location where the similarity information will be written.
+    :type outputLocation:   string
+    :param backendSettings: The settings of the similarity search (see main).
+    :type backendSettings:  dictionary
+
+    """
+
+    kmerStage = profiling.begin_stage('kmer')
+    kmersimilarity.main(fileQueryFasta, fileReprFasta, outputLocation, minIdentity=backendSettings['kmerMinIdentity'],
+                        workers=backendSettings['workers'], memoryLimit=backendSettings['similarityMemory'])
+    profiling.end_stage(kmerStage)
+
+def sharded_BLAST(inputFile, shardDir, database, BLASTLoc, threadsPerJob, concurrentJobs, shardSize, databaseFasta, arguments=psiblastArguments):
+    """Split a FASTA file into shards, and BLAST the shards concurrently.
+
+    Each shard is named after a hash of its sequences, the sequences in the database and the PSI-BLAST arguments, and its results are only
+    kept once the BLASTing of it has finished. A shard that already has results (e.g. from a previous run that was interrupted) is therefore
+    not BLASTed again, unless the database or arguments have changed since (in which case the old results are removed).
+
+    :param inputFile:       The FASTA file which needs to be submitted to PSI-BLAST.
+    :type inputFile:        string
+    :param shardDir:        The directory to write the shards and the results of BLASTing them to.
+    :type shardDir:         string
+    :param database:        The database to BLAST the inputFile proteins against.
+    :type database:         string
+    :param BLASTLoc:        The location of the PSI-BLAST executable.
+    :type BLASTLoc:         string
+    :param threadsPerJob:   The number of threads each PSI-BLAST process uses.
+    :type threadsPerJob:    int
+    :param concurrentJobs:  The number of PSI-BLAST processes to run at once.
+    :type concurrentJobs:   int
+    :param shardSize:       The number of sequences in each shard.
+    :type shardSize:        int
+    :param databaseFasta:   The FASTA file that the database was made from.
+    :type databaseFasta:    string
+    :param arguments:       The arguments to run PSI-BLAST with (in addition to the query, output, database and number of threads).
+    :type arguments:        list
+    :returns :              The locations of the results of BLASTing each shard, in the order that the shards appear in inputFile.
+    :type :                 list
+
+    """
 
+    if not os.path.exists(shardDir):
+        os.mkdir(shardDir)
 
-def sequence_BLAST(inputFile, outputFile, database, BLASTLoc, cores):
+    # Determine the hash of the search that every shard is part of.
+    searchHash = hashlib.sha1('\t'.join(arguments).encode('utf-8'))
+    with open(databaseFasta, 'rb') as readDatabase:
+        while True:
+            block = readDatabase.read(1 << 20)
+            if not block:
+                break
+            searchHash.update(block)
+    searchHash = searchHash.hexdigest()
+
+    # Split the input file into shards.
+    shards = []
+    readInput = open(inputFile, 'r')
+    shardRecords = []
+    while True:
+        # Read the file two lines at a time.
+        identifierLine = readInput.readline()
+        sequence = readInput.readline()
+        if sequence:
+            shardRecords.append(identifierLine + sequence)
+        if shardRecords and (len(shardRecords) == shardSize or not sequence):
+            # Write out the shard once it is full, or the end of the file has been reached.
+            shardContent = ''.join(shardRecords)
+            shard = shardDir + '/Shard_' + hashlib.sha1((searchHash + shardContent).encode('utf-8')).hexdigest()[:16]
+            with open(shard + '.fasta', 'w') as writeShard:
+                writeShard.write(shardContent)
+            shards.append(shard)
+            shardRecords = []
+        if not sequence:
+            # Reached the end of the file when there is no second line.
+            break
+    readInput.close()
+
+    # Remove any shards left over from previous runs on different input, or against a different database.
+    currentFiles = set([os.path.basename(i) + j for i in shards for j in ['.fasta', '.txt']])
+    for i in os.listdir(shardDir):
+        if not i in currentFiles:
+            os.remove(shardDir + '/' + i)
+
+    # BLAST the shards that do not have results already.
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrentJobs) as executor:
+        jobs = dict((executor.submit(timed_BLAST, i + '.fasta', i + '.txt', database, BLASTLoc, threadsPerJob, arguments), i) for i in shards
+                    if not os.path.exists(i + '.txt'))
+        for i in concurrent.futures.as_completed(jobs):
+            shardTime = i.result()  # Raise any error that occurred while BLASTing.
+            profiling.record('BLAST shards', os.path.basename(jobs[i]), shardTime)
+
+    return [i + '.txt' for i in shards]
+
+def timed_BLAST(inputFile, outputFile, database, BLASTLoc, cores, arguments=psiblastArguments):
+    """BLAST a given input file (see sequence_BLAST), and determine how long it took.
+
+    :returns :  The time taken (in seconds) to BLAST the file.
+    :type :     float
+
+    """
+
+    startTime = time.perf_counter()
+    sequence_BLAST(inputFile, outputFile, database, BLASTLoc, cores, arguments)
+    return time.perf_counter() - startTime
+
+def sequence_BLAST(inputFile, outputFile, database, BLASTLoc, cores, arguments=psiblastArguments):
     """Will BLAST a given input file.
 
+    The results are written to a temporary file, and only moved to outputFile once the BLASTing has finished successfully.
+
     :param inputFile:   The FASTA file which needs to be submitted to PSI-BLAST.
     :type inputFile:    string
     :param outputFile:  The location to write the results of the BLASTing.
@@ -145,35 +455,22 @@ def sequence_BLAST(inputFile, outputFile, database, BLASTLoc, cores):
     :param BLASTLoc:    The location of the PSI-BLAST executable.
     :type BLASTLoc:     string
     :param cores:       The number of threads to create to run BLAST with.
-    :type cores:        character
+    :type cores:        int
+    :param arguments:   The arguments to run PSI-BLAST with (in addition to the query, output, database and number of threads).
+    :type arguments:    list
 
     """
 
     # Setup the parameters for the BLASTing.
-    argsPSI = []
-    argsPSI.append(BLASTLoc)
-    argsPSI.append('-query')
-    argsPSI.append(inputFile)
-    argsPSI.append('-out')
-    argsPSI.append(outputFile)
-    argsPSI.append('-evalue')
-    argsPSI.append('1')
-    argsPSI.append('-num_iterations')
-    argsPSI.append('3')
-    argsPSI.append('-gap_trigger')
-    argsPSI.append('18')
-    argsPSI.append('-num_descriptions')
-    argsPSI.append('10000')
-    argsPSI.append('-num_alignments')
-    argsPSI.append('10000')
-    argsPSI.append('-dbsize')
-    argsPSI.append('0')
-    argsPSI.append('-db')
-    argsPSI.append(database)
-    argsPSI.append('-outfmt')
-    argsPSI.append('7 qseqid sseqid pident length evalue')
-    argsPSI.append('-num_threads')
-    argsPSI.append(str(cores))
+    argsPSI = [BLASTLoc, '-query', inputFile, '-out', outputFile + '.tmp'] + arguments
+    argsPSI.extend(['-db', database, '-num_threads', str(cores)])
 
     # Perform the BLASTing.
-    subprocess.call(argsPSI)#, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
\ No newline at end of file
+    subprocess.check_call(argsPSI)#, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    os.replace(outputFile + '.tmp', outputFile)
+
+# The methods that can be used to find the similarities between sequence groupings. Each is called with the FASTA file of the sequence
+# groupings to search for, the FASTA file of the sequence groupings to search against, the location to write the similarities to (in the
+# format written by processPSIoutput) and a dictionary of settings. The searchName setting distinguishes the searches made in the same run
+# (e.g. for naming the files that the search works in).
+similarityBackends = {'psiblast' : psiblast_similarities, 'kmer' : kmer_similarities}